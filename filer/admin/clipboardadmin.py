@@ -3,24 +3,27 @@ from __future__ import absolute_import
 
 from django.conf.urls import url
 from django.contrib import admin
+from django.db import transaction
 from django.forms.models import modelform_factory
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from . import views
 from .. import settings as filer_settings
-from ..models import Clipboard, ClipboardItem, Folder, Image
+from ..models import BaseImage, Clipboard, ClipboardItem, File, Folder, Image
+from ..utils import metrics, thumbnail_warmup
+from ..utils.file_types import registry as file_type_registry
 from ..utils.files import (
     UploadException,
     handle_request_files_upload,
     handle_upload,
 )
-from ..utils.loader import load_model
 
 NO_FOLDER_ERROR = "Can't find folder to upload. Please refresh and try again"
 NO_PERMISSIONS_FOR_FOLDER = (
     "Can't use this folder, Permission Denied. Please select another folder."
 )
+TOO_MANY_FILES_ERROR = "Too many files in one batch, the limit is %d"
 
 
 # ModelAdmins
@@ -53,6 +56,12 @@ class ClipboardAdmin(admin.ModelAdmin):
             url(r'^operations/upload/no_folder/$',
                 ajax_upload,
                 name='filer-ajax_upload'),
+            url(r'^operations/upload_batch/(?P<folder_id>[0-9]+)/$',
+                self.admin_site.admin_view(ajax_upload_batch),
+                name='filer-ajax_upload_batch'),
+            url(r'^operations/upload_batch/no_folder/$',
+                self.admin_site.admin_view(ajax_upload_batch),
+                name='filer-ajax_upload_batch'),
         ] + super(ClipboardAdmin, self).get_urls()
 
     def get_model_perms(self, *args, **kwargs):
@@ -66,10 +75,9 @@ class ClipboardAdmin(admin.ModelAdmin):
         }
 
 
-@csrf_exempt
-def ajax_upload(request, folder_id=None):
+def get_upload_folder(request, folder_id):
     """
-    Receives an upload from the uploader. Receives only one file at a time.
+    Returns a tuple (folder, error) for the folder uploads should go to.
     """
     folder = None
     if folder_id:
@@ -77,48 +85,88 @@ def ajax_upload(request, folder_id=None):
             # Get folder
             folder = Folder.objects.get(pk=folder_id)
         except Folder.DoesNotExist:
-            return JsonResponse({'error': NO_FOLDER_ERROR})
+            return None, NO_FOLDER_ERROR
 
     # check permissions
     if folder and not folder.has_add_children_permission(request):
-        return JsonResponse({'error': NO_PERMISSIONS_FOR_FOLDER})
+        return None, NO_PERMISSIONS_FOR_FOLDER
+    return folder, None
+
+
+@csrf_exempt
+def ajax_upload(request, folder_id=None):
+    """
+    Receives an upload from the uploader. Receives only one file at a time.
+
+    The duration of each stage of the upload is reported to the
+    ``FILER_METRICS_HOOK`` and, if ``FILER_DEBUG`` is on, returned in the
+    ``timings`` of the response.
+    """
+    with metrics.collect('upload') as timer:
+        return _ajax_upload(request, folder_id, timer)
+
+
+def _ajax_upload(request, folder_id, timer):
+    folder, error = get_upload_folder(request, folder_id)
+    if error:
+        return JsonResponse({'error': error})
     try:
-        if len(request.FILES) == 1:
-            # dont check if request is ajax or not, just grab the file
-            upload, filename, is_raw = handle_request_files_upload(request)
-        else:
-            # else process the request as usual
-            upload, filename, is_raw = handle_upload(request)
+        with timer.span('receive'):
+            if len(request.FILES) == 1:
+                # dont check if request is ajax or not, just grab the file
+                upload, filename, is_raw = handle_request_files_upload(request)
+            else:
+                # else process the request as usual
+                upload, filename, is_raw = handle_upload(request)
         # TODO: Deprecated/refactor
         # Get clipboad
         # clipboard = Clipboard.objects.get_or_create(user=request.user)[0]
 
         # find the file type
-        for filer_class in filer_settings.FILER_FILE_MODELS:
-            FileSubClass = load_model(filer_class)
-            # TODO: What if there are more than one that qualify?
-            if FileSubClass.matches_file_type(filename, upload, request):
-                FileForm = modelform_factory(
-                    model=FileSubClass,
-                    fields=('original_filename', 'owner', 'file')
-                )
-                break
+        with timer.span('classify'):
+            FileSubClass, mime_type = file_type_registry.classify(
+                filename, upload, request)
+        if FileSubClass is None:
+            raise UploadException(
+                "AJAX request not valid: unsupported file type '%s'" % (
+                    mime_type,))
+        FileForm = modelform_factory(
+            model=FileSubClass,
+            fields=('original_filename', 'owner', 'file')
+        )
         uploadform = FileForm({'original_filename': filename,
                                'owner': request.user.pk},
                               {'file': upload})
-        if uploadform.is_valid():
+        # validation also computes the sha1 and the image dimensions, they
+        # are recorded as separate spans
+        with timer.span('validate'):
+            is_valid = uploadform.is_valid()
+        if is_valid:
             file_obj = uploadform.save(commit=False)
+            file_obj.mime_type = mime_type
             # Enforce the FILER_IS_PUBLIC_DEFAULT
             file_obj.is_public = filer_settings.FILER_IS_PUBLIC_DEFAULT
             file_obj.folder = folder
-            file_obj.save()
+            with timer.span('save'):
+                file_obj.save()
             # TODO: Deprecated/refactor
             # clipboard_item = ClipboardItem(
             #     clipboard=clipboard, file=file_obj)
             # clipboard_item.save()
 
+            thumbnail_180_options = {
+                'size': (180, 180),
+                'crop': True,
+                'upscale': True,
+            }
             # Try to generate thumbnails.
-            if not file_obj.icons:
+            with timer.span('icons'):
+                if type(file_obj) == Image:
+                    # the whole admin set at once, from a single decode
+                    file_obj.generate_admin_thumbnails(
+                        {'preview_180': thumbnail_180_options})
+                icons = file_obj.icons
+            if not icons:
                 # There is no point to continue, as we can't generate
                 # thumbnails for this file. Usual reasons: bad format or
                 # filename.
@@ -129,6 +177,9 @@ def ajax_upload(request, folder_id=None):
                     {'error': 'failed to generate icons for file'},
                     status=500,
                 )
+            if isinstance(file_obj, BaseImage) and filer_settings.FILER_THUMBNAIL_WARMUP:
+                # the thumbnails of the presets are generated by a job
+                thumbnail_warmup.warm_up_images([file_obj.pk], owner=request.user)
             thumbnail = None
             # Backwards compatibility: try to get specific icon size (32px)
             # first. Then try medium icon size (they are already sorted),
@@ -136,7 +187,7 @@ def ajax_upload(request, folder_id=None):
             for size in (['32'] +
                          filer_settings.FILER_ADMIN_ICON_SIZES[1::-1]):
                 try:
-                    thumbnail = file_obj.icons[size]
+                    thumbnail = icons[size]
                     break
                 except KeyError:
                     continue
@@ -149,15 +200,13 @@ def ajax_upload(request, folder_id=None):
             }
             # prepare preview thumbnail
             if type(file_obj) == Image:
-                thumbnail_180_options = {
-                    'size': (180, 180),
-                    'crop': True,
-                    'upscale': True,
-                }
-                thumbnail_180 = file_obj.file.get_thumbnail(
-                    thumbnail_180_options)
+                with timer.span('preview'):
+                    thumbnail_180 = file_obj.file.get_thumbnail(
+                        thumbnail_180_options)
                 data['thumbnail_180'] = thumbnail_180.url
                 data['original_image'] = file_obj.url
+            if filer_settings.FILER_DEBUG:
+                data['timings'] = dict(timer.timings, total=timer.elapsed())
             return JsonResponse(data)
         else:
             form_errors = '; '.join(['%s: %s' % (
@@ -170,3 +219,129 @@ def ajax_upload(request, folder_id=None):
                     form_errors,))
     except UploadException as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+def _save_upload(file_obj, errors):
+    """
+    Saves an uploaded file in its own savepoint. A failure is recorded in
+    ``errors`` and the stored file, if any, is deleted.
+    """
+    try:
+        with transaction.atomic():
+            file_obj.save()
+    except Exception as e:
+        errors[id(file_obj)] = e
+        file_obj.pk = file_obj.id = None
+        if file_obj.file._committed:
+            file_obj.file.storage.delete(file_obj.file.name)
+
+
+def ajax_upload_batch(request, folder_id=None):
+    """
+    Receives many files in one multipart request, e.g. from ingestion scripts.
+    Like every admin view it is CSRF protected: clients send the token in the
+    ``X-CSRFToken`` header or the ``csrfmiddlewaretoken`` field.
+
+    All files are classified and hashed first, then the rows are created in a
+    single transaction. Plain ``File`` rows are inserted with one bulk insert,
+    subclasses (like images) need their own ``save()`` because Django can't
+    bulk insert multi-table inherited models. Each of these saves (and the
+    plain files, if the bulk insert fails) runs in its own savepoint, so a bad
+    file doesn't fail the whole batch. No thumbnails are generated here, they
+    are created on first use (or by a job, see ``FILER_THUMBNAIL_WARMUP``).
+
+    Returns a JSON list with one result per uploaded file, in upload order,
+    with an ``error`` for the files which could not be saved.
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {'error': 'AJAX request not valid: must be POST'}, status=405)
+    folder, error = get_upload_folder(request, folder_id)
+    if error:
+        return JsonResponse({'error': error})
+    uploads = [upload for key in request.FILES
+               for upload in request.FILES.getlist(key)]
+    if len(uploads) > filer_settings.FILER_BATCH_UPLOAD_MAX_FILES:
+        return JsonResponse({'error': TOO_MANY_FILES_ERROR % (
+            filer_settings.FILER_BATCH_UPLOAD_MAX_FILES,)}, status=400)
+
+    owner = request.user if request.user.is_authenticated() else None
+    max_length = File._meta.get_field('original_filename').max_length
+    results = []
+    file_objs = []
+    for upload in uploads:
+        filename = upload.name
+        FileSubClass, mime_type = file_type_registry.classify(
+            filename, upload, request)
+        if FileSubClass is None:
+            results.append({
+                'label': filename,
+                'error': "unsupported file type '%s'" % (mime_type,),
+            })
+            continue
+        if len(filename) > max_length:
+            results.append({
+                'label': filename,
+                'error': 'file name is longer than %d characters' % (
+                    max_length,),
+            })
+            continue
+        file_obj = FileSubClass(
+            original_filename=filename,
+            owner=owner,
+            folder=folder,
+            is_public=filer_settings.FILER_IS_PUBLIC_DEFAULT,
+        )
+        # setting the file computes size, sha1 and the image dimensions
+        file_obj.file = upload
+        file_obj.mime_type = mime_type
+        file_objs.append(file_obj)
+        results.append(file_obj)
+
+    plain_files = [f for f in file_objs if type(f) is File]
+    errors = {}
+    with transaction.atomic():
+        for file_obj in file_objs:
+            if type(file_obj) is not File:
+                _save_upload(file_obj, errors)
+        if plain_files:
+            try:
+                with transaction.atomic():
+                    for file_obj in plain_files:
+                        file_obj.pre_save_polymorphic()
+                    File.objects.bulk_create(plain_files)
+            except Exception:
+                # find the bad files, the stored files are reused
+                for file_obj in plain_files:
+                    _save_upload(file_obj, errors)
+    file_objs = [f for f in file_objs if id(f) not in errors]
+    plain_files = [f for f in plain_files if id(f) not in errors]
+    if any(f.pk is None for f in plain_files):
+        # not all database backends return primary keys from bulk inserts
+        ids = dict(File.objects.filter(
+            file__in=[f.file.name for f in plain_files],
+        ).values_list('file', 'id'))
+        for file_obj in plain_files:
+            file_obj.pk = file_obj.id = ids.get(file_obj.file.name)
+
+    if filer_settings.FILER_THUMBNAIL_WARMUP:
+        thumbnail_warmup.warm_up_images(
+            [f.pk for f in file_objs if isinstance(f, BaseImage)], owner=request.user)
+
+    data = []
+    for result in results:
+        if id(result) in errors:
+            result = {
+                'label': result.original_filename,
+                'error': str(errors[id(result)]),
+            }
+        elif isinstance(result, File):
+            result = {
+                'file_id': result.pk,
+                'label': str(result),
+                'mime_type': result.mime_type,
+                'sha1': result.sha1,
+                'size': result.size,
+            }
+        data.append(result)
+    return JsonResponse({'files': data})
@@ -2,20 +2,19 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
-import itertools
-import os
 import re
+import warnings
 
 from django import forms
 from django.conf import settings as django_settings
 from django.conf.urls import url
 from django.contrib import messages
 from django.contrib.admin import helpers
-from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied, ValidationError
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.urlresolvers import reverse
 from django.db import models, router
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils.encoding import force_text
 from django.utils.html import escape
@@ -32,11 +31,13 @@ from ..models import (
     FolderPermission,
     FolderRoot,
     ImagesWithMissingData,
+    Job,
     UnsortedImages,
     tools,
 )
 from ..settings import FILER_IMAGE_MODEL, FILER_PAGINATE_BY
 from ..thumbnail_processors import normalize_subject_location
+from ..utils import bulk, jobs
 from ..utils.compatibility import (
     capfirst,
     get_delete_permission,
@@ -45,6 +46,7 @@ from ..utils.compatibility import (
 )
 from ..utils.filer_easy_thumbnails import FilerActionThumbnailer
 from ..utils.loader import load_model
+from ..utils.storage import copy_file
 from .forms import CopyFilesAndFoldersForm, RenameFilesForm, ResizeImagesForm
 from .patched.admin_utils import get_deleted_objects
 from .permissions import PrimitivePermissionAwareModelAdmin
@@ -248,6 +250,13 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                 self.admin_site.admin_view(self.directory_listing),
                 {'viewtype': 'unfiled_images'},
                 name='filer-directory_listing-unfiled_images'),
+
+            url(r'^jobs/(?P<job_id>\d+)/$',
+                self.admin_site.admin_view(self.job_progress),
+                name='filer-job_progress'),
+            url(r'^jobs/(?P<job_id>\d+)/status/$',
+                self.admin_site.admin_view(self.job_status),
+                name='filer-job_status'),
         ] + super(FolderAdmin, self).get_urls()
 
     # custom views
@@ -591,6 +600,58 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             del actions['delete_selected']
         return actions
 
+    def _get_job_items(self, files_queryset, folders_queryset):
+        """
+        Returns ``['file', pk]`` and ``['folder', pk]`` job items for the
+        selected files and folders.
+        """
+        items = [['file', pk] for pk in files_queryset.values_list('pk', flat=True)]
+        items.extend(['folder', pk] for pk in folders_queryset.values_list('pk', flat=True))
+        return items
+
+    def _submit_job(self, request, handler, items, arguments, title,
+                    success_message, message_params=None, count=None):
+        """
+        Processes ``items`` of an action with ``handler`` (a job handler of
+        this module). With ``FILER_BACKGROUND_JOBS`` the job is queued and the
+        user redirected to its progress page, otherwise it is run right away.
+        """
+        job = jobs.submit('%s.%s' % (__name__, handler), items, arguments,
+                          owner=request.user, title=title)
+        if job.pk is not None:
+            self.message_user(request, _("The operation was queued and will be processed in the background."))
+            return HttpResponseRedirect(
+                reverse('admin:filer-job_progress', args=(job.pk,)))
+        for error in job.get_errors():
+            messages.error(request, error['message'])
+        params = dict(message_params or {})
+        params['count'] = job.affected if count is None else count
+        self.message_user(request, success_message % params)
+        return None
+
+    def _get_job(self, request, job_id):
+        job = get_object_or_404(Job, pk=job_id)
+        if not request.user.is_superuser and job.owner_id != request.user.pk:
+            raise PermissionDenied
+        return job
+
+    def job_progress(self, request, job_id):
+        job = self._get_job(request, job_id)
+        context = self.admin_site.each_context(request)
+        context.update({
+            "title": job.title or _("Job"),
+            "breadcrumbs_action": job.title,
+            "job": job,
+            "status_url": reverse('admin:filer-job_status', args=(job.pk,)),
+            "opts": self.model._meta,
+            "root_path": reverse('admin:index'),
+            "app_label": self.model._meta.app_label,
+        })
+        return render(request, "admin/filer/job_progress.html", context)
+
+    def job_status(self, request, job_id):
+        return JsonResponse(self._get_job(request, job_id).as_dict())
+
     def move_to_clipboard(self, request, files_queryset, folders_queryset):
         """
         Action which moves the selected files and files in selected folders
@@ -650,31 +711,21 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         check_files_edit_permissions(request, files_queryset)
         check_folder_edit_permissions(request, folders_queryset)
 
-        # We define it like that so that we can modify it inside the
-        # set_files function
-        files_count = [0]
-
-        def set_files(files):
-            for f in files:
-                if f.is_public != set_public:
-                    f.is_public = set_public
-                    f.save()
-                    files_count[0] += 1
-
-        def set_folders(folders):
-            for f in folders:
-                set_files(f.files)
-                set_folders(f.children.all())
-
-        set_files(files_queryset)
-        set_folders(folders_queryset)
+        folder_ids = bulk.get_folder_ids_recursive(folders_queryset)
+        files = File.objects.filter(
+            models.Q(pk__in=files_queryset.values('pk')) |
+            models.Q(folder__in=folder_ids))
+        items = list(files.order_by('pk').values_list('pk', flat=True))
 
         if set_public:
-            self.message_user(request, _("Successfully disabled permissions for %(count)d files.") % {"count": files_count[0], })
+            title = _("Disable permissions for selected files")
+            message = _("Successfully disabled permissions for %(count)d files.")
         else:
-            self.message_user(request, _("Successfully enabled permissions for %(count)d files.") % {"count": files_count[0], })
-
-        return None
+            title = _("Enable permissions for selected files")
+            message = _("Successfully enabled permissions for %(count)d files.")
+        return self._submit_job(
+            request, 'set_public_job', items, {'set_public': set_public},
+            title, message)
 
     def files_set_private(self, request, files_queryset, folders_queryset):
         return self.files_set_public_or_private(request, False, files_queryset,
@@ -734,26 +785,23 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             n = files_queryset.count() + folders_queryset.count()
             if n:
                 # delete all explicitly selected files
-                for f in files_queryset:
-                    self.log_deletion(request, f, force_text(f))
-                    f.delete()
+                items = self._get_job_items(files_queryset, folders_queryset.none())
                 # delete all files in all selected folders and their children
                 # This would happen automatically by ways of the delete
                 # cascade, but then the individual .delete() methods won't be
                 # called and the files won't be deleted from the filesystem.
-                folder_ids = set()
-                for folder in folders_queryset:
-                    folder_ids.add(folder.id)
-                    folder_ids.update(
-                        folder.get_descendants().values_list('id', flat=True))
-                for f in File.objects.filter(folder__in=folder_ids):
-                    self.log_deletion(request, f, force_text(f))
-                    f.delete()
+                folder_ids = bulk.get_folder_ids_recursive(folders_queryset)
+                items.extend(
+                    ['file', pk] for pk in File.objects.filter(
+                        folder__in=folder_ids).values_list('pk', flat=True))
                 # delete all folders
-                for f in folders_queryset:
-                    self.log_deletion(request, f, force_text(f))
-                    f.delete()
-                self.message_user(request, _("Successfully deleted %(count)d files and/or folders.") % {"count": n, })
+                items.extend(
+                    ['folder', pk] for pk in folders_queryset.values_list('pk', flat=True))
+                return self._submit_job(
+                    request, 'delete_job', items, {},
+                    _("Delete files and/or folders"),
+                    _("Successfully deleted %(count)d files and/or folders."),
+                    count=n)
             # Return None to display the change list page again.
             return None
 
@@ -872,14 +920,6 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         root_folders = Folder.objects.filter(parent__isnull=True).order_by('name')
         return list(self._list_all_destination_folders_recursive(request, folders_queryset, current_folder, root_folders, allow_self, 0))
 
-    def _move_files_and_folders_impl(self, files_queryset, folders_queryset, destination):
-        for f in files_queryset:
-            f.folder = destination
-            f.save()
-        for f in folders_queryset:
-            f.move_to(destination, 'last-child')
-            f.save()
-
     def move_files_and_folders(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
         app_label = opts.app_label
@@ -901,16 +941,18 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                 raise PermissionDenied
             # We count only topmost files and folders here
             n = files_queryset.count() + folders_queryset.count()
-            conflicting_names = [folder.name for folder in Folder.objects.filter(parent=destination, name__in=folders_queryset.values('name'))]
+            conflicting_names = bulk.get_move_conflicts(
+                folders_queryset.values_list('pk', flat=True), destination.pk)
             if conflicting_names:
                 messages.error(request, _("Folders with names %s already exist at the selected "
                                           "destination") % ", ".join(conflicting_names))
             elif n:
-                self._move_files_and_folders_impl(files_queryset, folders_queryset, destination)
-                self.message_user(request, _("Successfully moved %(count)d files and/or folders to folder '%(destination)s'.") % {
-                    "count": n,
-                    "destination": destination,
-                })
+                items = self._get_job_items(files_queryset, folders_queryset)
+                return self._submit_job(
+                    request, 'move_job', items, {'destination': destination.pk},
+                    _("Move files and/or folders"),
+                    _("Successfully moved %(count)d files and/or folders to folder '%(destination)s'."),
+                    {"destination": destination})
             return None
 
         context = self.admin_site.each_context(request)
@@ -934,45 +976,12 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
 
     move_files_and_folders.short_description = ugettext_lazy("Move selected files and/or folders")
 
-    def _rename_file(self, file_obj, form_data, counter, global_counter):
-        original_basename, original_extension = os.path.splitext(file_obj.original_filename)
-        if file_obj.name:
-            current_basename, current_extension = os.path.splitext(file_obj.name)
-        else:
-            current_basename = ""
-            current_extension = ""
-        file_obj.name = form_data['rename_format'] % {
-            'original_filename': file_obj.original_filename,
-            'original_basename': original_basename,
-            'original_extension': original_extension,
-            'current_filename': file_obj.name or "",
-            'current_basename': current_basename,
-            'current_extension': current_extension,
-            'current_folder': getattr(file_obj.folder, 'name', ''),
-            'counter': counter + 1,  # 1-based
-            'global_counter': global_counter + 1,  # 1-based
-        }
-        file_obj.save()
-
-    def _rename_files(self, files, form_data, global_counter):
-        n = 0
-        for f in sorted(files):
-            self._rename_file(f, form_data, n, global_counter + n)
-            n += 1
-        return n
-
-    def _rename_folder(self, folder, form_data, global_counter):
-        return self._rename_files_impl(folder.files.all(), folder.children.all(), form_data, global_counter)
-
-    def _rename_files_impl(self, files_queryset, folders_queryset, form_data, global_counter):
-        n = 0
-
-        for f in folders_queryset:
-            n += self._rename_folder(f, form_data, global_counter + n)
-
-        n += self._rename_files(files_queryset, form_data, global_counter + n)
-
-        return n
+    def _rename_files_impl(self, files_queryset, folders_queryset, form_data):
+        """
+        Returns the job items to rename the selected files, as
+        ``[pk, new name]``.
+        """
+        return bulk.plan_rename(files_queryset, folders_queryset, form_data['rename_format'])
 
     def rename_files(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
@@ -988,10 +997,11 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             form = RenameFilesForm(request.POST)
             if form.is_valid():
                 if files_queryset.count() + folders_queryset.count():
-                    n = self._rename_files_impl(files_queryset, folders_queryset, form.cleaned_data, 0)
-                    self.message_user(request, _("Successfully renamed %(count)d files.") % {
-                        "count": n,
-                    })
+                    items = self._rename_files_impl(files_queryset, folders_queryset, form.cleaned_data)
+                    return self._submit_job(
+                        request, 'rename_job', items, {},
+                        _("Rename files"),
+                        _("Successfully renamed %(count)d files."))
                 return None
         else:
             form = RenameFilesForm()
@@ -1017,75 +1027,6 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
 
     rename_files.short_description = ugettext_lazy("Rename files")
 
-    def _generate_new_filename(self, filename, suffix):
-        basename, extension = os.path.splitext(filename)
-        return basename + suffix + extension
-
-    def _copy_file(self, file_obj, destination, suffix, overwrite):
-        if overwrite:
-            # Not yet implemented as we have to find a portable (for different storage backends) way to overwrite files
-            raise NotImplementedError
-
-        # We are assuming here that we are operating on an already saved database objects with current database state available
-
-        filename = self._generate_new_filename(file_obj.file.name, suffix)
-
-        # Due to how inheritance works, we have to set both pk and id to None
-        file_obj.pk = None
-        file_obj.id = None
-        file_obj.save()
-        file_obj.folder = destination
-        file_obj._file_data_changed_hint = False  # no need to update size, sha1, etc.
-        file_obj.file = file_obj._copy_file(filename)
-        file_obj.original_filename = self._generate_new_filename(file_obj.original_filename, suffix)
-        file_obj.save()
-
-    def _copy_files(self, files, destination, suffix, overwrite):
-        for f in files:
-            self._copy_file(f, destination, suffix, overwrite)
-        return len(files)
-
-    def _get_available_name(self, destination, name):
-        count = itertools.count(1)
-        original = name
-        while destination.contains_folder(name):
-            name = "%s_%s" % (original, next(count))
-        return name
-
-    def _copy_folder(self, folder, destination, suffix, overwrite):
-        if overwrite:
-            # Not yet implemented as we have to find a portable (for different storage backends) way to overwrite files
-            raise NotImplementedError
-
-        # TODO: Should we also allow not to overwrite the folder if it exists, but just copy into it?
-
-        # TODO: Is this a race-condition? Would this be a problem?
-        foldername = self._get_available_name(destination, folder.name)
-
-        old_folder = Folder.objects.get(pk=folder.pk)
-
-        # Due to how inheritance works, we have to set both pk and id to None
-        folder.pk = None
-        folder.id = None
-        folder.name = foldername
-        folder.insert_at(destination, 'last-child', True)  # We save folder here
-
-        for perm in FolderPermission.objects.filter(folder=old_folder):
-            perm.pk = None
-            perm.id = None
-            perm.folder = folder
-            perm.save()
-
-        return 1 + self._copy_files_and_folders_impl(old_folder.files.all(), old_folder.children.all(), folder, suffix, overwrite)
-
-    def _copy_files_and_folders_impl(self, files_queryset, folders_queryset, destination, suffix, overwrite):
-        n = self._copy_files(files_queryset, destination, suffix, overwrite)
-
-        for f in folders_queryset:
-            n += self._copy_folder(f, destination, suffix, overwrite)
-
-        return n
-
     def copy_files_and_folders(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
         app_label = opts.app_label
@@ -1109,11 +1050,16 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                     raise PermissionDenied
                 if files_queryset.count() + folders_queryset.count():
                     # We count all files and folders here (recursivelly)
-                    n = self._copy_files_and_folders_impl(files_queryset, folders_queryset, destination, form.cleaned_data['suffix'], False)
-                    self.message_user(request, _("Successfully copied %(count)d files and/or folders to folder '%(destination)s'.") % {
-                        "count": n,
-                        "destination": destination,
-                    })
+                    items = self._get_job_items(files_queryset, folders_queryset)
+                    arguments = {
+                        'destination': destination.pk,
+                        'suffix': form.cleaned_data['suffix'],
+                    }
+                    return self._submit_job(
+                        request, 'copy_job', items, arguments,
+                        _("Copy files and/or folders"),
+                        _("Successfully copied %(count)d files and/or folders to folder '%(destination)s'."),
+                        {"destination": destination})
                 return None
         else:
             form = CopyFilesAndFoldersForm()
@@ -1187,6 +1133,13 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
     def _resize_image(self, image, form_data):
         original_width = float(image.width)
         original_height = float(image.height)
+        if File.objects.filter(file=image.file.name, is_public=image.is_public).exclude(pk=image.pk).exists():
+            # other files share the stored file (see
+            # filer.utils.bulk.collapse_duplicates()), resize a copy of it
+            storage = image.file.storages['public' if image.is_public else 'private']
+            image.file = copy_file(
+                storage, image.file.name, storage,
+                image._meta.get_field('file').generate_filename(image, image.original_filename))
         thumbnailer = FilerActionThumbnailer(file=image.file, name=image.file.name, source_storage=image.file.source_storage, thumbnail_storage=image.file.source_storage)
         # This should overwrite the original image
         new_image = thumbnailer.get_thumbnail({
@@ -1212,24 +1165,16 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
             image.subject_location = "%d,%d" % (new_x, new_y)
             image.save()
 
-    def _resize_images(self, files, form_data):
-        n = 0
-        for f in files:
-            if isinstance(f, Image):
-                self._resize_image(f, form_data)
-                n += 1
-        return n
-
-    def _resize_folder(self, folder, form_data):
-        return self._resize_images_impl(folder.files.all(), folder.children.all(), form_data)
-
-    def _resize_images_impl(self, files_queryset, folders_queryset, form_data):
-        n = self._resize_images(files_queryset, form_data)
+    def _resize_images_impl(self, files_queryset, folders_queryset):
+        """
+        Returns the job items (image pks) to resize the selected images.
+        """
+        items = [f.pk for f in files_queryset if isinstance(f, Image)]
 
         for f in folders_queryset:
-            n += self._resize_folder(f, form_data)
+            items.extend(self._resize_images_impl(f.files.all(), f.children.all()))
 
-        return n
+        return items
 
     def resize_images(self, request, files_queryset, folders_queryset):
         opts = self.model._meta
@@ -1251,8 +1196,14 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
                     form.cleaned_data['upscale'] = form.cleaned_data['thumbnail_option'].upscale
                 if files_queryset.count() + folders_queryset.count():
                     # We count all files here (recursivelly)
-                    n = self._resize_images_impl(files_queryset, folders_queryset, form.cleaned_data)
-                    self.message_user(request, _("Successfully resized %(count)d images.") % {"count": n, })
+                    items = self._resize_images_impl(files_queryset, folders_queryset)
+                    arguments = dict(
+                        (key, form.cleaned_data[key])
+                        for key in ('width', 'height', 'crop', 'upscale'))
+                    return self._submit_job(
+                        request, 'resize_job', items, arguments,
+                        _("Resize images"),
+                        _("Successfully resized %(count)d images."))
                 return None
         else:
             form = ResizeImagesForm()
@@ -1278,3 +1229,146 @@ class FolderAdmin(PrimitivePermissionAwareModelAdmin):
         return render(request, "admin/filer/folder/choose_images_resize_options.html", context)
 
     resize_images.short_description = ugettext_lazy("Resize selected images")
+
+    # Deprecated, the actions are processed by the job handlers below and
+    # filer.utils.bulk and don't call these methods anymore. They will be
+    # removed in the next release.
+
+    def _move_files_and_folders_impl(self, files_queryset, folders_queryset, destination):
+        _warn_deprecated('_move_files_and_folders_impl')
+        bulk.move_files([f.pk for f in files_queryset], destination.pk)
+        bulk.move_folders([f.pk for f in folders_queryset], destination.pk)
+
+    def _rename_file(self, file_obj, form_data, counter, global_counter):
+        _warn_deprecated('_rename_file')
+        file_obj.name = bulk.format_file_name(
+            form_data['rename_format'], file_obj.name, file_obj.original_filename or '',
+            getattr(file_obj.folder, 'name', ''), counter, global_counter)
+        file_obj.save()
+
+    def _rename_files(self, files, form_data, global_counter):
+        _warn_deprecated('_rename_files')
+        return bulk.rename_files([
+            (f.pk, bulk.format_file_name(
+                form_data['rename_format'], f.name, f.original_filename or '',
+                getattr(f.folder, 'name', ''), n, global_counter + n))
+            for n, f in enumerate(sorted(files))])
+
+    def _rename_folder(self, folder, form_data, global_counter):
+        _warn_deprecated('_rename_folder')
+        return bulk.rename_files(bulk.plan_rename(
+            File.objects.none(), [folder], form_data['rename_format'], global_counter))
+
+    def _generate_new_filename(self, filename, suffix):
+        _warn_deprecated('_generate_new_filename')
+        return bulk._generate_new_filename(filename, suffix)
+
+    def _copy_file(self, file_obj, destination, suffix, overwrite):
+        _warn_deprecated('_copy_file')
+        return _copy([file_obj], [], destination, suffix, overwrite)
+
+    def _copy_files(self, files, destination, suffix, overwrite):
+        _warn_deprecated('_copy_files')
+        return _copy(files, [], destination, suffix, overwrite)
+
+    def _get_available_name(self, destination, name):
+        _warn_deprecated('_get_available_name')
+        return bulk._get_available_names(destination.pk, [name])[0]
+
+    def _copy_folder(self, folder, destination, suffix, overwrite):
+        _warn_deprecated('_copy_folder')
+        return _copy([], [folder], destination, suffix, overwrite)
+
+    def _copy_files_and_folders_impl(self, files_queryset, folders_queryset, destination, suffix, overwrite):
+        _warn_deprecated('_copy_files_and_folders_impl')
+        return _copy(files_queryset, folders_queryset, destination, suffix, overwrite)
+
+    def _resize_images(self, files, form_data):
+        _warn_deprecated('_resize_images')
+        n = 0
+        for f in files:
+            if isinstance(f, Image):
+                self._resize_image(f, form_data)
+                n += 1
+        return n
+
+    def _resize_folder(self, folder, form_data):
+        _warn_deprecated('_resize_folder')
+        items = self._resize_images_impl(folder.files.all(), folder.children.all())
+        for image in File.objects.filter(pk__in=items):
+            self._resize_image(image, form_data)
+        return len(items)
+
+
+def _warn_deprecated(name):
+    warnings.warn(
+        "FolderAdmin.%s() is deprecated and will be removed in the next "
+        "release, the folder actions are processed by the job handlers of "
+        "filer.admin.folderadmin and filer.utils.bulk." % name,
+        DeprecationWarning, stacklevel=3)
+
+
+def _copy(files, folders, destination, suffix, overwrite):
+    if overwrite:
+        # Not yet implemented as we have to find a portable (for different storage backends) way to overwrite files
+        raise NotImplementedError
+    return bulk.copy_files_and_folders(
+        [f.pk for f in files], [f.pk for f in folders], destination.pk, suffix)
+
+
+def _get_folder_admin():
+    from django.contrib import admin
+    folder_admin = admin.site._registry.get(Folder)
+    if not isinstance(folder_admin, FolderAdmin):
+        folder_admin = FolderAdmin(Folder, admin.site)
+    return folder_admin
+
+
+# Job handlers of the folder actions, see filer.utils.jobs
+
+@jobs.batch_handler
+def set_public_job(job, items):
+    changed, errors = bulk.set_files_public(items, job.get_arguments()['set_public'])
+    for pk, error in sorted(errors.items()):
+        job.add_error(pk, force_text(error))
+    return changed
+
+
+@jobs.batch_handler
+def delete_job(job, items):
+    file_ids = [pk for kind, pk in items if kind == 'file']
+    folder_ids = [pk for kind, pk in items if kind == 'folder']
+    return (bulk.delete_files(file_ids, job.owner_id) +
+            bulk.delete_folders(folder_ids, job.owner_id))
+
+
+@jobs.batch_handler
+def move_job(job, items):
+    destination_id = Folder.objects.get(pk=job.get_arguments()['destination']).pk
+    file_ids = [pk for kind, pk in items if kind == 'file']
+    folder_ids = [pk for kind, pk in items if kind == 'folder']
+    moved = (bulk.move_files(file_ids, destination_id) +
+             bulk.move_folders(folder_ids, destination_id))
+    if moved < len(items):
+        # report the missing items, the batch is retried one by one
+        raise ObjectDoesNotExist(_("Some of the selected files and/or folders no longer exist."))
+    return moved
+
+
+@jobs.batch_handler
+def copy_job(job, items):
+    arguments = job.get_arguments()
+    return bulk.copy_files_and_folders(
+        [pk for kind, pk in items if kind == 'file'],
+        [pk for kind, pk in items if kind == 'folder'],
+        arguments['destination'], arguments['suffix'])
+
+
+@jobs.batch_handler
+def rename_job(job, items):
+    return bulk.rename_files(items)
+
+
+def resize_job(job, pk):
+    _get_folder_admin()._resize_image(File.objects.get(pk=pk), job.get_arguments())
+    return 1
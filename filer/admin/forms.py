@@ -8,7 +8,9 @@ from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import ugettext as _
 
-from ..models import ThumbnailOption
+from .. import settings as filer_settings
+from ..models import Folder, ThumbnailOption
+from ..utils import thumbnail_warmup
 from ..utils.files import get_valid_filename
 
 
@@ -73,3 +75,28 @@ class ResizeImagesForm(forms.Form, AsPWithHelpMixin):
             else:
                 raise ValidationError(_('Resize parameters must be choosen.'))
         return self.cleaned_data
+
+
+class ThumbnailOptionForm(forms.ModelForm):
+    warm_up = forms.BooleanField(
+        required=False, label=_("generate thumbnails"),
+        help_text=_("Generate the thumbnails of the existing images (in the background if background jobs are enabled)."))
+    warm_up_folders = forms.ModelMultipleChoiceField(
+        queryset=Folder.objects.all(), required=False, label=_("folders"),
+        help_text=_("Only generate the thumbnails of images in these folders and their subfolders."))
+
+    class Meta:
+        model = ThumbnailOption
+        fields = ('name', 'width', 'height', 'crop', 'upscale', 'formats')
+
+    def clean(self):
+        cleaned_data = super(ThumbnailOptionForm, self).clean()
+        if cleaned_data.get('warm_up') and not filer_settings.FILER_BACKGROUND_JOBS:
+            # it would run during the request
+            count = thumbnail_warmup.get_images(cleaned_data.get('warm_up_folders')).count()
+            if count > thumbnail_warmup.MAX_SYNCHRONOUS_IMAGES:
+                self.add_error('warm_up', _(
+                    "Without background jobs, the thumbnails can only be generated "
+                    "for up to %(max)d images (%(count)d selected).") % {
+                        'max': thumbnail_warmup.MAX_SYNCHRONOUS_IMAGES, 'count': count})
+        return cleaned_data
@@ -1,7 +1,46 @@
 from __future__ import absolute_import
 
 from django.contrib import admin
+from django.contrib.admin.options import IS_POPUP_VAR
+from django.core.urlresolvers import reverse
+from django.http import HttpResponseRedirect
+from django.utils.translation import ugettext as _
+
+from ..utils import thumbnail_warmup
+from .forms import ThumbnailOptionForm
 
 
 class ThumbnailOptionAdmin(admin.ModelAdmin):
     list_display = ('name', 'width', 'height')
+    form = ThumbnailOptionForm
+
+    def save_model(self, request, obj, form, change):
+        super(ThumbnailOptionAdmin, self).save_model(request, obj, form, change)
+        obj._warm_up_job = None
+        if form.cleaned_data.get('warm_up'):
+            obj._warm_up_job = thumbnail_warmup.warm_up_option(
+                obj, form.cleaned_data.get('warm_up_folders'), owner=request.user)
+
+    def _warm_up_response(self, request, obj, response):
+        """
+        Redirects to the progress page of a queued warm-up job.
+        """
+        job = getattr(obj, '_warm_up_job', None)
+        if job is None:
+            return response
+        if job.pk is None:
+            self.message_user(request, _("Generated the thumbnails of %(count)d images.") % {
+                'count': job.affected})
+            return response
+        self.message_user(request, _("The thumbnails will be generated in the background."))
+        if IS_POPUP_VAR in request.POST:
+            return response
+        return HttpResponseRedirect(reverse('admin:filer-job_progress', args=(job.pk,)))
+
+    def response_add(self, request, obj, post_url_continue=None):
+        response = super(ThumbnailOptionAdmin, self).response_add(request, obj, post_url_continue)
+        return self._warm_up_response(request, obj, response)
+
+    def response_change(self, request, obj):
+        response = super(ThumbnailOptionAdmin, self).response_change(request, obj)
+        return self._warm_up_response(request, obj, response)
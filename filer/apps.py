@@ -8,3 +8,7 @@ from django.utils.translation import ugettext_lazy as _
 class FilerConfig(AppConfig):
     name = 'filer'
     verbose_name = _("Filer")
+
+    def ready(self):
+        from .utils.file_types import registry
+        registry.build()
@@ -13,7 +13,12 @@ from easy_thumbnails import fields as easy_thumbnails_fields
 from easy_thumbnails import files as easy_thumbnails_files
 
 from .. import settings as filer_settings
-from ..utils.filer_easy_thumbnails import ThumbnailerNameMixin
+from ..utils import metrics
+from ..utils.filer_easy_thumbnails import (
+    ThumbnailerNameMixin,
+    ThumbnailIndexMixin,
+    ThumbnailSetMixin,
+)
 
 STORAGES = {
     'public': filer_settings.FILER_PUBLICMEDIA_STORAGE,
@@ -67,7 +72,7 @@ class MultiStorageFileDescriptor(FileDescriptor):
                 getattr(instance, callback_attr)()
 
 
-class MultiStorageFieldFile(ThumbnailerNameMixin,
+class MultiStorageFieldFile(ThumbnailIndexMixin, ThumbnailSetMixin, ThumbnailerNameMixin,
                             easy_thumbnails_files.ThumbnailerFieldFile):
     def __init__(self, instance, field, name):
         """
@@ -119,7 +124,8 @@ class MultiStorageFieldFile(ThumbnailerNameMixin,
 
     def save(self, name, content, save=True):
         content.seek(0)  # Ensure we upload the whole file
-        super(MultiStorageFieldFile, self).save(name, content, save)
+        with metrics.span('storage_write'):
+            super(MultiStorageFieldFile, self).save(name, content, save)
 
 
 class MultiStorageFileField(easy_thumbnails_fields.ThumbnailerField):
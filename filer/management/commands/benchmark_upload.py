@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import os
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test.client import RequestFactory
+
+from ... import settings as filer_settings
+from ...admin.clipboardadmin import ajax_upload
+from ...models.filemodels import File
+from ...models.foldermodels import Folder
+from ...utils.compatibility import PILImage
+
+SIZE_SUFFIXES = {'k': 1024, 'm': 1024 * 1024, 'g': 1024 * 1024 * 1024}
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def parse_dimensions(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def synthetic_image(dimensions):
+    # random noise compresses badly, which is close to a real photo
+    width, height = dimensions
+    image = PILImage.frombytes('RGB', dimensions, os.urandom(width * height * 3))
+    data = BytesIO()
+    image.save(data, 'JPEG', quality=90)
+    return data.getvalue()
+
+
+class Command(BaseCommand):
+    help = ("Uploads synthetic files through the upload view and reports the "
+            "p50/p99 duration of each stage of the upload.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=20,
+            help='Number of uploads per size (default: 20)')
+        parser.add_argument(
+            '--sizes', default='',
+            help='Comma separated sizes of generic files, e.g. 10k,1m')
+        parser.add_argument(
+            '--dimensions', default='',
+            help='Comma separated dimensions of JPEG images, e.g. 800x600')
+        parser.add_argument(
+            '--user', default=None,
+            help='Username of the uploading user (default: first superuser)')
+        parser.add_argument(
+            '--keep', action='store_true', default=False,
+            help='Keep the uploaded files instead of deleting them')
+
+    def get_user(self, username):
+        User = get_user_model()
+        try:
+            if username:
+                return User.objects.get(**{User.USERNAME_FIELD: username})
+            return User.objects.filter(is_superuser=True).order_by('pk')[0]
+        except (User.DoesNotExist, IndexError):
+            raise CommandError('No user to upload the files with.')
+
+    def get_samples(self, options):
+        samples = []
+        for size in filter(None, options['sizes'].split(',')):
+            samples.append(('file %s' % size.strip(), 'benchmark.dat',
+                            os.urandom(parse_size(size))))
+        for dimensions in filter(None, options['dimensions'].split(',')):
+            samples.append(('image %s' % dimensions.strip(), 'benchmark.jpg',
+                            synthetic_image(parse_dimensions(dimensions))))
+        if not samples:
+            raise CommandError('Pass --sizes and/or --dimensions.')
+        return samples
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        samples = self.get_samples(options)
+        folder = Folder.objects.create(name='filer upload benchmark')
+        url = reverse('admin:filer-ajax_upload', kwargs={'folder_id': folder.pk})
+        factory = RequestFactory()
+        collected = []
+
+        def hook(operation, timings):
+            collected.append(dict(timings))
+
+        old_hook = filer_settings.FILER_METRICS_HOOK
+        filer_settings.FILER_METRICS_HOOK = hook
+        try:
+            for label, filename, content in samples:
+                del collected[:]
+                for i in range(options['count']):
+                    request = factory.post(url, {
+                        'file': SimpleUploadedFile(filename, content),
+                    })
+                    request.user = user
+                    response = ajax_upload(request, folder_id=folder.pk)
+                    if response.status_code != 200:
+                        raise CommandError('Upload failed: %s' % response.content)
+                self.report(label, len(content), collected)
+        finally:
+            filer_settings.FILER_METRICS_HOOK = old_hook
+            if not options['keep']:
+                for file_obj in File.objects.filter(folder=folder):
+                    file_obj.delete()
+                folder.delete()
+
+    def report(self, label, size, collected):
+        stages = []
+        for timings in collected:
+            for stage in timings:
+                if stage not in stages:
+                    stages.append(stage)
+        self.stdout.write('%s (%d bytes, %d uploads)' % (label, size, len(collected)))
+        self.stdout.write('  %-16s %10s %10s' % ('stage', 'p50 ms', 'p99 ms'))
+        for stage in stages:
+            values = [t.get(stage, 0.0) * 1000 for t in collected]
+            self.stdout.write('  %-16s %10.2f %10.2f' % (
+                stage, percentile(values, 0.5), percentile(values, 0.99)))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from ...models import File
+from ...utils import bulk
+
+
+def reclaimable_bytes(files):
+    """
+    Returns the bytes freed by letting the ``files`` (with the same sha1)
+    share one stored file per visibility.
+    """
+    blobs = set((f.file.name, f.is_public) for f in files if f.file.name)
+    size = max(f._file_size or 0 for f in files)
+    return sum(
+        size * max(0, len([b for b in blobs if b[1] == is_public]) - 1)
+        for is_public in (True, False))
+
+
+class Command(BaseCommand):
+    help = ("Reports files with the same content (sha1) and the disk space "
+            "their stored files use more than necessary.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--collapse',
+            action='store_true',
+            dest='collapse',
+            default=False,
+            help='Make duplicate files share one stored file and remove the others')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of duplicate groups fetched at a time (default: 1000)')
+
+    def handle(self, *args, **options):
+        groups = reclaimable = freed = 0
+        for sha1, files in File.objects.iter_duplicates(options['batch_size']):
+            groups += 1
+            group_reclaimable = reclaimable_bytes(files)
+            reclaimable += group_reclaimable
+            self.stdout.write('{0}: {1} files, {2} reclaimable'.format(
+                sha1, len(files), filesizeformat(group_reclaimable)))
+            if int(options['verbosity']) >= 2:
+                for file_obj in files:
+                    self.stdout.write('    {0} ({1})'.format(file_obj.pk, file_obj.file.name))
+            if options['collapse'] and group_reclaimable:
+                with transaction.atomic():
+                    freed += bulk.collapse_duplicates(files)
+        self.stdout.write('{0} groups of duplicates, {1} reclaimable'.format(
+            groups, filesizeformat(reclaimable)))
+        if options['collapse']:
+            self.stdout.write('Freed {0}'.format(filesizeformat(freed)))
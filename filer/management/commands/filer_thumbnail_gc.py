@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import posixpath
+import time
+
+from django.core.management.base import BaseCommand
+from easy_thumbnails.conf import settings as thumbnail_settings
+from easy_thumbnails.models import Thumbnail
+from easy_thumbnails.utils import get_storage_hash
+
+from ...models import File, ThumbnailOption
+from ...settings import FILER_IMAGE_MODEL
+from ...utils import thumbnail_index
+from ...utils.filer_easy_thumbnails import thumbnail_to_original_filename
+from ...utils.loader import load_model
+from ...utils.storage import iter_files
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+ORPHANED = 'orphaned'
+UNKNOWN_OPTIONS = 'unknown options'
+
+
+def get_preset_options():
+    """
+    Returns the thumbnail options in use: the admin thumbnails and icons, the
+    ``ThumbnailOption`` presets and the ``THUMBNAIL_ALIASES``.
+    """
+    options = list(Image()._icon_options().values())
+    options.extend(Image.DEFAULT_THUMBNAILS.values())
+    options.extend(option.as_dict for option in ThumbnailOption.objects.all())
+    for aliases in (thumbnail_settings.THUMBNAIL_ALIASES or {}).values():
+        options.extend(aliases.values())
+    return options
+
+
+def get_base_name(thumbnail_name):
+    """
+    Returns the name of a thumbnail without directory, high resolution infix
+    and extension, which differs between the formats of a thumbnail.
+    """
+    name = posixpath.splitext(posixpath.basename(thumbnail_name))[0]
+    infix = thumbnail_settings.THUMBNAIL_HIGHRES_INFIX
+    if infix and name.endswith(infix):
+        name = name[:-len(infix)]
+    return name
+
+
+def get_preset_names(image, preset_options):
+    """
+    Returns the base names (see ``get_base_name()``) of the thumbnails of
+    ``image`` with the preset options, with and without its subject location.
+    """
+    thumbnailer = image.file
+    names = set()
+    for options in preset_options:
+        for opts in (options, dict(options, subject_location=image.subject_location)):
+            names.add(get_base_name(thumbnailer.get_thumbnail_name(thumbnailer.get_options(opts))))
+    return names
+
+
+def iter_batches(thumbnail_storage, base_dir, batch_size):
+    """
+    Yields lists of ``(thumbnail name, source name)`` of the thumbnails in
+    ``thumbnail_storage``, listing one directory at a time.
+    """
+    batch = []
+    for name in iter_files(thumbnail_storage, base_dir):
+        source_name = thumbnail_to_original_filename(
+            posixpath.relpath(name, base_dir) if base_dir else name)
+        if source_name:
+            batch.append((name, source_name))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def find_garbage(batch, preset_options=None):
+    """
+    Yields ``(thumbnail name, source name, reason)`` for the thumbnails of a
+    batch whose source is not a file anymore, or (unless ``preset_options`` is
+    None) which have options not among ``preset_options``. Runs one query for
+    the files and one for the images of the batch.
+    """
+    source_names = set(source_name for name, source_name in batch)
+    live = set(File.objects.non_polymorphic().filter(
+        file__in=source_names).values_list('file', flat=True))
+    preset_names = {}
+    if preset_options is not None:
+        for image in Image.objects.filter(file__in=live):
+            preset_names[image.file.name] = get_preset_names(image, preset_options)
+    for name, source_name in batch:
+        if source_name not in live:
+            yield name, source_name, ORPHANED
+        elif preset_options is not None and \
+                get_base_name(name) not in preset_names.get(source_name, ()):
+            yield name, source_name, UNKNOWN_OPTIONS
+
+
+class Command(BaseCommand):
+    help = ("Deletes thumbnails of files which don't exist anymore and, with "
+            "--unused, thumbnails with options not in use.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help="Only list the thumbnails to delete, don't delete them")
+        parser.add_argument(
+            '--unused',
+            action='store_true',
+            dest='unused',
+            default=False,
+            help='Also delete thumbnails with options other than the admin '
+                 'thumbnails, the thumbnail options presets and '
+                 'THUMBNAIL_ALIASES (including those of templates and '
+                 'filer_srcset, they are generated again when used)')
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Maximum number of thumbnails deleted per second (default: unlimited)')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of thumbnails checked at a time (default: 1000)')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        dry_run = options['dry_run']
+        rate = options['rate']
+        preset_options = get_preset_options() if options['unused'] else None
+        field = File._meta.get_field('file')
+        started = time.time()
+        deleted = 0
+        for key in ('public', 'private'):
+            thumbnail_storage = field.thumbnail_storages[key]
+            base_dir = field.thumbnail_options[key].get('base_dir', '')
+            counts = {ORPHANED: 0, UNKNOWN_OPTIONS: 0}
+            reclaimed = 0
+            for batch in iter_batches(thumbnail_storage, base_dir, options['batch_size']):
+                names = []
+                source_names = set()
+                for name, source_name, reason in find_garbage(batch, preset_options):
+                    try:
+                        reclaimed += thumbnail_storage.size(name)
+                    except Exception:
+                        pass
+                    if verbosity >= 2 or dry_run and verbosity >= 1:
+                        self.stdout.write('{0} ({1})'.format(name, reason))
+                    counts[reason] += 1
+                    if dry_run:
+                        continue
+                    if rate:
+                        # spread the deletions, so the storage isn't flooded
+                        delay = started + deleted / rate - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                    thumbnail_storage.delete(name)
+                    deleted += 1
+                    names.append(name)
+                    source_names.add(source_name)
+                if names:
+                    # the thumbnail caches must not list them anymore
+                    Thumbnail.objects.filter(
+                        storage_hash=get_storage_hash(thumbnail_storage), name__in=names).delete()
+                    thumbnail_index.clear(thumbnail_storage, source_names)
+            self.stdout.write('{0} {1} {2} thumbnails ({3} orphaned, {4} with unknown options), reclaiming {5} bytes'.format(
+                'Would delete' if dry_run else 'Deleted',
+                counts[ORPHANED] + counts[UNKNOWN_OPTIONS], key, counts[ORPHANED],
+                counts[UNKNOWN_OPTIONS], reclaimed))
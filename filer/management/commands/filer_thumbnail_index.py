@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import posixpath
+
+from django.core.management.base import BaseCommand, CommandError
+from easy_thumbnails.models import Source
+
+from ...models import File
+from ...utils import thumbnail_index
+from ...utils.filer_easy_thumbnails import thumbnail_to_original_filename
+
+
+def iter_batches(files, batch_size):
+    """
+    Yields lists of the names of ``batch_size`` files each, one query per
+    batch.
+    """
+    start = 0
+    rows = files.order_by('pk').values_list('pk', 'file')
+    while True:
+        batch = list(rows.filter(pk__gt=start)[:batch_size])
+        if not batch:
+            break
+        yield [name for pk, name in batch]
+        start = batch[-1][0]
+
+
+def list_thumbnails(thumbnail_storage, base_dir, source_names):
+    """
+    Returns the thumbnails of ``source_names`` in ``thumbnail_storage`` by
+    source name, listing each of their directories once.
+    """
+    thumbnails = dict((name, []) for name in source_names)
+    for directory in set(posixpath.dirname(name) for name in source_names):
+        path = posixpath.join(base_dir, directory) if base_dir else directory
+        try:
+            filenames = thumbnail_storage.listdir(path)[1]
+        except (IOError, OSError):
+            # no thumbnails yet
+            continue
+        for filename in filenames:
+            source_name = thumbnail_to_original_filename(posixpath.join(directory, filename))
+            if source_name in thumbnails:
+                thumbnails[source_name].append(posixpath.join(path, filename))
+    return thumbnails
+
+
+def get_entries(source_storage, thumbnail_storage, base_dir, source_names):
+    """
+    Returns the index entries of ``source_names``, without the thumbnails
+    older than their source. Sources without a modification time are left
+    out, their entries are loaded when they are used.
+    """
+    source_modtimes = thumbnail_index.get_modified_times(source_storage, source_names, model=Source)
+    thumbnails = list_thumbnails(thumbnail_storage, base_dir, list(source_modtimes))
+    thumbnail_modtimes = thumbnail_index.get_modified_times(
+        thumbnail_storage, [name for names in thumbnails.values() for name in names])
+    entries = {}
+    for source_name, source_modtime in source_modtimes.items():
+        entries[source_name] = (source_modtime, dict(
+            (name, None) for name in thumbnails[source_name]
+            if thumbnail_modtimes.get(name) and thumbnail_modtimes[name] >= source_modtime))
+    return entries
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds the index of existing thumbnails (see "
+            "FILER_THUMBNAIL_INDEX_CACHE) from listings of the thumbnail storages.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of files indexed at a time (default: 1000)')
+
+    def handle(self, *args, **options):
+        if thumbnail_index.get_cache() is None:
+            raise CommandError('The thumbnail index is disabled, set FILER_THUMBNAIL_INDEX_CACHE')
+        field = File._meta.get_field('file')
+        for key, is_public in (('public', True), ('private', False)):
+            source_storage = field.storages[key]
+            thumbnail_storage = field.thumbnail_storages[key]
+            base_dir = field.thumbnail_options[key].get('base_dir', '')
+            # files without thumbnails get an empty entry, so they are not
+            # looked up in the database
+            files = File.objects.non_polymorphic().filter(
+                is_public=is_public).exclude(file__isnull=True).exclude(file='')
+            count = indexed = 0
+            for batch in iter_batches(files, options['batch_size']):
+                entries = get_entries(source_storage, thumbnail_storage, base_dir, batch)
+                thumbnail_index.set_entries(thumbnail_storage, entries)
+                count += len(entries)
+                indexed += sum(len(thumbnails) for modtime, thumbnails in entries.values())
+            self.stdout.write('Indexed {0} thumbnails of {1} {2} files'.format(
+                indexed, count, key))
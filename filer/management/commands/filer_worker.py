@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...utils import jobs
+
+
+class Command(BaseCommand):
+    help = ("Processes the background jobs queued by filer admin actions "
+            "(see FILER_BACKGROUND_JOBS).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Process the queued jobs and exit instead of waiting for new ones')
+        parser.add_argument(
+            '--sleep', type=float, default=5,
+            help='Seconds to wait before looking for new jobs (default: 5)')
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Number of items processed between progress updates '
+                 '(default: FILER_JOB_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = jobs.run_pending_jobs(batch_size=options['batch_size'])
+            if count and int(options['verbosity']) >= 1:
+                self.stdout.write('Processed {0} jobs'.format(count))
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
@@ -1,29 +1,232 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
 
-from django.core.management.base import BaseCommand
-from filer.models.imagemodels import Image
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from easy_thumbnails.models import Source
+
+from ...models import Folder
+from ...settings import FILER_IMAGE_MODEL
+from ...utils.loader import load_model
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+
+def parse_since(value):
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError('Invalid date: {0}'.format(value))
+        since = datetime.combine(date, datetime.min.time())
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.get_current_timezone())
+    return since
+
+
+def get_admin_thumbnail_options():
+    options = list(Image()._icon_options().values())
+    options.extend(Image.DEFAULT_THUMBNAILS.values())
+    return options
+
+
+def admin_thumbnail_count():
+    """
+    Returns the number of distinct admin thumbnails of an image (some icons
+    are also default thumbnails).
+    """
+    return len(set(tuple(sorted(options.items())) for options in get_admin_thumbnail_options()))
+
+
+def get_images(options):
+    """
+    Returns the images selected by the filter options of the command.
+    """
+    images = Image.objects.exclude(file__isnull=True).exclude(file='')
+    if options.get('folder'):
+        try:
+            folder = Folder.objects.get(pk=options['folder'])
+        except Folder.DoesNotExist:
+            raise CommandError('Folder {0} does not exist'.format(options['folder']))
+        images = images.filter(folder__in=folder.get_descendants(include_self=True))
+    if options.get('modified_since'):
+        images = images.filter(modified_at__gte=parse_since(options['modified_since']))
+    if options.get('missing_only'):
+        # images with fewer cached thumbnails than the admin needs
+        complete = Source.objects.annotate(
+            thumbnail_count=Count('thumbnails')
+        ).filter(thumbnail_count__gte=admin_thumbnail_count()).values('name')
+        images = images.exclude(file__in=complete)
+    return images
+
+
+def exclude_ranges(images, ranges):
+    for start, end in ranges:
+        images = images.exclude(pk__gt=start, pk__lte=end)
+    return images
+
+
+def iter_chunks(images, chunk_size):
+    """
+    Yields ``(start, end)`` pk ranges (start excluded) of ``chunk_size``
+    images each, one query per chunk.
+    """
+    start = 0
+    pks = images.order_by('pk').values_list('pk', flat=True)
+    while True:
+        chunk = list(pks.filter(pk__gt=start)[:chunk_size])
+        if not chunk:
+            break
+        yield start, chunk[-1]
+        start = chunk[-1]
+
+
+def merge_ranges(ranges):
+    """
+    Merges adjacent and overlapping ``(start, end)`` ranges.
+    """
+    merged = []
+    for start, end in sorted(tuple(r) for r in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = [merged[-1][0], max(end, merged[-1][1])]
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as checkpoint:
+        return json.load(checkpoint)['done']
+
+
+def write_checkpoint(path, ranges):
+    # write and rename, so an interrupted run never leaves a broken file
+    tmp_path = '{0}.tmp'.format(path)
+    with open(tmp_path, 'w') as checkpoint:
+        json.dump({'done': ranges}, checkpoint)
+    os.rename(tmp_path, path)
+
+
+def generate_chunk(options, chunk, done=()):
+    """
+    Generates the thumbnails of the images in the ``(start, end)`` pk range,
+    except for those in the ``done`` ranges, and returns
+    ``(chunk, processed, failures)``.
+    """
+    start, end = chunk
+    images = get_images(options).filter(pk__gt=start, pk__lte=end)
+    images = exclude_ranges(images, done).order_by('pk')
+    expected = len(get_admin_thumbnail_options())
+    processed = 0
+    failures = []
+    for image in images.iterator():
+        try:
+            if len(image.generate_admin_thumbnails()) < expected:
+                failures.append((image.pk, 'Some thumbnails could not be generated'))
+        except Exception as e:
+            failures.append((image.pk, str(e)))
+        processed += 1
+    return chunk, processed, failures
+
+
+def _init_worker():
+    # forked workers must not share the connections of the parent
+    for connection in connections.all():
+        connection.close()
+
+
+def _generate_chunk(args):
+    return generate_chunk(*args)
 
 
 class Command(BaseCommand):
+    help = ("Generates the admin thumbnails and icons of images, in parallel "
+            "with --workers. Progress is saved to --checkpoint, so an "
+            "interrupted run can be resumed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker processes (default: 1, no subprocesses)')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of images per chunk of work (default: 500)')
+        parser.add_argument(
+            '--checkpoint',
+            help='File recording the processed chunks. If it exists, the '
+                 'images processed by a previous run are skipped')
+        parser.add_argument(
+            '--folder', type=int,
+            help='Only images in the folder with this id and its subfolders')
+        parser.add_argument(
+            '--modified-since',
+            help='Only images modified since this date (YYYY-MM-DD[ HH:MM])')
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            dest='missing_only',
+            default=False,
+            help='Only images whose thumbnails are not all in the thumbnail cache')
 
     def handle(self, *args, **options):
         """
         Generates image thumbnails
 
-        NOTE: To keep memory consumption stable avoid iteration over the Image queryset
+        Images are processed in chunks of consecutive pks, each chunk with a
+        single query and on its own in a worker. Every worker process opens
+        its own database connections.
         """
-        pks = Image.objects.all().values_list('id', flat=True)
-        total = len(pks)
-        for idx, pk in enumerate(pks):
-            image = None
-            try:
-                image = Image.objects.get(pk=pk)
-                self.stdout.write(u'Processing image {0} / {1} {2}'.format(idx + 1, total, image))
-                self.stdout.flush()
-                image.thumbnails
-                image.icons
-            except IOError as e:
-                self.stderr.write('Failed to generate thumbnails: {0}'.format(str(e)))
-                self.stderr.flush()
-            finally:
-                del image
+        filters = dict((key, options[key]) for key in ('folder', 'modified_since', 'missing_only'))
+        verbosity = int(options['verbosity'])
+        checkpoint = options['checkpoint']
+        done = merge_ranges(read_checkpoint(checkpoint))
+        images = exclude_ranges(get_images(filters), done)
+        total = images.count()
+        # a chunk may span ranges done by a previous run
+        chunks = (
+            (filters, (start, end), [r for r in done if r[0] < end and r[1] > start])
+            for start, end in iter_chunks(images, options['chunk_size']))
+        if options['workers'] > 1:
+            # the workers are forked, they must not inherit open connections
+            _init_worker()
+            pool = multiprocessing.Pool(options['workers'], initializer=_init_worker)
+            results = pool.imap_unordered(_generate_chunk, chunks)
+        else:
+            pool = None
+            results = (generate_chunk(*args) for args in chunks)
+
+        started = time.time()
+        processed = failed = 0
+        try:
+            for chunk, count, failures in results:
+                processed += count
+                failed += len(failures)
+                for pk, error in failures:
+                    self.stderr.write('Failed to generate thumbnails of image {0}: {1}'.format(pk, error))
+                if checkpoint:
+                    done = merge_ranges(done + [chunk])
+                    write_checkpoint(checkpoint, done)
+                if verbosity >= 1:
+                    elapsed = time.time() - started
+                    rate = processed / elapsed if elapsed else 0
+                    eta = timedelta(seconds=int((total - processed) / rate)) if rate else '?'
+                    self.stdout.write('Processed {0} / {1} images ({2:.1f}/s, ETA {3})'.format(
+                        processed, total, rate, eta))
+                    self.stdout.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self.stdout.write('Generated thumbnails of {0} images, {1} failed'.format(processed, failed))
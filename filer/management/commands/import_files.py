@@ -2,19 +2,22 @@
 from __future__ import absolute_import, unicode_literals
 
 import os
-from optparse import make_option
 
 from django.core.files import File as DjangoFile
-from django.core.management.base import BaseCommand, NoArgsCommand
+from django.core.management.base import BaseCommand
 
 from ...models.filemodels import File
 from ...models.foldermodels import Folder
 from ...settings import FILER_IMAGE_MODEL, FILER_IS_PUBLIC_DEFAULT
 from ...utils.compatibility import upath
+from ...utils.executor import StorageExecutor
 from ...utils.loader import load_model
 
 Image = load_model(FILER_IMAGE_MODEL)
 
+# number of files of a directory written to the storage concurrently
+IMPORT_BATCH_SIZE = 100
+
 
 class FileImporter(object):
     def __init__(self, * args, **kwargs):
@@ -29,31 +32,83 @@ class FileImporter(object):
         """
         Create a File or an Image into the given folder
         """
-        try:
-            iext = os.path.splitext(file_obj.name)[1].lower()
-        except:
-            iext = ''
-        if iext in ['.jpg', '.jpeg', '.png', '.gif']:
-            obj, created = Image.objects.get_or_create(
-                original_filename=file_obj.name,
-                file=file_obj,
+        return self.import_files([file_obj], folder)[0]
+
+    def import_files(self, file_objs, folder):
+        """
+        Gets or creates Files or Images for a list of files into the given
+        folder. Existing files are matched by their original filename with one
+        query, the new files are written to the storage concurrently.
+        """
+        existing = dict(
+            (obj.original_filename, obj) for obj in File.objects.filter(
+                original_filename__in=[file_obj.name for file_obj in file_objs],
                 folder=folder,
-                is_public=FILER_IS_PUBLIC_DEFAULT)
+                is_public=FILER_IS_PUBLIC_DEFAULT))
+        objs = []
+        for file_obj in file_objs:
+            obj = existing.get(file_obj.name)
+            created = obj is None
             if created:
-                self.image_created += 1
-        else:
-            obj, created = File.objects.get_or_create(
-                original_filename=file_obj.name,
-                file=file_obj,
-                folder=folder,
-                is_public=FILER_IS_PUBLIC_DEFAULT)
+                try:
+                    iext = os.path.splitext(file_obj.name)[1].lower()
+                except:
+                    iext = ''
+                model = Image if iext in ['.jpg', '.jpeg', '.png', '.gif'] else File
+                obj = model(
+                    original_filename=file_obj.name,
+                    file=file_obj,
+                    folder=folder,
+                    is_public=FILER_IS_PUBLIC_DEFAULT)
+            objs.append((obj, created))
+        new_objs = [obj for obj, created in objs if created]
+
+        with StorageExecutor() as executor:
+            for obj in new_objs:
+                field = obj._meta.get_field('file')
+                executor.save(obj.file.storage,
+                              field.generate_filename(obj, obj.file.name),
+                              obj.file.file, max_length=field.max_length)
+            names = executor.results(return_exceptions=True)
+            errors = [name for name in names if isinstance(name, Exception)]
+            if errors:
+                # no rows will refer to the files stored already
+                self._delete_stored(executor, zip(new_objs, names))
+                raise errors[0]
+
+        saved = 0
+        try:
+            for obj, name in zip(new_objs, names):
+                # already stored, only the rows are left to be saved
+                obj.file.name = name
+                obj.file._committed = True
+                obj.save()
+                saved += 1
+        except Exception:
+            with StorageExecutor() as executor:
+                self._delete_stored(executor, zip(new_objs[saved:], names[saved:]))
+            raise
+
+        for obj, created in objs:
             if created:
-                self.file_created += 1
-        if self.verbosity >= 2:
-            print("file_created #%s / image_created #%s -- file : %s -- created : %s" % (self.file_created,
-                                                        self.image_created,
-                                                        obj, created))
-        return obj
+                if isinstance(obj, Image):
+                    self.image_created += 1
+                else:
+                    self.file_created += 1
+            if self.verbosity >= 2:
+                print("file_created #%s / image_created #%s -- file : %s -- created : %s" % (self.file_created,
+                                                            self.image_created,
+                                                            obj, created))
+        return [obj for obj, created in objs]
+
+    def _delete_stored(self, executor, stored):
+        """
+        Deletes the files of ``(obj, name)`` stored for rows which failed.
+        """
+        for obj, name in stored:
+            if not isinstance(name, Exception):
+                executor.delete(obj.file.storage, name)
+        executor.results(return_exceptions=True)
 
     def get_or_create_folder(self, folder_names):
         """
@@ -87,7 +142,8 @@ class FileImporter(object):
         path = os.path.normpath(upath(path))
         if base_folder:
             base_folder = os.path.normpath(upath(base_folder))
-            print("The directory structure will be imported in %s" % (base_folder,))
+            if self.verbosity >= 1:
+                print("The directory structure will be imported in %s" % (base_folder,))
         if self.verbosity >= 1:
             print("Import the folders and files in %s" % (path,))
         root_folder_name = os.path.basename(path)
@@ -100,15 +156,22 @@ class FileImporter(object):
             else:
                 folder_names = [root_folder_name] + rel_folders
             folder = self.get_or_create_folder(folder_names)
-            for file_obj in files:
-                dj_file = DjangoFile(open(os.path.join(root, file_obj), mode='rb'),
-                                     name=file_obj)
-                self.import_file(file_obj=dj_file, folder=folder)
+            for start in range(0, len(files), IMPORT_BATCH_SIZE):
+                dj_files = [
+                    DjangoFile(open(os.path.join(root, file_obj), mode='rb'),
+                               name=file_obj)
+                    for file_obj in files[start:start + IMPORT_BATCH_SIZE]
+                ]
+                try:
+                    self.import_files(dj_files, folder=folder)
+                finally:
+                    for dj_file in dj_files:
+                        dj_file.close()
         if self.verbosity >= 1:
             print(('folder_created #%s / file_created #%s / ' + 'image_created #%s') % (self.folder_created, self.file_created, self.image_created))
 
 
-class Command(NoArgsCommand):
+class Command(BaseCommand):
     """
     Import directory structure into the filer ::
 
@@ -116,19 +179,18 @@ class Command(NoArgsCommand):
         manage.py --path=/tmp/assets/news --folder=images
     """
 
-    option_list = BaseCommand.option_list + (
-        make_option('--path',
+    def add_arguments(self, parser):
+        parser.add_argument('--path',
             action='store',
             dest='path',
             default=False,
-            help='Import files located in the path into django-filer'),
-        make_option('--folder',
+            help='Import files located in the path into django-filer')
+        parser.add_argument('--folder',
             action='store',
             dest='base_folder',
             default=False,
-            help='Specify the destination folder in which the directory structure should be imported'),
-    )
+            help='Specify the destination folder in which the directory structure should be imported')
 
-    def handle_noargs(self, **options):
+    def handle(self, *args, **options):
         file_importer = FileImporter(**options)
         file_importer.walker()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ...settings import FILER_IMAGE_MODEL
+from ...utils.image_dimensions import get_storage_image_dimensions
+from ...utils.loader import load_model
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+
+class Command(BaseCommand):
+    help = ("Reads width and height of images from the file headers and "
+            "stores them on the image rows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Update all images, not only those without dimensions')
+
+    def handle(self, *args, **options):
+        """
+        Only the first few kilobytes of each image are read (ranged reads if
+        the storage supports them) and the rows are updated without calling
+        ``save()``.
+        """
+        images = Image.objects.exclude(file__isnull=True).exclude(file='')
+        if not options['all']:
+            images = images.filter(Q(_width__isnull=True) | Q(_height__isnull=True))
+        storages = Image._meta.get_field('file').storages
+        rows = images.order_by('pk').values_list('pk', 'file', 'is_public')
+        updated = failed = 0
+        for pk, name, is_public in rows.iterator():
+            storage = storages['public' if is_public else 'private']
+            try:
+                dimensions = get_storage_image_dimensions(storage, name)
+            except (IOError, OSError) as e:
+                dimensions = None
+                self.stderr.write('Failed to read {0}: {1}'.format(name, e))
+            if dimensions is None:
+                failed += 1
+                continue
+            width, height = dimensions
+            Image.objects.filter(pk=pk).update(_width=width, _height=height)
+            updated += 1
+            if int(options['verbosity']) >= 2:
+                self.stdout.write('{0}: {1}x{2}'.format(name, width, height))
+        self.stdout.write('Updated {0} images, {1} failed'.format(updated, failed))
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 07:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0007_auto_20161016_1055'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='mime_type',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='mime type'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 08:06
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('filer', '0008_file_mime_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(blank=True, default='', max_length=255, verbose_name='title')),
+                ('handler', models.CharField(max_length=255, verbose_name='handler')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10, verbose_name='status')),
+                ('arguments', models.TextField(blank=True, default='{}', verbose_name='arguments')),
+                ('items', models.TextField(blank=True, default='[]', verbose_name='items')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='total')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='position')),
+                ('affected', models.PositiveIntegerField(default=0, verbose_name='affected objects')),
+                ('errors', models.TextField(blank=True, default='[]', verbose_name='errors')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='started at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='finished at')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='filer_jobs', to=settings.AUTH_USER_MODEL, verbose_name='owner')),
+            ],
+            options={
+                'verbose_name': 'job',
+                'verbose_name_plural': 'jobs',
+                'ordering': ('created_at', 'pk'),
+            },
+        ),
+    ]
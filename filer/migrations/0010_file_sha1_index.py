@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 08:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0009_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='sha1',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=40, verbose_name='sha1'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.8 on 2026-10-19 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filer', '0010_file_sha1_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailoption',
+            name='formats',
+            field=models.CharField(blank=True, default='', help_text='preferred output formats, comma separated (e.g. "webp"). Browsers not accepting them get the default format.', max_length=100, verbose_name='formats'),
+        ),
+    ]
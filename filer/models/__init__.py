@@ -4,5 +4,6 @@ from .clipboardmodels import *  # flake8: noqa
 from .filemodels import *  # flake8: noqa
 from .foldermodels import *  # flake8: noqa
 from .imagemodels import *  # flake8: noqa
+from .jobmodels import *  # flake8: noqa
 from .thumbnailoptionmodels import *   # flake8: noqa
 from .virtualitems import *  # flake8: noqa
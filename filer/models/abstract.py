@@ -2,15 +2,15 @@
 from __future__ import absolute_import
 
 import logging
-import os
 
 from django.db import models
-from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 
 from .. import settings as filer_settings
+from ..utils import file_types, lazy_thumbnails, metrics
 from ..utils.compatibility import GTE_DJANGO_1_10, PILImage
 from ..utils.filer_easy_thumbnails import FilerThumbnailer
+from ..utils.image_dimensions import get_image_dimensions
 from ..utils.pil_exif import get_exif_for_file
 from .filemodels import File
 
@@ -29,6 +29,7 @@ class BaseImage(File):
     }
     file_type = 'Image'
     _icon = "image"
+    mime_types = ('image/jpeg', 'image/png', 'image/gif')
 
     _height = models.IntegerField(null=True, blank=True)
     _width = models.IntegerField(null=True, blank=True)
@@ -46,13 +47,9 @@ class BaseImage(File):
 
     @classmethod
     def matches_file_type(cls, iname, ifile, request):
-        # This was originally in admin/clipboardadmin.py  it was inside of a try
-        # except, I have moved it here outside of a try except because I can't
-        # figure out just what kind of exception this could generate... all it was
-        # doing for me was obscuring errors...
-        # --Dave Butler <croepha@gmail.com>
-        iext = os.path.splitext(iname)[1].lower()
-        return iext in ['.jpg', '.jpeg', '.png', '.gif']
+        mime_type = file_types.guess_mime_type(
+            iname, file_types.read_head(ifile))
+        return file_types.mime_type_matches(mime_type, cls.mime_types)
 
     def file_data_changed(self, post_init=False):
         attrs_updated = super(BaseImage, self).file_data_changed(post_init=post_init)
@@ -62,9 +59,14 @@ class BaseImage(File):
                     imgfile = self.file.file
                 except ValueError:
                     imgfile = self.file_ptr.file
-                imgfile.seek(0)
-                self._width, self._height = PILImage.open(imgfile).size
-                imgfile.seek(0)
+                with metrics.span('dimensions'):
+                    # reading the header is enough for the common formats
+                    dimensions = get_image_dimensions(imgfile)
+                    if dimensions is None:
+                        imgfile.seek(0)
+                        dimensions = PILImage.open(imgfile).size
+                        imgfile.seek(0)
+                self._width, self._height = dimensions
             except Exception:
                 self._width, self._height = None, None
         return attrs_updated
@@ -136,13 +138,30 @@ class BaseImage(File):
     def height(self):
         return self._height or 0
 
-    def _generate_thumbnails(self, required_thumbnails):
+    def _generate_thumbnails(self, required_thumbnails, lazy=None):
         _thumbnails = {}
-        for name, opts in six.iteritems(required_thumbnails):
+        names = list(required_thumbnails)
+        options = [dict(required_thumbnails[name], subject_location=self.subject_location)
+                   for name in names]
+        if lazy is None:
+            lazy = filer_settings.FILER_LAZY_THUMBNAILS
+        thumbs = [None] * len(names)
+        if not lazy:
             try:
-                opts.update({'subject_location': self.subject_location})
-                thumb = self.file.get_thumbnail(opts)
-                _thumbnails[name] = thumb.url
+                # decodes the image once for all missing thumbnails
+                thumbs = self.file.get_thumbnail_set(options)
+            except Exception:
+                # generate them one by one, to find the failing ones
+                pass
+        for name, opts, thumb in zip(names, options, thumbs):
+            try:
+                if lazy:
+                    # missing thumbnails are generated when they are requested
+                    _thumbnails[name] = lazy_thumbnails.get_thumbnail_url(self, opts)
+                else:
+                    if thumb is None:
+                        thumb = self.file.get_thumbnail(opts)
+                    _thumbnails[name] = thumb.url
             except Exception as e:
                 # catch exception and manage it. We can re-raise it for debugging
                 # purposes and/or just logging it, provided user configured
@@ -153,20 +172,43 @@ class BaseImage(File):
                     raise
         return _thumbnails
 
-    @property
-    def icons(self):
-        required_thumbnails = dict(
+    def get_thumbnail_urls(self, required_thumbnails, lazy=None):
+        """
+        Returns the urls of ``required_thumbnails`` (a dictionary of thumbnail
+        options by name). Missing thumbnails are generated together, or lazily
+        if ``lazy`` (defaults to ``FILER_LAZY_THUMBNAILS``). Failing
+        thumbnails are left out.
+        """
+        return self._generate_thumbnails(required_thumbnails, lazy)
+
+    def _icon_options(self):
+        return dict(
             (size, {'size': (int(size), int(size)),
                     'crop': True,
-                    'upscale': True,
-                    'subject_location': self.subject_location})
+                    'upscale': True})
             for size in filer_settings.FILER_ADMIN_ICON_SIZES)
-        return self._generate_thumbnails(required_thumbnails)
+
+    @property
+    def icons(self):
+        return self._generate_thumbnails(self._icon_options())
 
     @property
     def thumbnails(self):
         return self._generate_thumbnails(BaseImage.DEFAULT_THUMBNAILS)
 
+    def generate_admin_thumbnails(self, extra_thumbnails=None):
+        """
+        Generates the icons, the ``DEFAULT_THUMBNAILS`` and
+        ``extra_thumbnails`` (a dictionary of thumbnail options) at once,
+        decoding the image only once (even with ``FILER_LAZY_THUMBNAILS``).
+        Returns their urls by name.
+        """
+        required_thumbnails = dict(
+            ('icon_%s' % size, options) for size, options in self._icon_options().items())
+        required_thumbnails.update(BaseImage.DEFAULT_THUMBNAILS)
+        required_thumbnails.update(extra_thumbnails or {})
+        return self._generate_thumbnails(required_thumbnails, lazy=False)
+
     @property
     def easy_thumbnails_thumbnailer(self):
         tn = FilerThumbnailer(
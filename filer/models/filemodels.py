@@ -8,7 +8,6 @@ from datetime import datetime
 
 from django.conf import settings
 from django.core import urlresolvers
-from django.core.files.base import ContentFile
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -16,7 +15,9 @@ from django.utils.translation import ugettext_lazy as _
 from . import mixins
 from .. import settings as filer_settings
 from ..fields.multistorage_file import MultiStorageFileField
+from ..utils import file_types, metrics
 from ..utils.compatibility import python_2_unicode_compatible
+from ..utils.storage import change_visibility, copy_file
 from .foldermodels import Folder
 
 try:
@@ -28,16 +29,43 @@ except ImportError:
 
 
 class FileManager(PolymorphicManager):
+    def duplicate_groups(self):
+        """
+        Returns the sha1 values shared by several files with the ``count``
+        and total ``size`` of their files, ordered by sha1 (one GROUP BY
+        query).
+        """
+        return (self.non_polymorphic().exclude(sha1='').order_by()
+                .values('sha1')
+                .annotate(count=models.Count('pk'), size=models.Sum('_file_size'))
+                .filter(count__gt=1).order_by('sha1'))
+
+    def iter_duplicates(self, batch_size=1000):
+        """
+        Yields ``(sha1, files)`` for the sha1 values shared by several files,
+        fetching the files of ``batch_size`` sha1 values at a time.
+        """
+        last = ''
+        while True:
+            sha1s = list(self.duplicate_groups().filter(sha1__gt=last).values_list(
+                'sha1', flat=True)[:batch_size])
+            if not sha1s:
+                break
+            files = {}
+            for file_obj in self.filter(sha1__in=sha1s).order_by('pk'):
+                files.setdefault(file_obj.sha1, []).append(file_obj)
+            for sha1 in sha1s:
+                yield sha1, files.get(sha1, [])
+            last = sha1s[-1]
+
     def find_all_duplicates(self):
-        r = {}
-        for file_obj in self.all():
-            if file_obj.sha1:
-                q = self.filter(sha1=file_obj.sha1)
-                if len(q) > 1:
-                    r[file_obj.sha1] = q
-        return r
+        return dict(
+            (sha1, self.filter(sha1=sha1))
+            for sha1 in self.duplicate_groups().values_list('sha1', flat=True))
 
     def find_duplicates(self, file_obj):
+        if not file_obj.sha1:
+            return []
         return [i for i in self.exclude(pk=file_obj.pk).filter(sha1=file_obj.sha1)]
 
 
@@ -46,13 +74,17 @@ class File(PolymorphicModel, mixins.IconsMixin):
     file_type = 'File'
     _icon = "file"
     _file_data_changed_hint = None
+    # MIME types handled by this model when classifying uploads
+    # (see ``filer.utils.file_types``).
+    mime_types = ('*/*',)
 
     folder = models.ForeignKey(Folder, verbose_name=_('folder'), related_name='all_files',
         null=True, blank=True)
     file = MultiStorageFileField(_('file'), null=True, blank=True, max_length=255)
     _file_size = models.IntegerField(_('file size'), null=True, blank=True)
 
-    sha1 = models.CharField(_('sha1'), max_length=40, blank=True, default='')
+    sha1 = models.CharField(_('sha1'), max_length=40, blank=True, default='', db_index=True)
+    mime_type = models.CharField(_('mime type'), max_length=255, blank=True, default='')
 
     has_all_mandatory_data = models.BooleanField(_('has all mandatory data'), default=False, editable=False)
 
@@ -110,9 +142,16 @@ class File(PolymorphicModel, mixins.IconsMixin):
             self._file_size = None
         # generate SHA1 hash
         try:
-            self.generate_sha1()
+            with metrics.span('sha1'):
+                self.generate_sha1()
         except Exception:
             self.sha1 = ''
+        # detect the content type from the magic bytes and the file name
+        try:
+            self.mime_type = file_types.guess_mime_type(
+                self.file.name, file_types.read_head(self.file))
+        except Exception:
+            self.mime_type = ''
         return True
 
     def _move_file(self):
@@ -130,21 +169,26 @@ class File(PolymorphicModel, mixins.IconsMixin):
             src_storage = self.file.storages['public']
             dst_storage = self.file.storages['private']
 
+        # hint file_data_changed callback that data is actually unchanged
+        self._file_data_changed_hint = False
+        if File.objects.filter(file=src_file_name, is_public=not self.is_public).exclude(pk=self.pk).exists():
+            # other files share the stored file (see
+            # filer.utils.bulk.collapse_duplicates()), leave it and its
+            # thumbnails alone
+            self.file = copy_file(src_storage, src_file_name, dst_storage, dst_file_name)
+            return
+
         # delete the thumbnail
         # We are toggling the is_public to make sure that easy_thumbnails can
         # delete the thumbnails
         self.is_public = not self.is_public
         self.file.delete_thumbnails()
         self.is_public = not self.is_public
-        # This is needed because most of the remote File Storage backend do not
-        # open the file.
-        src_file = src_storage.open(src_file_name)
-        src_file.open()
-        # hint file_data_changed callback that data is actually unchanged
-        self._file_data_changed_hint = False
-        self.file = dst_storage.save(dst_file_name,
-            ContentFile(src_file.read()))
-        src_storage.delete(src_file_name)
+        # The file is renamed or streamed in chunks, never read into memory
+        # as a whole.
+        self.file = change_visibility(src_storage, src_file_name,
+                                      dst_storage, dst_file_name,
+                                      self.is_public, sha1=self.sha1)
 
     def _copy_file(self, destination, overwrite=False):
         """
@@ -159,12 +203,7 @@ class File(PolymorphicModel, mixins.IconsMixin):
 
         src_file_name = self.file.name
         storage = self.file.storages['public' if self.is_public else 'private']
-
-        # This is needed because most of the remote File Storage backend do not
-        # open the file.
-        src_file = storage.open(src_file_name)
-        src_file.open()
-        return storage.save(destination, ContentFile(src_file.read()))
+        return copy_file(storage, src_file_name, storage, destination)
 
     def generate_sha1(self):
         sha = hashlib.sha1()
@@ -0,0 +1,132 @@
+#-*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+
+from django.conf import settings
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+from ..utils.compatibility import python_2_unicode_compatible
+
+
+@python_2_unicode_compatible
+class Job(models.Model):
+    """
+    A long running operation processed in batches by the ``filer_worker``
+    management command.
+
+    ``handler`` is the dotted path of a callable which is called as
+    ``handler(job, item)`` for each of the JSON encoded ``items``, in
+    order. ``position`` is the index of the next item to process, so an
+    interrupted job resumes where it stopped.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('pending')),
+        (STATUS_RUNNING, _('running')),
+        (STATUS_DONE, _('done')),
+        (STATUS_FAILED, _('failed')),
+    )
+
+    title = models.CharField(_('title'), max_length=255, blank=True, default='')
+    handler = models.CharField(_('handler'), max_length=255)
+    owner = models.ForeignKey(
+        getattr(settings, 'AUTH_USER_MODEL', 'auth.User'),
+        related_name='filer_jobs', on_delete=models.SET_NULL,
+        null=True, blank=True, verbose_name=_('owner'))
+    status = models.CharField(_('status'), max_length=10, db_index=True,
+                              choices=STATUS_CHOICES, default=STATUS_PENDING)
+    arguments = models.TextField(_('arguments'), blank=True, default='{}')
+    items = models.TextField(_('items'), blank=True, default='[]')
+    total = models.PositiveIntegerField(_('total'), default=0)
+    position = models.PositiveIntegerField(_('position'), default=0)
+    affected = models.PositiveIntegerField(_('affected objects'), default=0)
+    errors = models.TextField(_('errors'), blank=True, default='[]')
+
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    started_at = models.DateTimeField(_('started at'), null=True, blank=True)
+    finished_at = models.DateTimeField(_('finished at'), null=True, blank=True)
+
+    class Meta:
+        app_label = 'filer'
+        ordering = ('created_at', 'pk')
+        verbose_name = _('job')
+        verbose_name_plural = _('jobs')
+
+    def __str__(self):
+        return self.title or self.handler
+
+    def get_arguments(self):
+        # handlers ask for the arguments for every item
+        if getattr(self, '_arguments', None) is None:
+            self._arguments = json.loads(self.arguments)
+        return self._arguments
+
+    def set_arguments(self, arguments):
+        self.arguments = json.dumps(arguments)
+        self._arguments = None
+
+    def get_items(self):
+        return json.loads(self.items)
+
+    def set_items(self, items):
+        items = list(items)
+        self.items = json.dumps(items)
+        self.total = len(items)
+
+    def get_errors(self):
+        return json.loads(self.errors) + getattr(self, '_pending_errors', [])
+
+    def add_error(self, item, message):
+        # kept in memory until the next flush_errors(), so the errors are
+        # not serialised again for every new one
+        if getattr(self, '_pending_errors', None) is None:
+            self._pending_errors = []
+        self._pending_errors.append({'item': item, 'message': message})
+
+    def flush_errors(self):
+        """
+        Adds the errors recorded since the last call to ``errors``. Returns
+        whether there were any.
+        """
+        pending = getattr(self, '_pending_errors', None)
+        if not pending:
+            return False
+        self.errors = json.dumps(json.loads(self.errors) + pending)
+        self._pending_errors = []
+        return True
+
+    def save(self, *args, **kwargs):
+        self.flush_errors()
+        super(Job, self).save(*args, **kwargs)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    @property
+    def progress(self):
+        """
+        Percentage of processed items.
+        """
+        if not self.total:
+            return 100 if self.is_finished else 0
+        return int(100 * self.position / self.total)
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'title': self.title,
+            'status': self.status,
+            'total': self.total,
+            'position': self.position,
+            'affected': self.affected,
+            'progress': self.progress,
+            'errors': self.get_errors(),
+            'finished': self.is_finished,
+        }
@@ -4,6 +4,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
 from ..utils.compatibility import python_2_unicode_compatible
+from ..utils.thumbnail_formats import parse_formats
 
 
 @python_2_unicode_compatible
@@ -16,6 +17,10 @@ class ThumbnailOption(models.Model):
     height = models.IntegerField(_("height"), help_text=_('height in pixel.'))
     crop = models.BooleanField(_("crop"), default=True)
     upscale = models.BooleanField(_("upscale"), default=True)
+    formats = models.CharField(
+        _("formats"), max_length=100, blank=True, default='',
+        help_text=_('preferred output formats, comma separated (e.g. "webp"). '
+                    'Browsers not accepting them get the default format.'))
 
     class Meta:
         app_label = 'filer'
@@ -40,3 +45,11 @@ class ThumbnailOption(models.Model):
         """
         return {"size": (self.width, self.height), "width": self.width,
                 "height": self.height, "crop": self.crop, "upscale": self.upscale}
+
+    @property
+    def format_list(self):
+        """
+        The preferred output formats, to negotiate with
+        ``filer.utils.thumbnail_formats.negotiate_format()``.
+        """
+        return parse_formats(self.formats)
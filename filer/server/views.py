@@ -3,18 +3,30 @@
 from __future__ import absolute_import
 
 from django.conf import settings
+from django.core import signing
 from django.core.exceptions import PermissionDenied
 from django.http import Http404
+from django.shortcuts import redirect
+from django.utils.cache import patch_vary_headers
 from easy_thumbnails.files import ThumbnailFile
 
 from .. import settings as filer_settings
 from ..models import File
+from ..utils import lazy_thumbnails, thumbnail_formats
 from ..utils.filer_easy_thumbnails import thumbnail_to_original_filename
 
 server = filer_settings.FILER_PRIVATEMEDIA_SERVER
 thumbnail_server = filer_settings.FILER_PRIVATEMEDIA_THUMBNAIL_SERVER
 
 
+def check_read_permission(request, file_obj):
+    if not file_obj.has_read_permission(request):
+        if settings.DEBUG:
+            raise PermissionDenied
+        else:
+            raise Http404('File not found')
+
+
 def serve_protected_file(request, path):
     """
     Serve protected files to authenticated users with read permissions.
@@ -23,11 +35,7 @@ def serve_protected_file(request, path):
         file_obj = File.objects.get(file=path, is_public=False)
     except File.DoesNotExist:
         raise Http404('File not found')
-    if not file_obj.has_read_permission(request):
-        if settings.DEBUG:
-            raise PermissionDenied
-        else:
-            raise Http404('File not found')
+    check_read_permission(request, file_obj)
     return server.serve(request, file_obj=file_obj.file, save_as=False)
 
 
@@ -35,6 +43,11 @@ def serve_protected_thumbnail(request, path):
     """
     Serve protected thumbnails to authenticated users.
     If the user doesn't have read permissions, redirect to a static image.
+
+    With ``FILER_THUMBNAIL_FORMATS`` set, the thumbnail is served in a
+    preferred format the browser accepts, if it was generated in it. The
+    variant is looked up like any thumbnail, in the thumbnail index (see
+    ``filer.utils.thumbnail_index``) or the easy-thumbnails database cache.
     """
     source_path = thumbnail_to_original_filename(path)
     if not source_path:
@@ -43,13 +56,44 @@ def serve_protected_thumbnail(request, path):
         file_obj = File.objects.get(file=source_path, is_public=False)
     except File.DoesNotExist:
         raise Http404('File not found')
-    if not file_obj.has_read_permission(request):
-        if settings.DEBUG:
-            raise PermissionDenied
-        else:
-            raise Http404('File not found')
+    check_read_permission(request, file_obj)
+    storage = file_obj.file.thumbnail_storage
+    image_format = thumbnail_formats.negotiate_format(request)
+    if image_format and not path.lower().endswith('.%s' % image_format):
+        variant = thumbnail_formats.get_variant_name(path, image_format)
+        if file_obj.file.thumbnail_exists(variant):
+            path = variant
+    try:
+        thumbnail = ThumbnailFile(name=path, storage=storage)
+        response = thumbnail_server.serve(request, thumbnail, save_as=False)
+    except Exception:
+        raise Http404('File not found')
+    if filer_settings.FILER_THUMBNAIL_FORMATS:
+        patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def serve_lazy_thumbnail(request, token, filename):
+    """
+    Generates the thumbnail of a lazy thumbnail url (see
+    ``filer.utils.lazy_thumbnails``) if it doesn't exist yet. Redirects to
+    the thumbnail of a public file, serves the thumbnail of a private file to
+    users with read permissions.
+    """
+    try:
+        file_id, thumbnail_options = lazy_thumbnails.load_token(token)
+    except (signing.BadSignature, ValueError):
+        raise Http404('File not found')
+    try:
+        file_obj = File.objects.get(pk=file_id)
+    except File.DoesNotExist:
+        raise Http404('File not found')
+    if not file_obj.is_public:
+        check_read_permission(request, file_obj)
     try:
-        thumbnail = ThumbnailFile(name=path, storage=file_obj.file.thumbnail_storage)
-        return thumbnail_server.serve(request, thumbnail, save_as=False)
+        thumbnail = file_obj.file.get_thumbnail(thumbnail_options)
     except Exception:
         raise Http404('File not found')
+    if file_obj.is_public:
+        return redirect(thumbnail.url)
+    return thumbnail_server.serve(request, thumbnail, save_as=False)
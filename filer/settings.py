@@ -243,6 +243,64 @@ else:
 FILER_UPLOADER_CONNECTIONS = getattr(
     settings, 'FILER_UPLOADER_CONNECTIONS', _uploader_connections)
 
+# Dotted path to a callable receiving ``(operation, timings)`` for instrumented
+# operations like uploads, see ``filer.utils.metrics``
+FILER_METRICS_HOOK = getattr(settings, 'FILER_METRICS_HOOK', None)
+
+# Maximum number of files accepted by the batch upload endpoint in one request
+FILER_BATCH_UPLOAD_MAX_FILES = getattr(settings, 'FILER_BATCH_UPLOAD_MAX_FILES', 1000)
+
+# Copies of files on local storages are hardlinks of the original. Only safe
+# if stored files are never modified in place.
+FILER_HARDLINK_COPIES = getattr(settings, 'FILER_HARDLINK_COPIES', False)
+
+# Making files public or private never copies their data: local files are
+# renamed, others keep their name (public and private storage share the same
+# backend, see ``filer_set_public`` in filer.utils.storage).
+FILER_METADATA_ONLY_VISIBILITY = getattr(settings, 'FILER_METADATA_ONLY_VISIBILITY', False)
+
+# Name of the cache (in ``CACHES``) keeping an index of the existing
+# thumbnails of each source file, see ``filer.utils.thumbnail_index``. It must
+# be shared by all processes.
+FILER_THUMBNAIL_INDEX_CACHE = getattr(settings, 'FILER_THUMBNAIL_INDEX_CACHE', None)
+
+# Missing thumbnails of images are not generated while rendering a page, their
+# url points to a view generating them (see ``filer.utils.lazy_thumbnails``).
+FILER_LAZY_THUMBNAILS = getattr(settings, 'FILER_LAZY_THUMBNAILS', False)
+
+# Name of the cache (in ``CACHES``) holding the locks which make sure only one
+# process generates a thumbnail (see ``filer.utils.locks``), and the seconds to
+# wait for a thumbnail generated by another process. Without a cache, only the
+# threads of a process are coordinated.
+FILER_THUMBNAIL_LOCK_CACHE = getattr(settings, 'FILER_THUMBNAIL_LOCK_CACHE', None)
+FILER_THUMBNAIL_LOCK_WAIT = getattr(settings, 'FILER_THUMBNAIL_LOCK_WAIT', 10)
+
+# Preferred output formats of thumbnails (e.g. ``('webp',)``), used when the
+# browser accepts them and Pillow can write them. Thumbnail options presets
+# can set their own.
+FILER_THUMBNAIL_FORMATS = getattr(settings, 'FILER_THUMBNAIL_FORMATS', ())
+
+# Generate the thumbnails of the thumbnail options presets for uploaded images
+# in a job (see ``FILER_BACKGROUND_JOBS``) instead of on the first page view.
+FILER_THUMBNAIL_WARMUP = getattr(settings, 'FILER_THUMBNAIL_WARMUP', False)
+
+# Run long admin actions on folders as background jobs, processed by the
+# ``filer_worker`` management command.
+FILER_BACKGROUND_JOBS = getattr(settings, 'FILER_BACKGROUND_JOBS', False)
+# Number of items processed between two progress updates of a job
+FILER_JOB_BATCH_SIZE = getattr(settings, 'FILER_JOB_BATCH_SIZE', 100)
+# Seconds after which a running job not making any progress is resumed by
+# another worker
+FILER_JOB_TIMEOUT = getattr(settings, 'FILER_JOB_TIMEOUT', 600)
+
+# Concurrent storage operations of bulk operations (see
+# ``filer.utils.executor``): size of the thread pool, maximum number of
+# concurrent calls per storage and retries of failed calls
+FILER_STORAGE_THREADS = getattr(settings, 'FILER_STORAGE_THREADS', 16)
+FILER_STORAGE_CONCURRENCY = getattr(settings, 'FILER_STORAGE_CONCURRENCY', 8)
+FILER_STORAGE_RETRIES = getattr(settings, 'FILER_STORAGE_RETRIES', 3)
+FILER_STORAGE_RETRY_BACKOFF = getattr(settings, 'FILER_STORAGE_RETRY_BACKOFF', 0.5)
+
 FILER_DUMP_PAYLOAD = getattr(settings, 'FILER_DUMP_PAYLOAD', False)  # Whether the filer shall dump the files payload
 
 FILER_CANONICAL_URL = getattr(settings, 'FILER_CANONICAL_URL', 'canonical/')
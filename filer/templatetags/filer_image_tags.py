@@ -6,11 +6,18 @@ import re
 
 from django.template import Library
 from django.utils import six
+from django.utils.html import format_html
+
+from ..models import ThumbnailOption
+from ..utils.thumbnail_formats import negotiate_format, with_format
 
 register = Library()
 
 RE_SIZE = re.compile(r'(\d+)x(\d+)$')
 
+# candidates of a srcset for a ThumbnailOption, relative to its width
+SRCSET_DENSITIES = (1, 2)
+
 
 def percentage(part, whole):
     return 100 * float(part) / float(whole)
@@ -125,3 +132,95 @@ def get_css_position(image):
     )
     return coords
 get_css_position = register.filter(get_css_position)
+
+
+def get_thumbnail_options(options):
+    """
+    Returns the thumbnail options and the preferred output formats of a
+    ``ThumbnailOption`` or a dictionary of thumbnail options.
+    """
+    if isinstance(options, ThumbnailOption):
+        return options.as_dict, options.format_list or None
+    return dict(options), None
+
+
+def filer_thumbnail_url(context, image, options, formats=None):
+    """
+    Returns the url of a thumbnail of ``image`` in the first preferred format
+    the browser accepts (``formats``, or those of the ``ThumbnailOption``, or
+    ``FILER_THUMBNAIL_FORMATS``), or the default format. The response must
+    vary on ``Accept``.
+
+        {% filer_thumbnail_url image thumbnail_option %}
+    """
+    thumbnail_options, preferred = get_thumbnail_options(options)
+    image_format = negotiate_format(context.get('request'), formats or preferred)
+    urls = image.get_thumbnail_urls({'url': with_format(thumbnail_options, image_format)})
+    return urls.get('url', '')
+filer_thumbnail_url = register.simple_tag(takes_context=True)(filer_thumbnail_url)
+
+
+def get_srcset_options(image, options, widths=None):
+    """
+    Returns ``(width, thumbnail options)`` of the candidates of a srcset: the
+    ``widths`` at the aspect ratio of a ``ThumbnailOption`` (its width and
+    ``SRCSET_DENSITIES`` times it by default), or keeping the aspect ratio of
+    the image. Widths larger than the image are left out unless upscaled.
+    A ``ThumbnailOption`` without a positive width has no candidates.
+    """
+    if isinstance(options, ThumbnailOption):
+        if options.width <= 0:
+            # the width follows from the height and the image, there is no
+            # aspect ratio to scale
+            return []
+        # as_dict also has width and height keys, which would not match the
+        # size of the candidates
+        thumbnail_options = {'crop': options.crop, 'upscale': options.upscale}
+        widths = widths or [options.width * density for density in SRCSET_DENSITIES]
+    else:
+        thumbnail_options = {}
+        widths = options
+    if isinstance(widths, six.string_types):
+        widths = widths.split(',')
+    widths = sorted(set(int(width) for width in widths))
+    if image.width and not thumbnail_options.get('upscale'):
+        widths = [width for width in widths if width <= image.width] or [image.width]
+    candidates = []
+    for width in widths:
+        if thumbnail_options:
+            height = int(round(float(width) * options.height / options.width))
+            candidates.append((width, dict(thumbnail_options, size=(width, height))))
+        else:
+            candidates.append((width, {'size': (width, 0)}))
+    return candidates
+
+
+def filer_srcset(context, image, options, widths=None, sizes=None, formats=None):
+    """
+    Returns the ``srcset`` and ``sizes`` attributes of an ``<img>`` of
+    ``image``, for a ``ThumbnailOption`` or a list of widths (see
+    ``get_srcset_options()``). Missing thumbnails are generated from a single
+    decode of the image. The format is negotiated like for
+    ``filer_thumbnail_url``.
+
+        <img src="..." {% filer_srcset image "320,640,1280" sizes="50vw" %}>
+        <img src="..." {% filer_srcset image thumbnail_option %}>
+    """
+    preferred = None
+    if isinstance(options, ThumbnailOption):
+        preferred = options.format_list or None
+    image_format = negotiate_format(context.get('request'), formats or preferred)
+    candidates = get_srcset_options(image, options, widths)
+    if not candidates:
+        return ''
+    urls = image.get_thumbnail_urls(dict(
+        (str(width), with_format(thumbnail_options, image_format))
+        for width, thumbnail_options in candidates))
+    # commas separate the candidates (and appear in subject locations)
+    srcset = ', '.join(
+        '%s %sw' % (urls[str(width)].replace(',', '%2C'), width)
+        for width, thumbnail_options in candidates if str(width) in urls)
+    if not sizes:
+        sizes = '%spx' % options.width if isinstance(options, ThumbnailOption) else '100vw'
+    return format_html('srcset="{0}" sizes="{1}"', srcset, sizes)
+filer_srcset = register.simple_tag(takes_context=True)(filer_srcset)
@@ -2,10 +2,15 @@
 from __future__ import absolute_import
 
 from .admin import *
+from .bulk import *
 from .dump import *
+from .file_types import *
+from .image_dimensions import *
 from .migrations import *
 from .models import *
 from .permissions import *
 from .server_backends import *
+from .storage import *
+from .thumbnails import *
 from .tools import *
 from .utils import *
@@ -1,7 +1,10 @@
 #-*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import json
 import os
+import warnings
+from datetime import timedelta
 
 import django
 import django.core.files
@@ -9,15 +12,22 @@ from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin import helpers
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models.signals import pre_save
 from django.forms.models import model_to_dict as model_to_dict_django
-from django.test import TestCase
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
 from filer.test_utils.extended_app.models import ExtImage, Video
 
 from .. import settings as filer_settings
 from ..admin.folderadmin import FolderAdmin
 from ..models.filemodels import File
 from ..models.foldermodels import Folder, FolderPermission
+from ..models.jobmodels import Job
 from ..models.virtualitems import FolderRoot
 from ..settings import FILER_IMAGE_MODEL
 from ..tests.helpers import (
@@ -27,6 +37,7 @@ from ..tests.helpers import (
     create_superuser,
 )
 from ..thumbnail_processors import normalize_subject_location
+from ..utils import jobs
 from ..utils.loader import load_model
 
 Image = load_model(FILER_IMAGE_MODEL)
@@ -177,10 +188,11 @@ class FilerClipboardAdminUrlsTests(TestCase):
         self.image_name = 'test_file.jpg'
         self.filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, self.image_name)
         self.img.save(self.filename, 'JPEG')
-        self.video = create_image()
         self.video_name = 'test_file.mov'
         self.video_filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, self.video_name)
-        self.video.save(self.video_filename, 'JPEG')
+        with open(self.video_filename, 'wb') as video:
+            # a QuickTime file type box followed by some padding
+            video.write(b'\x00\x00\x00\x14ftypqt  \x00\x00\x02\x00qt  ' + b'\x00' * 512)
         super(FilerClipboardAdminUrlsTests, self).setUp()
 
     def tearDown(self):
@@ -244,6 +256,19 @@ class FilerClipboardAdminUrlsTests(TestCase):
             self.assertEqual(ExtImage.objects.count(), 1)
             self.assertEqual(ExtImage.objects.all()[0].original_filename, self.image_name)
 
+    def test_filer_upload_misnamed_image(self, extra_headers={}):
+        self.assertEqual(Image.objects.count(), 0)
+        folder = Folder.objects.create(name='foo')
+        url = reverse('admin:filer-ajax_upload', kwargs={'folder_id': folder.pk})
+        post_data = {
+            'Filename': 'test_file',
+            'Filedata': django.core.files.File(open(self.filename, 'rb'), name='test_file'),
+            'jsessionid': self.client.session.session_key
+        }
+        response = self.client.post(url, post_data, **extra_headers)
+        self.assertEqual(Image.objects.count(), 1)
+        self.assertEqual(Image.objects.all()[0].mime_type, 'image/jpeg')
+
     def test_filer_upload_file_no_folder(self, extra_headers={}):
         self.assertEqual(Image.objects.count(), 0)
         file_obj = django.core.files.File(open(self.filename, 'rb'))
@@ -395,6 +420,103 @@ class FilerClipboardAdminUrlsTests(TestCase):
         self.assertContains(response, NO_PERMISSIONS_FOR_FOLDER)
         self.assertEqual(Image.objects.count(), 0)
 
+    def test_filer_upload_timings(self):
+        collected = []
+        folder = Folder.objects.create(name='foo')
+        url = reverse('admin:filer-ajax_upload', kwargs={'folder_id': folder.pk})
+        # not with SettingsOverride, it deletes settings which were None
+        old_hook = filer_settings.FILER_METRICS_HOOK
+        filer_settings.FILER_METRICS_HOOK = lambda operation, timings: collected.append((operation, timings))
+        try:
+            with SettingsOverride(filer_settings, FILER_DEBUG=True):
+                response = self.client.post(url, {'Filedata': open(self.filename, 'rb')})
+        finally:
+            filer_settings.FILER_METRICS_HOOK = old_hook
+        timings = json.loads(response.content.decode('utf-8'))['timings']
+        for stage in ('receive', 'classify', 'validate', 'sha1', 'dimensions',
+                      'save', 'storage_write', 'icons', 'preview', 'total'):
+            self.assertIn(stage, timings)
+        self.assertEqual(len(collected), 1)
+        self.assertEqual(collected[0][0], 'upload')
+
+    def test_benchmark_upload_command(self):
+        out = StringIO()
+        call_command('benchmark_upload', count=2, sizes='1k', dimensions='64x48', stdout=out)
+        self.assertIn('p99', out.getvalue())
+        self.assertIn('storage_write', out.getvalue())
+        self.assertEqual(File.objects.count(), 0)
+
+    def test_filer_upload_batch(self):
+        self.assertEqual(File.objects.count(), 0)
+        folder = Folder.objects.create(name='foo')
+        text_file = django.core.files.base.ContentFile(b'some data')
+        text_file.name = 'test_file.txt'
+        url = reverse('admin:filer-ajax_upload_batch', kwargs={'folder_id': folder.pk})
+        response = self.client.post(url, {
+            'files': [open(self.filename, 'rb'), text_file],
+        })
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content.decode('utf-8'))['files']
+        self.assertEqual(len(results), 2)
+        self.assertEqual(Image.objects.filter(folder=folder).count(), 1)
+        self.assertEqual(File.objects.filter(folder=folder).count(), 2)
+        self.assertEqual(results[0]['mime_type'], 'image/jpeg')
+        self.assertEqual(results[1]['mime_type'], 'text/plain')
+        text_obj = File.objects.get(pk=results[1]['file_id'])
+        self.assertEqual(text_obj.original_filename, 'test_file.txt')
+        self.assertEqual(text_obj.size, 9)
+        self.assertTrue(text_obj.sha1)
+
+    def test_filer_upload_batch_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='admin', password='secret')
+        url = reverse('admin:filer-ajax_upload_batch')
+        response = client.post(url, {'files': [open(self.filename, 'rb')]})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(File.objects.count(), 0)
+        # the token of the admin pages
+        client.get(reverse('admin:filer-directory_listing-root'))
+        token = client.cookies[settings.CSRF_COOKIE_NAME].value
+        response = client.post(url, {'files': [open(self.filename, 'rb')]},
+                               HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_filer_upload_batch_file_error(self):
+        def fail(sender, instance, **kwargs):
+            if getattr(instance, 'original_filename', None) == 'bad.jpg':
+                raise ValueError('broken')
+
+        bad_file = django.core.files.base.ContentFile(open(self.filename, 'rb').read())
+        bad_file.name = 'bad.jpg'
+        text_file = django.core.files.base.ContentFile(b'some data')
+        text_file.name = 'test_file.txt'
+        url = reverse('admin:filer-ajax_upload_batch')
+        pre_save.connect(fail)
+        try:
+            response = self.client.post(url, {
+                'files': [open(self.filename, 'rb'), bad_file, text_file],
+            })
+        finally:
+            pre_save.disconnect(fail)
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content.decode('utf-8'))['files']
+        self.assertEqual(results[1], {'label': 'bad.jpg', 'error': 'broken'})
+        self.assertTrue(results[0]['file_id'])
+        self.assertTrue(results[2]['file_id'])
+        self.assertEqual(
+            sorted(File.objects.values_list('original_filename', flat=True)),
+            ['test_file.jpg', 'test_file.txt'])
+
+    def test_filer_upload_batch_too_many_files(self):
+        url = reverse('admin:filer-ajax_upload_batch')
+        with SettingsOverride(filer_settings, FILER_BATCH_UPLOAD_MAX_FILES=1):
+            response = self.client.post(url, {
+                'files': [open(self.filename, 'rb'), open(self.filename, 'rb')],
+            })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(File.objects.count(), 0)
+
 
 class BulkOperationsMixin(object):
     def setUp(self):
@@ -647,6 +769,121 @@ class FilerBulkOperationsTests(BulkOperationsMixin, TestCase):
                              file_obj=file_obj)
 
 
+class FilerBackgroundJobTests(BulkOperationsMixin, TestCase):
+
+    def move_image(self):
+        url = reverse('admin:filer-directory_listing', kwargs={
+            'folder_id': self.src_folder.id,
+        })
+        with SettingsOverride(filer_settings, FILER_BACKGROUND_JOBS=True):
+            return self.client.post(url, {
+                'action': 'move_files_and_folders',
+                'post': 'yes',
+                'destination': self.dst_folder.id,
+                helpers.ACTION_CHECKBOX_NAME: 'file-%d' % (self.image_obj.id,),
+            })
+
+    def test_action_is_queued(self):
+        response = self.move_image()
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('admin:filer-job_progress', args=(job.pk,)))
+        self.assertEqual(job.status, Job.STATUS_PENDING)
+        self.assertEqual(job.owner, self.superuser)
+        self.assertEqual(self.dst_folder.files.count(), 0)
+
+        response = self.client.get(reverse('admin:filer-job_progress', args=(job.pk,)))
+        self.assertEqual(response.status_code, 200)
+
+        call_command('filer_worker', once=True, stdout=StringIO())
+        self.assertEqual(self.dst_folder.files.count(), 1)
+        response = self.client.get(reverse('admin:filer-job_status', args=(job.pk,)))
+        status = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(status['status'], Job.STATUS_DONE)
+        self.assertEqual(status['progress'], 100)
+        self.assertEqual(status['affected'], 1)
+        self.assertTrue(status['finished'])
+
+    def test_job_status_of_other_user(self):
+        self.move_image()
+        job = Job.objects.get()
+        User.objects.create_user('other', 'other@example.com', 'secret', is_staff=True)
+        self.client.login(username='other', password='secret')
+        response = self.client.get(reverse('admin:filer-job_status', args=(job.pk,)))
+        self.assertEqual(response.status_code, 403)
+
+    def test_job_resumes_and_records_errors(self):
+        files = list(File.objects.filter(folder=self.folder).order_by('pk'))
+        job = jobs.create_job(
+            'filer.admin.folderadmin.move_job',
+            [['file', f.pk] for f in files] + [['file', 0]],
+            {'destination': self.dst_folder.pk})
+        # the first file was moved before the previous worker died
+        job.position = 1
+        job.status = Job.STATUS_RUNNING
+        job.save()
+        jobs.run_job(job, batch_size=1)
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.position, len(files) + 1)
+        self.assertEqual(job.affected, len(files) - 1)
+        self.assertEqual([e['item'] for e in job.get_errors()], [['file', 0]])
+        self.assertEqual(self.folder.files.count(), 1)
+        self.assertEqual(self.dst_folder.files.count(), len(files) - 1)
+
+    def test_job_claimed_by_another_worker(self):
+        files = list(File.objects.filter(folder=self.folder).order_by('pk'))
+        job = jobs.create_job(
+            'filer.admin.folderadmin.move_job', [['file', f.pk] for f in files],
+            {'destination': self.dst_folder.pk})
+        job.status = Job.STATUS_RUNNING
+        job.save()
+        # another worker considered the job abandoned and claimed it
+        Job.objects.filter(pk=job.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        with self.assertRaises(jobs.JobClaimedError):
+            jobs.run_job(job, batch_size=1)
+        self.assertEqual(Job.objects.get(pk=job.pk).position, 0)
+        self.assertEqual(self.dst_folder.files.count(), 0)
+
+    def test_job_progress_does_not_save_items(self):
+        job = jobs.create_job(
+            'filer.admin.folderadmin.move_job', [['file', 0], ['file', 0]],
+            {'destination': self.dst_folder.pk})
+        job.save()
+        with CaptureQueriesContext(connection) as queries:
+            jobs.run_job(job, batch_size=1)
+        updates = [q['sql'] for q in queries.captured_queries
+                   if q['sql'].startswith('UPDATE "filer_job"')]
+        self.assertEqual(len(updates), 4)
+        for sql in updates:
+            self.assertNotIn('"items"', sql)
+        # the errors of a batch are serialised at once
+        self.assertEqual(sum('"errors"' in sql for sql in updates), 2)
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual(len(job.get_errors()), 2)
+
+
+class FilerDeprecatedActionMethodsTests(BulkOperationsMixin, TestCase):
+    def test_deprecated_methods(self):
+        folder_admin = FolderAdmin(Folder, admin.site)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            copied = folder_admin._copy_folder(self.sub_folder1, self.dst_folder, '_copy', False)
+            folder_admin._move_files_and_folders_impl(
+                File.objects.filter(folder=self.src_folder), Folder.objects.none(), self.dst_folder)
+            renamed = folder_admin._rename_folder(self.folder, {'rename_format': '%(global_counter)s'}, 10)
+        self.assertEqual([w.category for w in caught], [DeprecationWarning] * 3)
+        self.assertEqual(copied, 4)
+        copy = self.dst_folder.children.get()
+        self.assertEqual(copy.name, 'sub folder 1')
+        self.assertEqual(copy.files.count(), 3)
+        self.assertEqual(list(self.dst_folder.files.all()), [self.image_obj])
+        self.assertEqual(renamed, 8)
+        self.assertEqual(
+            sorted(File.objects.filter(folder__in=[self.folder, self.sub_folder1, self.sub_folder2])
+                   .values_list('name', flat=True)),
+            [str(n) for n in range(11, 19)])
+
+
 class FilerDeleteOperationTests(BulkOperationsMixin, TestCase):
     def test_delete_files_or_folders_action(self):
         self.assertNotEqual(File.objects.count(), 0)
@@ -760,6 +997,35 @@ class FilerResizeOperationTests(BulkOperationsMixin, TestCase):
                     expected_subj_x=20, expected_subj_y=150,  # at the center
                 )
 
+    def test_resize_shared_image(self):
+        image_obj = self.create_image(self.src_folder)
+        alias = self.create_image(self.src_folder)
+        # as left by filer.utils.bulk.collapse_duplicates()
+        File.objects.filter(pk=alias.pk).update(file=image_obj.file.name, sha1=image_obj.sha1)
+        url = reverse('admin:filer-directory_listing', kwargs={
+            'folder_id': self.src_folder.id,
+        })
+        response = self.client.post(url, {
+            'action': 'resize_images',
+            'post': 'yes',
+            'width': 40,
+            'height': 300,
+            'crop': False,
+            'upscale': False,
+            helpers.ACTION_CHECKBOX_NAME: 'file-%d' % (image_obj.id,),
+        })
+        self.assertEqual(response.status_code, 302)
+        resized = Image.objects.get(id=image_obj.id)
+        alias = Image.objects.get(id=alias.id)
+        self.assertNotEqual(resized.file.name, alias.file.name)
+        self.assertEqual((resized.width, resized.height), (40, 30))
+        self.assertNotEqual(resized.sha1, alias.sha1)
+        self.assertEqual(alias.file.name, image_obj.file.name)
+        # the shared stored file is unchanged
+        self.assertEqual(alias.file.size, image_obj.size)
+        alias.generate_sha1()
+        self.assertEqual(alias.sha1, image_obj.sha1)
+
 
 class PermissionAdminTest(TestCase):
     def setUp(self):
@@ -0,0 +1,353 @@
+#-*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from io import BytesIO
+
+import django.core.files
+from django.contrib.admin.models import DELETION, LogEntry
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from easy_thumbnails.models import Source
+
+from ..models.filemodels import File
+from ..models.foldermodels import Folder, FolderPermission
+from ..settings import FILER_IMAGE_MODEL
+from ..utils import bulk
+from ..utils.loader import load_model
+from .helpers import create_image, create_superuser
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+
+class BulkTestMixin(object):
+
+    def setUp(self):
+        self.superuser = create_superuser()
+        self.folder = Folder.objects.create(name='root')
+        self.sub_folder = Folder.objects.create(name='sub', parent=self.folder)
+
+    def create_file(self, folder=None, data=b'some data'):
+        file_obj = django.core.files.base.ContentFile(data, name='file.txt')
+        return File.objects.create(
+            owner=self.superuser, original_filename='file.txt',
+            file=file_obj, folder=folder or self.folder)
+
+    def create_image(self, folder=None):
+        data = BytesIO()
+        create_image().save(data, 'JPEG')
+        file_obj = django.core.files.base.ContentFile(data.getvalue(), name='image.jpg')
+        return Image.objects.create(
+            owner=self.superuser, original_filename='image.jpg',
+            file=file_obj, folder=folder or self.folder)
+
+    def exists(self, file_obj):
+        return file_obj.file.storage.exists(file_obj.file.name)
+
+
+class BulkDeleteTests(BulkTestMixin, TransactionTestCase):
+
+    def test_delete_files(self):
+        image = self.create_image()
+        image.easy_thumbnails_thumbnailer.get_thumbnail({'size': (32, 32)})
+        thumbnail_names = [t.name for t in image.file.get_thumbnails()]
+        self.assertEqual(len(thumbnail_names), 1)
+        file_obj = self.create_file()
+        with transaction.atomic():
+            deleted = bulk.delete_files([image.pk, file_obj.pk], self.superuser.pk)
+            # storage is cleaned up once committed
+            self.assertTrue(self.exists(image))
+        self.assertEqual(deleted, 2)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(self.exists(image))
+        self.assertFalse(self.exists(file_obj))
+        self.assertFalse(image.file.thumbnail_storage.exists(thumbnail_names[0]))
+        self.assertFalse(Source.objects.filter(name=image.file.name).exists())
+        self.assertEqual(
+            LogEntry.objects.filter(action_flag=DELETION, user=self.superuser).count(), 2)
+
+    def test_delete_files_keeps_shared_files(self):
+        file_obj = self.create_file()
+        other = File.objects.create(
+            original_filename='file.txt', file=file_obj.file.name, folder=self.folder)
+        bulk.delete_files([file_obj.pk])
+        self.assertTrue(self.exists(other))
+        bulk.delete_files([other.pk])
+        self.assertFalse(self.exists(other))
+
+    def test_delete_rollback_keeps_files(self):
+        file_obj = self.create_file()
+        try:
+            with transaction.atomic():
+                bulk.delete_files([file_obj.pk])
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(File.objects.filter(pk=file_obj.pk).exists())
+        self.assertTrue(self.exists(file_obj))
+
+    def test_delete_folders(self):
+        files = [self.create_file(self.folder), self.create_file(self.sub_folder)]
+        other = Folder.objects.create(name='other')
+        bulk.delete_folders([self.folder.pk], self.superuser.pk)
+        self.assertEqual(list(Folder.objects.all()), [other])
+        self.assertFalse(File.objects.exists())
+        for file_obj in files:
+            self.assertFalse(self.exists(file_obj))
+
+    def test_set_files_private(self):
+        image = self.create_image()
+        image.easy_thumbnails_thumbnailer.get_thumbnail({'size': (32, 32)})
+        thumbnail_name = [t.name for t in image.file.get_thumbnails()][0]
+        thumbnail_storage = image.file.thumbnail_storage
+        missing = self.create_file()
+        missing.file.storage.delete(missing.file.name)
+        private = self.create_file()
+        private.is_public = False
+        private.save()
+        with transaction.atomic():
+            changed, errors = bulk.set_files_public(
+                [image.pk, missing.pk, private.pk], False)
+            self.assertTrue(thumbnail_storage.exists(thumbnail_name))
+        self.assertEqual(changed, 1)
+        self.assertEqual(list(errors), [missing.pk])
+        self.assertFalse(thumbnail_storage.exists(thumbnail_name))
+        self.assertFalse(self.exists(image))
+        moved = Image.objects.get(pk=image.pk)
+        self.assertFalse(moved.is_public)
+        self.assertEqual(moved.sha1, image.sha1)
+        self.assertTrue(self.exists(moved))
+        self.assertTrue(File.objects.get(pk=missing.pk).is_public)
+
+    def test_set_files_private_hook_after_commit(self):
+        calls = []
+        saved = []
+        storages = File._meta.get_field('file').storages
+        private = storages['private']
+
+        class HookStorage(FileSystemStorage):
+            def filer_set_public(self, name, src_storage, is_public):
+                calls.append((name, is_public))
+                saved.append(self.save('hooked/file.txt', src_storage.open(name)))
+                return saved[-1]
+
+        file_obj = self.create_file()
+        storages['private'] = HookStorage(location=private.location)
+        try:
+            with transaction.atomic():
+                bulk.set_files_public([file_obj.pk], False)
+                self.assertEqual(calls, [])
+        finally:
+            storages['private'] = private
+            for name in saved:
+                private.delete(name)
+        self.assertEqual(calls, [(file_obj.file.name, False)])
+        moved = File.objects.get(pk=file_obj.pk)
+        self.assertFalse(moved.is_public)
+        self.assertEqual(moved.file.name, saved[0])
+
+    def test_set_files_private_rollback_keeps_files(self):
+        file_obj = self.create_file()
+        try:
+            with transaction.atomic():
+                bulk.set_files_public([file_obj.pk], False)
+                raise ValueError
+        except ValueError:
+            pass
+        file_obj = File.objects.get(pk=file_obj.pk)
+        self.assertTrue(file_obj.is_public)
+        self.assertTrue(self.exists(file_obj))
+
+
+class DuplicateTests(BulkTestMixin, TransactionTestCase):
+
+    def test_find_duplicates(self):
+        files = [self.create_file(data=b'same') for i in range(3)]
+        other = self.create_file(data=b'other')
+        with self.assertNumQueries(1):
+            duplicates = File.objects.find_all_duplicates()
+        self.assertEqual(list(duplicates), [files[0].sha1])
+        self.assertEqual(list(File.objects.iter_duplicates(batch_size=1)),
+                         [(files[0].sha1, files)])
+        self.assertEqual(File.objects.find_duplicates(files[0]), files[1:])
+        self.assertEqual(File.objects.find_duplicates(other), [])
+
+    def test_collapse_duplicates(self):
+        files = [self.create_file(data=b'same') for i in range(3)]
+        out = StringIO()
+        call_command('filer_duplicates', collapse=True, stdout=out)
+        self.assertIn('3 files, 8', out.getvalue())
+        names = set(File.objects.values_list('file', flat=True))
+        self.assertEqual(names, set([files[0].file.name]))
+        self.assertTrue(self.exists(files[0]))
+        self.assertFalse(self.exists(files[1]))
+        self.assertFalse(self.exists(files[2]))
+
+        # the shared stored file is copied when one of the files changes
+        bulk.set_files_public([files[1].pk], False)
+        private = File.objects.get(pk=files[1].pk)
+        self.assertTrue(self.exists(files[0]))
+        self.assertTrue(self.exists(private))
+        files[2] = File.objects.get(pk=files[2].pk)
+        files[2].is_public = False
+        files[2].save()
+        self.assertTrue(self.exists(files[0]))
+        self.assertTrue(self.exists(files[2]))
+        # stored files are deleted with the last file using them
+        bulk.delete_files([files[0].pk])
+        self.assertFalse(self.exists(files[0]))
+        bulk.delete_files([files[1].pk])
+        self.assertFalse(self.exists(private))
+        self.assertTrue(self.exists(files[2]))
+
+
+class BulkQueryTests(BulkTestMixin, TestCase):
+
+    def count_delete_queries(self, n):
+        file_ids = [self.create_file(data=b'data %d' % i).pk for i in range(n)]
+        file_ids.append(self.create_image().pk)
+        with CaptureQueriesContext(connection) as queries:
+            bulk.delete_files(file_ids, self.superuser.pk)
+        return len(queries)
+
+    def test_delete_queries_do_not_grow(self):
+        self.assertEqual(self.count_delete_queries(2), self.count_delete_queries(10))
+
+    def test_get_folder_ids_recursive(self):
+        sub_sub_folder = Folder.objects.create(name='subsub', parent=self.sub_folder)
+        Folder.objects.create(name='other')
+        self.assertEqual(
+            bulk.get_folder_ids_recursive(Folder.objects.filter(pk=self.folder.pk)),
+            set([self.folder.pk, self.sub_folder.pk, sub_sub_folder.pk]))
+
+    def test_plan_rename(self):
+        sub_file = self.create_file(folder=self.sub_folder)
+        sub_file.name = 'b'
+        sub_file.save()
+        root_files = [self.create_file(), self.create_file()]
+        root_files[0].name = 'z'
+        root_files[0].save()
+        other = self.create_file(folder=Folder.objects.create(name='other'))
+        names = bulk.plan_rename(
+            File.objects.filter(pk=other.pk),
+            Folder.objects.filter(pk=self.folder.pk),
+            '%(current_folder)s-%(counter)s-%(global_counter)s')
+        # subfolders first, files sorted by label
+        self.assertEqual(names, [
+            (sub_file.pk, 'sub-1-1'),
+            (root_files[1].pk, 'root-1-2'),
+            (root_files[0].pk, 'root-2-3'),
+            (other.pk, 'other-1-4'),
+        ])
+        self.assertEqual(bulk.rename_files(names), 4)
+        self.assertEqual(File.objects.get(pk=root_files[0].pk).name, 'root-2-3')
+
+    def test_plan_rename_queries_do_not_grow(self):
+        folders = Folder.objects.filter(pk=self.folder.pk)
+        self.create_file(folder=self.sub_folder)
+        with CaptureQueriesContext(connection) as queries:
+            bulk.plan_rename(File.objects.none(), folders.all(), '%(counter)s')
+        count = len(queries)
+        for i in range(5):
+            self.create_file(folder=Folder.objects.create(name='f%d' % i, parent=self.sub_folder))
+        with CaptureQueriesContext(connection) as queries:
+            bulk.plan_rename(File.objects.none(), folders.all(), '%(counter)s')
+        self.assertEqual(len(queries), count)
+
+    def count_move_queries(self, n):
+        destination = Folder.objects.create(name='destination')
+        files = [self.create_file(folder=self.sub_folder).pk for i in range(n)]
+        for i in range(n):
+            Folder.objects.create(name='f%d' % i, parent=self.sub_folder)
+        with CaptureQueriesContext(connection) as queries:
+            bulk.move_files(files, destination.pk)
+            bulk.move_folders([self.sub_folder.pk], destination.pk)
+        self.assertEqual(File.objects.filter(folder=destination).count(), n)
+        self.assertEqual(Folder.objects.get(pk=self.sub_folder.pk).parent_id, destination.pk)
+        destination = Folder.objects.get(pk=destination.pk)
+        self.assertEqual(destination.get_descendant_count(), n + 1)
+        self.assertEqual(Folder.objects.get(pk=self.folder.pk).get_descendant_count(), 0)
+        self.sub_folder = Folder.objects.create(name='sub', parent=self.folder)
+        return len(queries)
+
+    def test_move_queries_do_not_grow(self):
+        self.assertEqual(self.count_move_queries(2), self.count_move_queries(10))
+
+    def test_get_move_conflicts(self):
+        destination = Folder.objects.create(name='destination')
+        Folder.objects.create(name='sub', parent=destination)
+        self.assertEqual(
+            bulk.get_move_conflicts([self.sub_folder.pk], destination.pk), ['sub'])
+        self.assertEqual(
+            bulk.get_move_conflicts([self.sub_folder.pk], self.folder.pk), [])
+
+    def tree(self, folder):
+        return [
+            (f.name, f.level - folder.level, sorted(f.files.values_list('original_filename', flat=True)))
+            for f in folder.get_descendants(include_self=True)]
+
+    def count_copy_queries(self, n):
+        destination = Folder.objects.create(name='destination %d' % n)
+        source = Folder.objects.create(name='source %d' % n, parent=self.folder)
+        Folder.objects.create(name='after %d' % n)
+        self.create_image(folder=source)
+        for i in range(n):
+            folder = Folder.objects.create(name='f%d' % i, parent=source)
+            self.create_file(folder=folder, data=b'data %d' % i)
+            Folder.objects.create(name='g', parent=folder)
+        FolderPermission.objects.create(folder=source, everybody=True, can_read=1)
+        explicit = self.create_file()
+        with CaptureQueriesContext(connection) as queries:
+            copied = bulk.copy_files_and_folders(
+                [explicit.pk], [source.pk], destination.pk, '_copy')
+        self.assertEqual(copied, 1 + 1 + 2 * n + 1 + n)
+        copy = Folder.objects.get(parent=destination)
+        self.assertEqual(self.tree(copy), [
+            (name, level, [filename.replace('.', '_copy.') for filename in filenames])
+            for name, level, filenames in self.tree(Folder.objects.get(pk=source.pk))])
+        self.assertEqual(list(destination.files.values_list('original_filename', flat=True)),
+                         ['file_copy.txt'])
+        image = Image.objects.get(folder=copy)
+        self.assertTrue(image.file.storage.exists(image.file.name))
+        self.assertNotEqual(image.file.name, Image.objects.get(folder=source).file.name)
+        self.assertEqual(FolderPermission.objects.filter(folder=copy, everybody=True).count(), 1)
+        # the tree fields are consistent
+        before = list(Folder.objects.order_by('pk').values_list('pk', 'lft', 'rght', 'level', 'tree_id'))
+        Folder._tree_manager.rebuild()
+        self.assertEqual(
+            before, list(Folder.objects.order_by('pk').values_list('pk', 'lft', 'rght', 'level', 'tree_id')))
+        return len(queries)
+
+    def test_copy_queries_do_not_grow(self):
+        self.assertEqual(self.count_copy_queries(2), self.count_copy_queries(10))
+
+    def test_copy_folder_available_name(self):
+        bulk.copy_files_and_folders([], [self.sub_folder.pk], self.folder.pk, '')
+        bulk.copy_files_and_folders([], [self.sub_folder.pk], self.folder.pk, '')
+        self.assertEqual(
+            sorted(self.folder.children.values_list('name', flat=True)),
+            ['sub', 'sub_1', 'sub_2'])
+
+    def test_copy_folder_with_selected_subfolder(self):
+        destination = Folder.objects.create(name='destination')
+        self.create_file(folder=self.sub_folder)
+        copied = bulk.copy_files_and_folders(
+            [], [self.folder.pk, self.sub_folder.pk], destination.pk, '')
+        self.assertEqual(copied, 3)
+        copy = Folder.objects.get(parent=destination)
+        self.assertEqual(self.tree(copy), self.tree(Folder.objects.get(pk=self.folder.pk)))
+        self.assertEqual(Folder.objects.filter(parent=destination).count(), 1)
+
+    def count_set_public_queries(self, n):
+        file_ids = [self.create_file(data=b'data %d' % i).pk for i in range(n)]
+        with CaptureQueriesContext(connection) as queries:
+            changed, errors = bulk.set_files_public(file_ids, False)
+        self.assertEqual((changed, errors), (n, {}))
+        return len(queries)
+
+    def test_set_public_queries_do_not_grow(self):
+        self.assertEqual(self.count_set_public_queries(2), self.count_set_public_queries(10))
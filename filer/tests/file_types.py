@@ -0,0 +1,51 @@
+#-*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from ..models.filemodels import File
+from ..settings import FILER_IMAGE_MODEL
+from ..utils import file_types
+from ..utils.loader import load_model
+from .helpers import create_image
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+
+class FileTypesTestCase(TestCase):
+
+    def setUp(self):
+        self.img = create_image()
+        self.image_name = 'test_file.jpg'
+        self.filename = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, self.image_name)
+        self.img.save(self.filename, 'PNG')
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_sniffing_wins_over_extension(self):
+        with open(self.filename, 'rb') as f:
+            head = file_types.read_head(f)
+        self.assertEqual(file_types.guess_mime_type('test_file.jpg', head), 'image/png')
+        self.assertEqual(file_types.guess_mime_type('test_file', head), 'image/png')
+
+    def test_misnamed_file_is_not_trusted(self):
+        self.assertEqual(file_types.guess_mime_type('test_file.jpg', b'some data'),
+                         file_types.DEFAULT_MIME_TYPE)
+        self.assertEqual(file_types.guess_mime_type('test_file.txt', b'some data'),
+                         'text/plain')
+
+    def test_registry_classifies_by_content(self):
+        registry = file_types.FileTypeRegistry()
+        registry.build((FILER_IMAGE_MODEL, 'filer.File'))
+        with open(self.filename, 'rb') as f:
+            model, mime_type = registry.classify('test_file', DjangoFile(f))
+        self.assertEqual(model, Image)
+        self.assertEqual(mime_type, 'image/png')
+        model, mime_type = registry.classify('test_file.jpg', ContentFile(b'some data'))
+        self.assertEqual(model, File)
@@ -0,0 +1,56 @@
+#-*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import struct
+from io import BytesIO
+
+import django.core.files
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from ..models.filemodels import File
+from ..settings import FILER_IMAGE_MODEL
+from ..utils.image_dimensions import get_image_dimensions
+from ..utils.loader import load_model
+from .helpers import create_image, create_superuser
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+
+class ImageDimensionsTestCase(TestCase):
+
+    def image_data(self, format, size=(321, 123), **kwargs):
+        data = BytesIO()
+        create_image(size=size).save(data, format, **kwargs)
+        data.seek(0)
+        return data
+
+    def test_formats(self):
+        for format in ('JPEG', 'PNG', 'GIF'):
+            self.assertEqual(get_image_dimensions(self.image_data(format)), (321, 123), format)
+
+    def test_webp_extended(self):
+        header = (b'RIFF\x00\x00\x00\x00WEBPVP8X\x0a\x00\x00\x00\x00\x00\x00\x00' +
+                  struct.pack('<I', 320)[:3] + struct.pack('<I', 122)[:3])
+        self.assertEqual(get_image_dimensions(BytesIO(header)), (321, 123))
+
+    def test_jpeg_with_large_metadata(self):
+        data = self.image_data('JPEG', icc_profile=b'\0' * 20000)
+        self.assertEqual(get_image_dimensions(data), (321, 123))
+
+    def test_unknown_format(self):
+        self.assertIsNone(get_image_dimensions(BytesIO(b'some data')))
+
+    def test_update_image_dimensions_command(self):
+        owner = create_superuser()
+        data = self.image_data('PNG')
+        image = Image.objects.create(
+            owner=owner, original_filename='test.png',
+            file=django.core.files.File(data, name='test.png'))
+        Image.objects.filter(pk=image.pk).update(_width=None, _height=None)
+        call_command('update_image_dimensions', stdout=StringIO())
+        image = Image.objects.get(pk=image.pk)
+        self.assertEqual((image.width, image.height), (321, 123))
+        for f in File.objects.all():
+            f.delete()
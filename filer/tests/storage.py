@@ -0,0 +1,391 @@
+#-*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..management.commands.import_files import FileImporter
+from ..models import File, Folder
+from ..utils import storage as storage_utils
+from ..utils.executor import StorageExecutor
+from .. import settings as filer_settings
+from ..utils.storage import StorageError, change_visibility, copy_file, move_file
+
+
+class NonLocalStorage(Storage):
+    """
+    Wraps a filesystem storage without exposing paths, like a remote storage.
+    """
+
+    def __init__(self, location):
+        self.storage = FileSystemStorage(location=location)
+
+    def _open(self, name, mode='rb'):
+        return self.storage.open(name, mode)
+
+    def _save(self, name, content):
+        return self.storage.save(name, content)
+
+    def delete(self, name):
+        self.storage.delete(name)
+
+    def exists(self, name):
+        return self.storage.exists(name)
+
+    def size(self, name):
+        return self.storage.size(name)
+
+
+class StorageUtilsTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.src = FileSystemStorage(location=os.path.join(self.root, 'src'))
+        self.dst = FileSystemStorage(location=os.path.join(self.root, 'dst'))
+        self.data = b'filer' * 100000
+        self.sha1 = hashlib.sha1(self.data).hexdigest()
+        self.name = self.src.save('a/file.bin', ContentFile(self.data))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self, storage, name):
+        with storage.open(name, 'rb') as f:
+            return f.read()
+
+    def test_move_local_rename(self):
+        inode = os.stat(self.src.path(self.name)).st_ino
+        name = move_file(self.src, self.name, self.dst, 'b/file.bin', sha1=self.sha1)
+        self.assertEqual(name, 'b/file.bin')
+        self.assertEqual(os.stat(self.dst.path(name)).st_ino, inode)
+        self.assertFalse(self.src.exists(self.name))
+
+    def test_move_local_rename_concurrent_file(self):
+        data = self.data
+
+        class RacingStorage(FileSystemStorage):
+            # another upload takes the name right after it was checked
+            raced = False
+
+            def get_available_name(self, name, max_length=None):
+                name = super(RacingStorage, self).get_available_name(name)
+                if not self.raced:
+                    self.raced = True
+                    FileSystemStorage.save(self, name, ContentFile(b'other'))
+                return name
+
+        dst = RacingStorage(location=self.dst.location)
+        name = move_file(self.src, self.name, dst, 'b/file.bin', sha1=self.sha1)
+        self.assertNotEqual(name, 'b/file.bin')
+        self.assertEqual(self.read(dst, 'b/file.bin'), b'other')
+        self.assertEqual(self.read(dst, name), data)
+        self.assertFalse(self.src.exists(self.name))
+
+    def test_move_streamed(self):
+        src = NonLocalStorage(location=self.src.location)
+        old_chunk_size = storage_utils.CHUNK_SIZE
+        storage_utils.CHUNK_SIZE = 4096
+        try:
+            name = move_file(src, self.name, self.dst, 'b/file.bin', sha1=self.sha1)
+        finally:
+            storage_utils.CHUNK_SIZE = old_chunk_size
+        self.assertEqual(self.read(self.dst, name), self.data)
+        self.assertFalse(src.exists(self.name))
+
+    def test_move_streamed_existing_name(self):
+        src = NonLocalStorage(location=self.src.location)
+        self.dst.save('b/file.bin', ContentFile(b'other'))
+        name = move_file(src, self.name, self.dst, 'b/file.bin')
+        self.assertNotEqual(name, 'b/file.bin')
+        self.assertEqual(self.read(self.dst, name), self.data)
+
+    def test_move_digest_mismatch(self):
+        src = NonLocalStorage(location=self.src.location)
+        with self.assertRaises(StorageError):
+            move_file(src, self.name, self.dst, 'b/file.bin', sha1='0' * 40)
+        self.assertTrue(src.exists(self.name))
+        self.assertFalse(self.dst.exists('b/file.bin'))
+
+    def test_move_native(self):
+        calls = []
+
+        class NativeStorage(NonLocalStorage):
+            def filer_move(self, name, dst_storage, dst_name):
+                calls.append((name, dst_name))
+                return dst_storage.save(dst_name, self.open(name))
+
+        src = NativeStorage(location=self.src.location)
+        name = move_file(src, self.name, self.dst, 'b/file.bin', sha1=self.sha1)
+        self.assertEqual(calls, [(self.name, 'b/file.bin')])
+        self.assertEqual(self.read(self.dst, name), self.data)
+
+    def test_change_visibility_hook(self):
+        calls = []
+
+        class AclStorage(NonLocalStorage):
+            def filer_set_public(self, name, src_storage, is_public):
+                calls.append((name, is_public))
+                return name
+
+        src = NonLocalStorage(location=self.src.location)
+        dst = AclStorage(location=self.src.location)
+        name = change_visibility(src, self.name, dst, 'b/file.bin', True)
+        self.assertEqual(name, self.name)
+        self.assertEqual(calls, [(self.name, True)])
+        self.assertTrue(dst.exists(name))
+
+    def test_change_visibility_metadata_only(self):
+        src = NonLocalStorage(location=self.src.location)
+        dst = NonLocalStorage(location=self.src.location)
+        old_setting = filer_settings.FILER_METADATA_ONLY_VISIBILITY
+        filer_settings.FILER_METADATA_ONLY_VISIBILITY = True
+        try:
+            name = change_visibility(src, self.name, dst, 'b/file.bin', False)
+            self.assertEqual(name, self.name)
+            # local files are renamed
+            inode = os.stat(self.src.path(self.name)).st_ino
+            name = change_visibility(self.src, self.name, self.dst, 'b/file.bin', True)
+        finally:
+            filer_settings.FILER_METADATA_ONLY_VISIBILITY = old_setting
+        self.assertEqual(os.stat(self.dst.path(name)).st_ino, inode)
+
+    def test_change_visibility_metadata_only_other_location(self):
+        # a remote storage not sharing its location, nothing to rename
+        src = NonLocalStorage(location=self.src.location)
+        dst = NonLocalStorage(location=self.dst.location)
+        old_setting = filer_settings.FILER_METADATA_ONLY_VISIBILITY
+        filer_settings.FILER_METADATA_ONLY_VISIBILITY = True
+        try:
+            name = change_visibility(src, self.name, dst, 'b/file.bin', True, sha1=self.sha1)
+        finally:
+            filer_settings.FILER_METADATA_ONLY_VISIBILITY = old_setting
+        self.assertEqual(name, 'b/file.bin')
+        self.assertEqual(self.read(dst, name), self.data)
+        self.assertFalse(src.exists(self.name))
+
+    def test_change_visibility_moves_data(self):
+        src = NonLocalStorage(location=self.src.location)
+        name = change_visibility(src, self.name, self.dst, 'b/file.bin', True, sha1=self.sha1)
+        self.assertEqual(self.read(self.dst, name), self.data)
+        self.assertFalse(src.exists(self.name))
+
+    def test_copy_local(self):
+        name = copy_file(self.src, self.name, self.src, self.name)
+        self.assertNotEqual(name, self.name)
+        self.assertEqual(self.read(self.src, name), self.data)
+        self.assertEqual(self.read(self.src, self.name), self.data)
+        self.assertNotEqual(os.stat(self.src.path(name)).st_ino,
+                            os.stat(self.src.path(self.name)).st_ino)
+
+    def test_copy_fallback(self):
+        old_strategies = storage_utils._kernel_copy_strategies
+        storage_utils._kernel_copy_strategies = lambda: []
+        try:
+            name = copy_file(self.src, self.name, self.dst, 'b/file.bin')
+        finally:
+            storage_utils._kernel_copy_strategies = old_strategies
+        self.assertEqual(self.read(self.dst, name), self.data)
+
+    def test_copy_hardlink(self):
+        old_setting = filer_settings.FILER_HARDLINK_COPIES
+        filer_settings.FILER_HARDLINK_COPIES = True
+        try:
+            name = copy_file(self.src, self.name, self.dst, 'b/file.bin')
+        finally:
+            filer_settings.FILER_HARDLINK_COPIES = old_setting
+        self.assertEqual(os.stat(self.dst.path(name)).st_ino,
+                         os.stat(self.src.path(self.name)).st_ino)
+
+    def test_copy_streamed(self):
+        src = NonLocalStorage(location=self.src.location)
+        name = copy_file(src, self.name, self.dst, 'b/file.bin')
+        self.assertEqual(self.read(self.dst, name), self.data)
+        self.assertTrue(src.exists(self.name))
+
+    def test_copy_native(self):
+        class NativeStorage(NonLocalStorage):
+            def filer_copy(self, name, dst_storage, dst_name):
+                return 'native/%s' % dst_name
+
+        src = NativeStorage(location=self.src.location)
+        name = copy_file(src, self.name, self.dst, 'b/file.bin')
+        self.assertEqual(name, 'native/b/file.bin')
+
+
+class FlakyStorage(NonLocalStorage):
+
+    def __init__(self, location, failures=0, error=None, concurrency=None):
+        super(FlakyStorage, self).__init__(location)
+        self.failures = failures
+        self.error = error or IOError('connection reset')
+        self.calls = 0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+        if concurrency is not None:
+            self.filer_concurrency = concurrency
+
+    def exists(self, name):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            fail = self.failures > 0
+            self.failures -= 1
+        try:
+            time.sleep(0.01)
+            if fail:
+                raise self.error
+            return super(FlakyStorage, self).exists(name)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class StorageExecutorTestCase(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_ordered_results(self):
+        storage = FileSystemStorage(location=self.root)
+        names = ['file%d.txt' % i for i in range(20)]
+        with StorageExecutor(threads=4) as executor:
+            for name in names:
+                executor.save(storage, name, ContentFile(name.encode('ascii')))
+            self.assertEqual(executor.results(), names)
+            for name in names + ['missing.txt']:
+                executor.exists(storage, name)
+            self.assertEqual(executor.results(), [True] * 20 + [False])
+            for name in names:
+                executor.delete(storage, name)
+            executor.results()
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_retry(self):
+        storage = FlakyStorage(self.root, failures=2)
+        with StorageExecutor(retries=2, backoff=0.001) as executor:
+            executor.exists(storage, 'file.txt')
+            self.assertEqual(executor.results(), [False])
+        self.assertEqual(storage.calls, 3)
+
+    def test_retries_exhausted(self):
+        storage = FlakyStorage(self.root, failures=5)
+        with StorageExecutor(retries=1, backoff=0.001) as executor:
+            executor.exists(storage, 'file.txt')
+            executor.exists(storage, 'file.txt')
+            with self.assertRaises(IOError):
+                executor.results()
+        self.assertEqual(storage.calls, 4)
+
+    def test_permanent_errors_are_not_retried(self):
+        error = IOError(errno.ENOENT, 'No such file')
+        storage = FlakyStorage(self.root, failures=1, error=error)
+        with StorageExecutor(backoff=0.001) as executor:
+            executor.exists(storage, 'file.txt')
+            results = executor.results(return_exceptions=True)
+        self.assertEqual(results, [error])
+        self.assertEqual(storage.calls, 1)
+
+    def test_storage_concurrency(self):
+        storage = FlakyStorage(self.root, concurrency=2)
+        with StorageExecutor(threads=8) as executor:
+            for i in range(16):
+                executor.exists(storage, 'file.txt')
+            executor.results()
+        self.assertEqual(storage.max_active, 2)
+
+
+class ImportFilesTestCase(TestCase):
+
+    def test_failed_row_deletes_stored_files(self):
+        stored = []
+
+        def fail(sender, instance, **kwargs):
+            if getattr(instance, 'original_filename', None) == 'bad.txt':
+                stored.append((instance.file.storage, instance.file.name))
+                raise ValueError('broken')
+
+        folder = Folder.objects.create(name='import')
+        importer = FileImporter(verbosity=0)
+        files = [ContentFile(b'good', name='good.txt'), ContentFile(b'bad', name='bad.txt'),
+                 ContentFile(b'next', name='next.txt')]
+        pre_save.connect(fail)
+        try:
+            with self.assertRaises(ValueError):
+                importer.import_files(files, folder)
+        finally:
+            pre_save.disconnect(fail)
+        good = File.objects.get()
+        self.assertEqual(good.original_filename, 'good.txt')
+        self.assertTrue(good.file.storage.exists(good.file.name))
+        # neither the failed file nor the next one are left behind
+        storage, name = stored[0]
+        self.assertFalse(storage.exists(name))
+        self.assertEqual([f for root, dirs, files in os.walk(storage.location)
+                          for f in files if f in ('bad.txt', 'next.txt')], [])
+        good.delete()
+
+    def test_existing_files(self):
+        folder = Folder.objects.create(name='import')
+        importer = FileImporter(verbosity=0)
+        file_obj = importer.import_file(ContentFile(b'data', name='file.txt'), folder)
+        self.assertEqual(importer.file_created, 1)
+        objs = importer.import_files(
+            [ContentFile(b'data', name='file.txt'), ContentFile(b'new', name='new.txt')], folder)
+        self.assertEqual(objs[0], file_obj)
+        self.assertEqual(importer.file_created, 2)
+        for obj in objs:
+            obj.delete()
+
+    def count_import_queries(self, n):
+        folder = Folder.objects.create(name='import %d' % n)
+        importer = FileImporter(verbosity=0)
+        files = [ContentFile(b'data %d' % i, name='file%d.txt' % i) for i in range(n)]
+        with CaptureQueriesContext(connection) as queries:
+            objs = importer.import_files(files, folder)
+            # the existing files are looked up with one query
+            importer.import_files(files, folder)
+        self.assertEqual(File.objects.filter(folder=folder).count(), n)
+        for obj in objs:
+            obj.delete()
+        return len(queries) - n
+
+    def test_import_queries_do_not_grow(self):
+        self.assertEqual(self.count_import_queries(2), self.count_import_queries(10))
+
+    def test_command(self):
+        root = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(root, 'assets', 'sub'))
+            for name in ('a.txt', 'b.txt', os.path.join('sub', 'c.txt')):
+                with open(os.path.join(root, 'assets', name), 'wb') as f:
+                    f.write(name.encode('utf-8'))
+            call_command('import_files', path=os.path.join(root, 'assets'),
+                         folder='imported', verbosity=0)
+        finally:
+            shutil.rmtree(root)
+        sub = Folder.objects.get(name='sub', parent__name='assets',
+                                 parent__parent__name='imported')
+        files = File.objects.filter(folder__in=[sub, sub.parent]).order_by('original_filename')
+        self.assertEqual(
+            [(f.original_filename, f.folder, f.file.read()) for f in files],
+            [('a.txt', sub.parent, b'a.txt'), ('b.txt', sub.parent, b'b.txt'),
+             ('c.txt', sub, os.path.join('sub', 'c.txt').encode('utf-8'))])
+        for f in files:
+            f.delete()
@@ -0,0 +1,699 @@
+#-*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from unittest import skipUnless
+
+import django.core.files
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.utils.six import StringIO
+from easy_thumbnails import engine
+
+from .. import settings as filer_settings
+from ..models import File, Folder, Job, ThumbnailOption
+from ..settings import FILER_IMAGE_MODEL
+from ..templatetags import filer_image_tags
+from ..thumbnail_processors import (
+    REDUCE_FOR,
+    SOURCE_SCALE_INFO,
+    reduced_pil_image,
+    scale_and_crop_with_subject_location,
+)
+from ..utils import filer_easy_thumbnails, jobs, locks, thumbnail_formats, thumbnail_warmup
+from ..utils.compatibility import PILImage
+from ..utils.filer_easy_thumbnails import ImagePyramid
+from ..utils.loader import load_model
+from .helpers import SettingsOverride, create_image, create_superuser
+
+Image = load_model(FILER_IMAGE_MODEL)
+
+
+class ThumbnailTestMixin(object):
+
+    def setUp(self):
+        self.superuser = create_superuser()
+        self.decodes = 0
+        self.old_generate_source_image = engine.generate_source_image
+
+        def generate_source_image(*args, **kwargs):
+            self.decodes += 1
+            return self.old_generate_source_image(*args, **kwargs)
+
+        filer_easy_thumbnails.engine.generate_source_image = generate_source_image
+
+    def tearDown(self):
+        filer_easy_thumbnails.engine.generate_source_image = self.old_generate_source_image
+        for image in Image.objects.all():
+            image.delete()
+
+    def override_settings(self, **overrides):
+        """
+        Overrides filer settings until the end of the test.
+        """
+        for key, value in overrides.items():
+            self.addCleanup(setattr, filer_settings, key, getattr(filer_settings, key))
+            setattr(filer_settings, key, value)
+
+    def create_filer_image(self, size=(800, 600), subject_location=''):
+        data = BytesIO()
+        create_image(size=size).save(data, 'JPEG')
+        file_obj = django.core.files.base.ContentFile(data.getvalue(), name='image.jpg')
+        return Image.objects.create(
+            owner=self.superuser, original_filename='image.jpg', file=file_obj,
+            subject_location=subject_location)
+
+
+class ThumbnailSetTests(ThumbnailTestMixin, TestCase):
+
+    def test_get_thumbnail_set(self):
+        image = self.create_filer_image()
+        options = [
+            {'size': (16, 16), 'crop': True},
+            {'size': (400, 0)},
+            {'size': (64, 48), 'crop': True, 'upscale': True},
+        ]
+        thumbnails = image.file.get_thumbnail_set(options)
+        self.assertEqual(self.decodes, 1)
+        self.assertEqual([(t.width, t.height) for t in thumbnails],
+                         [(16, 16), (400, 300), (64, 48)])
+        for thumbnail in thumbnails:
+            self.assertTrue(image.file.thumbnail_storage.exists(thumbnail.name))
+        # the same thumbnails as generated one by one
+        self.assertEqual([t.name for t in thumbnails],
+                         [image.file.get_thumbnail(o).name for o in options])
+        self.assertEqual(self.decodes, 1)
+        self.assertEqual(len(list(image.file.get_thumbnails())), 3)
+
+    def test_generate_admin_thumbnails(self):
+        image = self.create_filer_image()
+        urls = image.generate_admin_thumbnails({'preview': {'size': (180, 180), 'crop': True}})
+        self.assertEqual(self.decodes, 1)
+        self.assertIn('preview', urls)
+        self.assertEqual(set(image.icons.values()) - set(urls.values()), set())
+        self.assertEqual(set(image.thumbnails.values()) - set(urls.values()), set())
+        self.assertEqual(self.decodes, 1)
+
+
+class ImagePyramidTests(TestCase):
+
+    def test_levels(self):
+        source = create_image(size=(1600, 1200))
+        pyramid = ImagePyramid(source)
+        self.assertIs(pyramid.get_image({'size': (1000, 1000)}), source)
+        self.assertIs(pyramid.get_image({'size': (400, 0)}), pyramid.levels[2])
+        self.assertEqual(pyramid.levels[2].size, (400, 300))
+        self.assertEqual(pyramid.get_image({'size': (32, 32), 'crop': True}).size, (50, 37))
+        self.assertIs(pyramid.get_image({'size': (32, 32), 'box': (0, 0, 10, 10)}), source)
+
+    def test_subject_location(self):
+        source = PILImage.new('RGB', (1600, 1200), 'white')
+        source.paste((255, 0, 0), (1500, 1100, 1600, 1200))
+        options = {'size': (40, 40), 'crop': True, 'subject_location': '1550,1150'}
+        reduced = ImagePyramid(source).get_image(options)
+        self.assertIn(SOURCE_SCALE_INFO, reduced.info)
+        for image in (source, reduced):
+            thumbnail = scale_and_crop_with_subject_location(image, **options)
+            self.assertEqual(thumbnail.size, (40, 40))
+            self.assertEqual(thumbnail.getpixel((39, 39)), (255, 0, 0))
+
+
+class ReducedSourceTests(TestCase):
+
+    def jpeg(self, image, **kwargs):
+        data = BytesIO()
+        image.save(data, 'JPEG', **kwargs)
+        data.seek(0)
+        return data
+
+    def test_draft(self):
+        source = self.jpeg(create_image(size=(1600, 1200)))
+        image = reduced_pil_image(source, size=(32, 32), crop=True)
+        # decoded at 1/8, then halved twice
+        self.assertEqual(image.size, (50, 38))
+        self.assertEqual(image.info[SOURCE_SCALE_INFO], (50 / 1600.0, 38 / 1200.0))
+
+        source.seek(0)
+        image = reduced_pil_image(source, size=(32, 32), **{REDUCE_FOR: [
+            {'size': (32, 32), 'crop': True}, {'size': (400, 0)}]})
+        self.assertEqual(image.size, (400, 300))
+
+        for options in ({'size': (1600, 1600)}, {'size': (32, 32), 'box': (0, 0, 10, 10)}):
+            source.seek(0)
+            image = reduced_pil_image(source, **options)
+            self.assertEqual(image.size, (1600, 1200))
+            self.assertNotIn(SOURCE_SCALE_INFO, image.info)
+
+    def test_exif_orientation(self):
+        im = create_image(size=(1600, 1200))
+        if not hasattr(im, 'getexif'):
+            self.skipTest('Writing EXIF data requires Pillow 6')
+        exif = im.getexif()
+        exif[0x0112] = 6
+        source = self.jpeg(im, exif=exif.tobytes())
+        image = reduced_pil_image(source, size=(300, 0))
+        self.assertEqual(image.size, (300, 400))
+        source.seek(0)
+        image = reduced_pil_image(source, size=(300, 0), exif_orientation=False)
+        self.assertEqual(image.size, (400, 300))
+
+    def test_subject_location(self):
+        im = PILImage.new('RGB', (1600, 1200), 'white')
+        im.paste((255, 0, 0), (1500, 1100, 1600, 1200))
+        options = {'size': (40, 40), 'crop': True, 'subject_location': '1550,1150'}
+        image = reduced_pil_image(self.jpeg(im), **options)
+        self.assertLess(image.size[0], 400)
+        thumbnail = scale_and_crop_with_subject_location(image, **options)
+        self.assertEqual(thumbnail.size, (40, 40))
+        red, green, blue = thumbnail.getpixel((39, 39))
+        self.assertTrue(red > 200 and green < 50 and blue < 50)
+
+
+class GenerateThumbnailsCommandTests(ThumbnailTestMixin, TestCase):
+
+    def setUp(self):
+        super(GenerateThumbnailsCommandTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, 'checkpoint.json')
+
+    def tearDown(self):
+        super(GenerateThumbnailsCommandTests, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def generate(self, **options):
+        stdout = StringIO()
+        call_command('generate_thumbnails', stdout=stdout, stderr=StringIO(),
+                     chunk_size=2, **options)
+        return stdout.getvalue().splitlines()[-1]
+
+    def test_resume(self):
+        images = [self.create_filer_image() for i in range(3)]
+        self.assertEqual(self.generate(checkpoint=self.checkpoint),
+                         'Generated thumbnails of 3 images, 0 failed')
+        self.assertEqual(self.decodes, 3)
+        for image in images:
+            self.assertEqual(len(list(image.file.get_thumbnails())), 5)
+        with open(self.checkpoint) as checkpoint:
+            self.assertEqual(json.load(checkpoint), {'done': [[0, images[-1].pk]]})
+
+        image = self.create_filer_image()
+        self.assertEqual(self.generate(checkpoint=self.checkpoint),
+                         'Generated thumbnails of 1 images, 0 failed')
+        self.assertEqual(self.decodes, 4)
+        self.assertEqual(len(list(image.file.get_thumbnails())), 5)
+
+    def test_filters(self):
+        folder = Folder.objects.create(name='folder')
+        subfolder = Folder.objects.create(name='subfolder', parent=folder)
+        image = self.create_filer_image()
+        image.folder = subfolder
+        image.save()
+        self.create_filer_image()
+        self.assertEqual(self.generate(folder=folder.pk),
+                         'Generated thumbnails of 1 images, 0 failed')
+        self.assertEqual(self.generate(missing_only=True),
+                         'Generated thumbnails of 1 images, 0 failed')
+        self.assertEqual(self.generate(missing_only=True),
+                         'Generated thumbnails of 0 images, 0 failed')
+        self.assertEqual(self.generate(modified_since='2999-01-01'),
+                         'Generated thumbnails of 0 images, 0 failed')
+        self.assertEqual(self.decodes, 2)
+
+
+class ThumbnailIndexTests(ThumbnailTestMixin, TestCase):
+    options = [{'size': (16, 16), 'crop': True}, {'size': (64, 0)}]
+
+    def setUp(self):
+        super(ThumbnailIndexTests, self).setUp()
+        self.override_settings(FILER_THUMBNAIL_INDEX_CACHE='default')
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def existing_thumbnails(self, image):
+        return [image.file.get_existing_thumbnail(options) for options in self.options]
+
+    def test_index(self):
+        image = self.create_filer_image()
+        image.file.get_thumbnail_set(self.options)
+        image = Image.objects.get(pk=image.pk)
+        with self.assertNumQueries(0):
+            thumbnails = self.existing_thumbnails(image)
+        self.assertEqual([(t.width, t.height) for t in thumbnails], [(16, 16), (64, 48)])
+
+        # missing entries are loaded with one query
+        cache.clear()
+        image = Image.objects.get(pk=image.pk)
+        with self.assertNumQueries(1):
+            self.assertNotIn(None, self.existing_thumbnails(image))
+
+        image.file.delete_thumbnails()
+        image = Image.objects.get(pk=image.pk)
+        self.assertEqual(self.existing_thumbnails(image), [None, None])
+
+    def touch_source(self, image):
+        modtime = time.time() + 60
+        os.utime(image.file.path, (modtime, modtime))
+
+    def test_replaced_source(self):
+        image = self.create_filer_image()
+        image.file.get_thumbnail_set(self.options)
+        image = Image.objects.get(pk=image.pk)
+        self.assertNotIn(None, self.existing_thumbnails(image))
+        self.touch_source(image)
+        image = Image.objects.get(pk=image.pk)
+        self.assertEqual(self.existing_thumbnails(image), [None, None])
+
+    def test_rebuild(self):
+        image = self.create_filer_image()
+        other = self.create_filer_image()
+        image.file.get_thumbnail_set(self.options)
+        cache.clear()
+        stdout = StringIO()
+        call_command('filer_thumbnail_index', stdout=stdout)
+        self.assertIn('Indexed 2 thumbnails of 2 public files', stdout.getvalue())
+        image = Image.objects.get(pk=image.pk)
+        other = Image.objects.get(pk=other.pk)
+        with self.assertNumQueries(0):
+            self.assertNotIn(None, self.existing_thumbnails(image))
+            self.assertEqual(self.existing_thumbnails(other), [None, None])
+
+        # thumbnails older than their source are not indexed
+        self.touch_source(image)
+        call_command('filer_thumbnail_index', batch_size=1, stdout=stdout)
+        self.assertIn('Indexed 0 thumbnails of 2 public files', stdout.getvalue())
+
+
+class LazyThumbnailTests(ThumbnailTestMixin, TestCase):
+
+    def setUp(self):
+        super(LazyThumbnailTests, self).setUp()
+        self.override_settings(FILER_LAZY_THUMBNAILS=True)
+
+    def test_public(self):
+        image = self.create_filer_image()
+        icons = image.icons
+        self.assertEqual(self.decodes, 0)
+        url = icons['32']
+        self.assertTrue(url.startswith('/filer/lazy-thumbnails/'))
+        self.assertIn('/image.jpg__32x32_q85_crop', url)
+        # the url doesn't change until the thumbnail exists
+        self.assertEqual(image.icons['32'], url)
+
+        response = self.client.get(url)
+        self.assertEqual(self.decodes, 1)
+        thumbnail_url = image.icons['32']
+        self.assertNotEqual(thumbnail_url, url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(thumbnail_url))
+        # generated once
+        self.client.get(url)
+        self.assertEqual(self.decodes, 1)
+
+    def test_private(self):
+        image = self.create_filer_image()
+        image.is_public = False
+        image.save()
+        url = image.icons['32']
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.decodes, 0)
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.decodes, 1)
+
+    def test_tampered(self):
+        image = self.create_filer_image()
+        url = image.icons['32']
+        token = url.split('/')[-2]
+        self.assertEqual(self.client.get(url.replace(token, token[1:])).status_code, 404)
+
+
+class GenerationLockTests(ThumbnailTestMixin, TestCase):
+    options = {'size': (32, 32), 'crop': True}
+
+    def setUp(self):
+        super(GenerationLockTests, self).setUp()
+        self.override_settings(FILER_THUMBNAIL_LOCK_WAIT=0.2)
+        self.addCleanup(setattr, locks, 'time', locks.time)
+
+    def hold_lock(self, image, options, other=None):
+        """
+        Acquires the lock of the thumbnail, like a concurrent process.
+        If ``other`` is given, the thumbnail is generated by it while the
+        thumbnailer under test waits.
+        """
+        name = image.file.get_lock_name(image.file.get_options(options))
+        token = locks.acquire(name)
+        self.assertTrue(token)
+
+        class FakeTime(object):
+            time = staticmethod(time.time)
+
+            @staticmethod
+            def sleep(seconds):
+                if other is not None and locks.get_key(name) in locks._held:
+                    # the lock holder generates the thumbnail
+                    thumbnail = other.file.generate_thumbnail(other.file.get_options(options))
+                    other.file.save_thumbnail(thumbnail)
+                    locks.release(name, token)
+
+        locks.time = FakeTime
+        return name, token
+
+    def test_locks(self):
+        self.override_settings(FILER_THUMBNAIL_LOCK_CACHE=None)
+        for cache_name in (None, 'default'):
+            filer_settings.FILER_THUMBNAIL_LOCK_CACHE = cache_name
+            try:
+                token = locks.acquire('name')
+                self.assertTrue(token)
+                self.assertIsNone(locks.acquire('name', wait=0.1))
+                self.assertTrue(locks.acquire('other'))
+                locks.release('name', 'wrong token')
+                self.assertIsNone(locks.acquire('name'))
+                locks.release('name', token)
+                with locks.lock('name') as acquired:
+                    self.assertTrue(acquired)
+                    with locks.lock('name') as acquired:
+                        self.assertFalse(acquired)
+                self.assertTrue(locks.acquire('name'))
+            finally:
+                cache.clear()
+                locks._held.clear()
+
+    def test_wait_for_other(self):
+        image = self.create_filer_image()
+        other = Image.objects.get(pk=image.pk)
+        self.hold_lock(image, self.options, other)
+        thumbnail = image.file.get_thumbnail(self.options)
+        # only generated by the other process
+        self.assertEqual(self.decodes, 1)
+        self.assertEqual(thumbnail.name, other.file.get_existing_thumbnail(self.options).name)
+
+    def test_wait_timeout(self):
+        image = self.create_filer_image()
+        name, token = self.hold_lock(image, self.options)
+        image.file.get_thumbnail(self.options)
+        self.assertEqual(self.decodes, 1)
+        locks.release(name, token)
+
+    def test_thumbnail_set(self):
+        image = self.create_filer_image()
+        other = Image.objects.get(pk=image.pk)
+        self.hold_lock(image, self.options, other)
+        thumbnails = image.file.get_thumbnail_set([self.options, {'size': (64, 64)}])
+        self.assertEqual(self.decodes, 2)
+        self.assertEqual([(t.width, t.height) for t in thumbnails], [(32, 32), (64, 48)])
+
+
+class ThumbnailFormatTests(ThumbnailTestMixin, TestCase):
+    # GIF stands in for modern formats, Pillow may be built without WebP
+    # (PNG thumbnails are also the transparent versions of the default format)
+
+    def setUp(self):
+        super(ThumbnailFormatTests, self).setUp()
+        self.factory = RequestFactory()
+
+    def get_content(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def test_thumbnail_name(self):
+        image = self.create_filer_image()
+        thumbnail = image.file.get_thumbnail({'size': (32, 32), 'format': 'gif'})
+        self.assertIn('image.jpg__32x32_q85_', thumbnail.name)
+        self.assertTrue(thumbnail.name.endswith('.gif'))
+        self.assertEqual(PILImage.open(thumbnail).format, 'GIF')
+        # formats Pillow can't write are ignored
+        thumbnail = image.file.get_thumbnail({'size': (32, 32), 'format': 'unknown'})
+        self.assertTrue(thumbnail.name.endswith('.jpg'))
+
+    @skipUnless(thumbnail_formats.is_supported('webp'), 'Pillow is built without WebP')
+    def test_webp(self):
+        image = self.create_filer_image()
+        thumbnail = image.file.get_thumbnail({'size': (32, 32), 'format': 'webp'})
+        self.assertTrue(thumbnail.name.endswith('.webp'))
+        self.assertEqual(PILImage.open(thumbnail).format, 'WEBP')
+
+    def test_negotiate_format(self):
+        request = self.factory.get('/', HTTP_ACCEPT='image/avif,image/gif;q=0.9,*/*;q=0.8')
+        self.assertEqual(thumbnail_formats.negotiate_format(request, ['unknown', 'gif']), 'gif')
+        self.assertEqual(thumbnail_formats.negotiate_format(request, 'png'), None)
+        request = self.factory.get('/', HTTP_ACCEPT='image/gif;q=0, image/*')
+        self.assertEqual(thumbnail_formats.negotiate_format(request, ['gif']), None)
+        self.override_settings(FILER_THUMBNAIL_FORMATS=())
+        request = self.factory.get('/', HTTP_ACCEPT='image/gif')
+        self.assertEqual(thumbnail_formats.negotiate_format(request), None)
+        self.override_settings(FILER_THUMBNAIL_FORMATS=('gif',))
+        self.assertEqual(thumbnail_formats.negotiate_format(request), 'gif')
+
+    def test_template_tag(self):
+        image = self.create_filer_image()
+        option = ThumbnailOption.objects.create(name='small', width=32, height=32, formats='gif')
+        template = Template('{% load filer_image_tags %}{% filer_thumbnail_url image option %}')
+        request = self.factory.get('/', HTTP_ACCEPT='image/gif')
+        url = template.render(Context({'image': image, 'option': option, 'request': request}))
+        self.assertTrue(url.endswith('.gif'))
+        request = self.factory.get('/', HTTP_ACCEPT='text/html,*/*')
+        url = template.render(Context({'image': image, 'option': option, 'request': request}))
+        self.assertTrue(url.endswith('.jpg'))
+
+    def test_private_thumbnail(self):
+        self.override_settings(FILER_THUMBNAIL_FORMATS=('gif',))
+        image = self.create_filer_image()
+        image.is_public = False
+        image.save()
+        options = {'size': (32, 32), 'crop': True}
+        url = image.file.get_thumbnail(options).url
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(url, HTTP_ACCEPT='image/gif')
+        self.assertEqual(PILImage.open(BytesIO(self.get_content(response))).format, 'JPEG')
+        self.assertIn('Accept', response['Vary'])
+        # served as GIF once it is generated in it
+        image.file.get_thumbnail(dict(options, format='gif'))
+        response = self.client.get(url, HTTP_ACCEPT='image/gif')
+        self.assertEqual(PILImage.open(BytesIO(self.get_content(response))).format, 'GIF')
+        response = self.client.get(url, HTTP_ACCEPT='image/*')
+        self.assertEqual(PILImage.open(BytesIO(self.get_content(response))).format, 'JPEG')
+
+    def test_private_thumbnail_indexed_variant(self):
+        self.override_settings(FILER_THUMBNAIL_FORMATS=('gif',), FILER_THUMBNAIL_INDEX_CACHE='default')
+        cache.clear()
+        self.addCleanup(cache.clear)
+        image = self.create_filer_image()
+        image.is_public = False
+        image.save()
+        options = {'size': (32, 32), 'crop': True}
+        thumbnail = image.file.get_thumbnail(options)
+        # a file the thumbnailer didn't save isn't probed in the storage
+        data = BytesIO()
+        create_image(size=(32, 32)).save(data, 'GIF')
+        storage = image.file.thumbnail_storage
+        variant = thumbnail_formats.get_variant_name(thumbnail.name, 'gif')
+        storage.save(variant, django.core.files.base.ContentFile(data.getvalue()))
+        self.addCleanup(storage.delete, variant)
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(thumbnail.url, HTTP_ACCEPT='image/gif')
+        self.assertEqual(PILImage.open(BytesIO(self.get_content(response))).format, 'JPEG')
+        storage.delete(variant)
+        image.file.get_thumbnail(dict(options, format='gif'))
+        response = self.client.get(thumbnail.url, HTTP_ACCEPT='image/gif')
+        self.assertEqual(PILImage.open(BytesIO(self.get_content(response))).format, 'GIF')
+
+
+class ThumbnailGarbageCollectionTests(ThumbnailTestMixin, TestCase):
+
+    def setUp(self):
+        super(ThumbnailGarbageCollectionTests, self).setUp()
+        # without the thumbnails left behind by other tests
+        self.directory = tempfile.mkdtemp()
+        self.thumbnail_storages = File._meta.get_field('file').thumbnail_storages
+        self.old_storage = self.thumbnail_storages['public']
+        self.thumbnail_storages['public'] = FileSystemStorage(
+            location=self.directory, base_url='/media/thumbnails/')
+
+    def tearDown(self):
+        super(ThumbnailGarbageCollectionTests, self).tearDown()
+        self.thumbnail_storages['public'] = self.old_storage
+        shutil.rmtree(self.directory)
+
+    def collect(self, **options):
+        stdout = StringIO()
+        call_command('filer_thumbnail_gc', stdout=stdout, **options)
+        # the listed thumbnails and the summary of the public storage
+        lines = stdout.getvalue().splitlines()
+        return ([line for line in lines if ' thumbnails (' not in line],
+                [line for line in lines if ' public thumbnails (' in line][0])
+
+    def test_collect(self):
+        image = self.create_filer_image(subject_location='400,300')
+        admin_thumbnails = list(image.generate_admin_thumbnails().values())
+        other = image.file.get_thumbnail({'size': (20, 20)})
+        storage = image.file.thumbnail_storage
+        orphan = storage.save(
+            posixpath.join(image.file.thumbnail_basedir, 'gone', 'image.jpg__32x32_q85.jpg'),
+            django.core.files.base.ContentFile(b'thumbnail'))
+
+        names, line = self.collect(dry_run=True, unused=True)
+        self.assertEqual(sorted(names), sorted([
+            '{0} (orphaned)'.format(orphan), '{0} (unknown options)'.format(other.name)]))
+        self.assertTrue(line.startswith('Would delete 2 public thumbnails (1 orphaned, 1 with unknown options)'))
+        self.assertTrue(storage.exists(orphan))
+        self.assertTrue(storage.exists(other.name))
+
+        # only orphaned thumbnails by default
+        self.assertEqual(self.collect(rate=100)[1],
+                         'Deleted 1 public thumbnails (1 orphaned, 0 with unknown options), '
+                         'reclaiming 9 bytes')
+        self.assertFalse(storage.exists(orphan))
+        self.assertTrue(storage.exists(other.name))
+
+        self.assertTrue(self.collect(unused=True)[1].startswith(
+            'Deleted 1 public thumbnails (0 orphaned, 1 with unknown options)'))
+        self.assertFalse(storage.exists(other.name))
+        image = Image.objects.get(pk=image.pk)
+        self.assertIsNone(image.file.get_existing_thumbnail({'size': (20, 20)}))
+        self.assertEqual(sorted(image.generate_admin_thumbnails().values()), sorted(admin_thumbnails))
+        self.assertEqual(self.decodes, 2)
+
+
+class ThumbnailWarmUpTests(ThumbnailTestMixin, TransactionTestCase):
+    # jobs are submitted once the transaction is committed
+
+    def setUp(self):
+        super(ThumbnailWarmUpTests, self).setUp()
+        self.option = ThumbnailOption.objects.create(name='small', width=64, height=64)
+        self.client.login(username='admin', password='secret')
+
+    def upload(self):
+        data = BytesIO()
+        create_image(size=(800, 600)).save(data, 'JPEG')
+        self.client.post(reverse('admin:filer-ajax_upload'), {
+            'Filename': 'image.jpg',
+            'Filedata': SimpleUploadedFile('image.jpg', data.getvalue(), 'image/jpeg'),
+        })
+        return Image.objects.latest('pk')
+
+    def test_upload(self):
+        with SettingsOverride(filer_settings, FILER_THUMBNAIL_WARMUP=True, FILER_BACKGROUND_JOBS=True):
+            image = self.upload()
+        job = Job.objects.get()
+        self.assertEqual(job.handler, thumbnail_warmup.HANDLER)
+        self.assertEqual(job.get_items(), [image.pk])
+        self.assertIsNone(image.file.get_existing_thumbnail(self.option.as_dict))
+        jobs.run_pending_jobs()
+        self.assertEqual(Job.objects.get().affected, 1)
+        self.assertIsNotNone(image.file.get_existing_thumbnail(self.option.as_dict))
+
+        with SettingsOverride(filer_settings, FILER_THUMBNAIL_WARMUP=False):
+            self.upload()
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_option_admin(self):
+        folder = Folder.objects.create(name='folder')
+        subfolder = Folder.objects.create(name='subfolder', parent=folder)
+        image = self.create_filer_image()
+        image.folder = subfolder
+        image.save()
+        other = self.create_filer_image()
+        with SettingsOverride(filer_settings, FILER_BACKGROUND_JOBS=True):
+            response = self.client.post(reverse('admin:filer_thumbnailoption_add'), {
+                'name': 'large', 'width': 400, 'height': 300, 'crop': 'on',
+                'formats': '', 'warm_up': 'on', 'warm_up_folders': [folder.pk],
+            })
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('admin:filer-job_progress', args=(job.pk,)),
+                             fetch_redirect_response=False)
+        self.assertEqual(job.get_items(), [image.pk])
+        jobs.run_pending_jobs()
+        option = ThumbnailOption.objects.get(name='large')
+        self.assertIsNotNone(image.file.get_existing_thumbnail(option.as_dict))
+        self.assertIsNone(other.file.get_existing_thumbnail(option.as_dict))
+        self.assertEqual(self.decodes, 1)
+
+        # without background jobs, right away
+        response = self.client.post(
+            reverse('admin:filer_thumbnailoption_change', args=(option.pk,)), {
+                'name': 'large', 'width': 400, 'height': 300, 'crop': 'on',
+                'formats': '', 'warm_up': 'on',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNotNone(other.file.get_existing_thumbnail(option.as_dict))
+        self.assertEqual(self.decodes, 2)
+
+    def test_option_admin_synchronous_limit(self):
+        self.create_filer_image()
+        self.create_filer_image()
+        with SettingsOverride(filer_settings, FILER_THUMBNAIL_WARMUP=True):
+            response = self.client.get(reverse('admin:filer_thumbnailoption_add'))
+        self.assertFalse(response.context['adminform'].form['warm_up'].value())
+        with SettingsOverride(thumbnail_warmup, MAX_SYNCHRONOUS_IMAGES=1):
+            response = self.client.post(reverse('admin:filer_thumbnailoption_add'), {
+                'name': 'large', 'width': 400, 'height': 300,
+                'formats': '', 'warm_up': 'on',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('warm_up', response.context['adminform'].form.errors)
+        self.assertFalse(ThumbnailOption.objects.filter(name='large').exists())
+        self.assertEqual(self.decodes, 0)
+
+
+class SrcsetTests(ThumbnailTestMixin, TestCase):
+
+    def setUp(self):
+        super(SrcsetTests, self).setUp()
+        self.override_settings(FILER_THUMBNAIL_INDEX_CACHE='default')
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def render(self, template, **context):
+        return Template('{% load filer_image_tags %}' + template).render(Context(context))
+
+    def test_widths(self):
+        image = self.create_filer_image(subject_location='400,300')
+        html = self.render('{% filer_srcset image "400,200,1000" sizes="50vw" %}', image=image)
+        self.assertEqual(self.decodes, 1)
+        srcset = html.split('"')[1].split(', ')
+        self.assertEqual([candidate.rsplit(' ', 1)[1] for candidate in srcset], ['200w', '400w'])
+        self.assertIn('subject_location-400%2C300', srcset[0])
+        self.assertTrue(html.endswith('sizes="50vw"'))
+        # existing thumbnails are found in one entry of the thumbnail index
+        image = Image.objects.get(pk=image.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.render('{% filer_srcset image "400,200,1000" sizes="50vw" %}', image=image), html)
+        self.assertEqual(self.decodes, 1)
+
+    def test_thumbnail_option(self):
+        image = self.create_filer_image()
+        option = ThumbnailOption.objects.create(name='small', width=100, height=50, upscale=False)
+        html = self.render('{% filer_srcset image option %}', image=image, option=option)
+        self.assertEqual(self.decodes, 1)
+        self.assertIn(' 100w, ', html)
+        self.assertIn(' 200w"', html)
+        self.assertIn('__200x100_', html)
+        self.assertTrue(html.endswith('sizes="100px"'))
+        # the candidates only have the size of the option
+        self.assertEqual(filer_image_tags.get_srcset_options(image, option), [
+            (100, {'size': (100, 50), 'crop': True, 'upscale': False}),
+            (200, {'size': (200, 100), 'crop': True, 'upscale': False}),
+        ])
+
+    def test_thumbnail_option_without_width(self):
+        image = self.create_filer_image()
+        option = ThumbnailOption.objects.create(name='height', width=0, height=50)
+        self.assertEqual(filer_image_tags.get_srcset_options(image, option), [])
+        self.assertEqual(self.render('{% filer_srcset image option %}', image=image, option=option), '')
+        self.assertEqual(self.decodes, 0)
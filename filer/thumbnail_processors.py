@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import math
 import re
 
 from django.utils import six
@@ -23,6 +24,31 @@ except ImportError:
 
 RE_SUBJECT_LOCATION = re.compile(r'^(\d+),(\d+)$')
 
+# Key in ``Image.info`` of images which were downscaled before being passed to
+# the processors, the ``(x, y)`` ratio of their size to the size of the source
+# image. Coordinates like ``subject_location`` are relative to the source.
+SOURCE_SCALE_INFO = 'filer_source_scale'
+
+# Option passed to ``reduced_pil_image`` with the list of thumbnail options
+# the decoded image has to be large enough for (uppercase options are not
+# part of thumbnail names).
+REDUCE_FOR = 'REDUCE_FOR'
+
+# modes which can be downscaled by averaging pixels
+REDUCIBLE_MODES = ('1', 'L', 'LA', 'RGB', 'RGBA', 'CMYK')
+
+# transpositions applying the EXIF orientation, like
+# ``easy_thumbnails.utils.exif_orientation``
+EXIF_TRANSPOSITIONS = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.TRANSPOSE,),
+    6: (Image.ROTATE_270,),
+    7: (Image.TRANSVERSE,),
+    8: (Image.ROTATE_90,),
+}
+
 
 def normalize_subject_location(subject_location):
     if subject_location:
@@ -38,6 +64,103 @@ def normalize_subject_location(subject_location):
     return False
 
 
+def scale_subject_location(im, subject_location):
+    """
+    Returns ``subject_location`` (in pixels of the source image) in pixels of
+    ``im``, which may be a downscaled version of the source.
+    """
+    scale_x, scale_y = im.info.get(SOURCE_SCALE_INFO, (1, 1))
+    return (subject_location[0] * scale_x, subject_location[1] * scale_y)
+
+
+def get_required_scale(source_size, thumbnail_options):
+    """
+    Returns the factor the source image is scaled by to produce a thumbnail
+    with ``thumbnail_options`` (see ``easy_thumbnails.processors.scale_and_crop``).
+    """
+    source_x, source_y = [float(v) for v in source_size]
+    target_x, target_y = [float(v or 0) for v in thumbnail_options['size']]
+    if not source_x or not source_y:
+        return 1.0
+    if not target_x:
+        scale = target_y / source_y
+    elif not target_y:
+        scale = target_x / source_x
+    elif thumbnail_options.get('crop'):
+        scale = max(target_x / source_x, target_y / source_y)
+    else:
+        scale = min(target_x / source_x, target_y / source_y)
+    if thumbnail_options.get('zoom'):
+        scale *= (100 + int(thumbnail_options['zoom'])) / 100.0
+    return scale
+
+
+def _get_exif_orientation(im):
+    try:
+        exif = im._getexif()
+    except Exception:
+        exif = None
+    return exif.get(0x0112) if exif else None
+
+
+def reduced_pil_image(source, exif_orientation=True, **options):
+    """
+    A replacement for ``easy_thumbnails.source_generators.pil_image`` which
+    decodes the image at the smallest power of two scale that still covers
+    the requested thumbnail. JPEG images are decoded in draft mode (the
+    decoder only computes the reduced image), other images are reduced right
+    after decoding. The scale is stored in ``im.info[SOURCE_SCALE_INFO]``, so
+    ``scale_and_crop_with_subject_location`` can adjust the subject location.
+
+    Images are not reduced for options with a ``box`` (the crop box is in
+    pixels of the source).
+    """
+    if not source:
+        return
+    source = six.BytesIO(source.read())
+    im = Image.open(source)
+    orientation = _get_exif_orientation(im) if exif_orientation else None
+    transpositions = EXIF_TRANSPOSITIONS.get(orientation, ())
+    original_size = im.size
+    if orientation in (5, 6, 7, 8):
+        oriented_size = (original_size[1], original_size[0])
+    else:
+        oriented_size = original_size
+
+    options_list = options.get(REDUCE_FOR) or [options]
+    if any('box' in opts or not opts.get('size') for opts in options_list):
+        scale = 1.0
+    else:
+        scale = max(get_required_scale(oriented_size, opts) for opts in options_list)
+
+    if scale <= 0.5 and im.format == 'JPEG':
+        im.draft(im.mode, (int(math.ceil(original_size[0] * scale)),
+                           int(math.ceil(original_size[1] * scale))))
+    # Fully load the image now to catch any problems with the image contents,
+    # swallowing "Image file truncated" errors the first time (like
+    # ``pil_image``).
+    try:
+        im.load()
+    except IOError:
+        pass
+    im.load()
+
+    factor = 1
+    remaining = scale * original_size[0] / im.size[0]
+    while remaining * factor * 2 <= 1 and min(im.size) // (factor * 2):
+        factor *= 2
+    if factor > 1 and im.mode in REDUCIBLE_MODES and hasattr(im, 'reduce'):
+        im = im.reduce(factor)
+
+    for method in transpositions:
+        im = im.transpose(method)
+    if im.size != oriented_size:
+        im.info[SOURCE_SCALE_INFO] = (
+            float(im.size[0]) / oriented_size[0],
+            float(im.size[1]) / oriented_size[1])
+    return im
+
+
 def scale_and_crop_with_subject_location(im, size, subject_location=False,
                                          zoom=None, crop=False, upscale=False,
                                          **kwargs):
@@ -52,6 +175,8 @@ def scale_and_crop_with_subject_location(im, size, subject_location=False,
     parameters will be ignored.
     """
     subject_location = normalize_subject_location(subject_location)
+    if subject_location:
+        subject_location = scale_subject_location(im, subject_location)
     if not (subject_location and crop):
         # use the normal scale_and_crop
         return processors.scale_and_crop(im, size, zoom=zoom, crop=crop,
@@ -6,6 +6,7 @@ from django.conf.urls import url
 
 from . import settings as filer_settings
 from . import views
+from .server import views as server_views
 
 urlpatterns = [
     url(
@@ -13,4 +14,9 @@ urlpatterns = [
         views.canonical,
         name='canonical'
     ),
+    url(
+        r'^lazy-thumbnails/(?P<token>[^/]+)/(?P<filename>[^/]+)$',
+        server_views.serve_lazy_thumbnail,
+        name='lazy_thumbnail'
+    ),
 ]
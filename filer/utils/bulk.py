@@ -0,0 +1,747 @@
+# -*- coding: utf-8 -*-
+"""
+Set based operations on many files and folders at once.
+
+The per object code paths (``File.delete()`` etc.) issue several queries and
+a synchronous storage call per object, which adds up for large selections.
+The functions in this module work on batches of rows with a constant number
+of queries per batch. Changes to the storages are only made once the
+transaction commits, so a batch which fails and is rolled back leaves the
+stored files alone.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import itertools
+import logging
+import os
+from collections import defaultdict
+
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.db.models import Case, CharField, F, Q, Value, When
+from django.utils import timezone
+from django.utils.encoding import force_text
+from easy_thumbnails.models import Source, Thumbnail
+from easy_thumbnails.utils import get_storage_hash
+
+from . import thumbnail_index
+from .executor import StorageExecutor
+from .storage import change_visibility, stage_visibility_change
+
+logger = logging.getLogger(__name__)
+
+# rows changed by one UPDATE with a CASE expression (3 query parameters per
+# row, SQLite allows 999)
+UPDATE_BATCH_SIZE = 300
+
+
+def on_commit(func):
+    """
+    Calls ``func`` once the current transaction is committed. Django < 1.9
+    can't defer it, in which case ``func`` is called right away.
+    """
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    else:
+        func()
+
+
+def get_folder_ids_recursive(folders):
+    """
+    Returns the ids of ``folders`` and of all their descendants, in one query.
+    """
+    from ..models import Folder
+
+    opts = Folder._mptt_meta
+    query = Q()
+    for folder in folders:
+        query |= Q(**{
+            opts.tree_id_attr: getattr(folder, opts.tree_id_attr),
+            '%s__gte' % opts.left_attr: getattr(folder, opts.left_attr),
+            '%s__lte' % opts.right_attr: getattr(folder, opts.right_attr),
+        })
+    if not query:
+        return set()
+    return set(Folder.objects.filter(query).values_list('pk', flat=True))
+
+
+def log_deletions(user_id, rows):
+    """
+    Writes the admin log entries for deleted objects in one query. ``rows``
+    are ``(content type id, object id, object repr)`` tuples.
+    """
+    LogEntry.objects.bulk_create([
+        LogEntry(
+            user_id=user_id,
+            content_type_id=content_type_id,
+            object_id=force_text(object_id),
+            object_repr=force_text(object_repr)[:200],
+            action_flag=DELETION,
+            change_message='',
+        )
+        for content_type_id, object_id, object_repr in rows
+    ])
+
+
+def delete_from_storages(removals):
+    """
+    Deletes the ``(storage, name)`` files in ``removals`` concurrently.
+    Failures are logged.
+    """
+    removals = list(removals)
+    if not removals:
+        return
+    with StorageExecutor() as executor:
+        for storage, name in removals:
+            executor.delete(storage, name)
+        results = executor.results(return_exceptions=True)
+    for (storage, name), result in zip(removals, results):
+        if isinstance(result, Exception):
+            logger.error('Failed to delete %s: %s', name, result)
+
+
+def _delete_thumbnail_caches(field, blobs):
+    """
+    Deletes the easy-thumbnails cache entries of the source files ``blobs``
+    (``(name, is_public)`` tuples) and returns the ``(storage, name)`` of
+    their thumbnails, like ``ThumbnailerFieldFile.delete()`` does.
+    """
+    removals = []
+    for is_public in (True, False):
+        key = 'public' if is_public else 'private'
+        names = [name for name, public in blobs if public == is_public]
+        if not names:
+            continue
+        thumbnail_storage = field.thumbnail_storages[key]
+        thumbnail_index.clear(thumbnail_storage, names)
+        source_ids = list(Source.objects.filter(
+            name__in=names, storage_hash=get_storage_hash(field.storages[key]),
+        ).values_list('pk', flat=True))
+        if not source_ids:
+            continue
+        thumbnails = Thumbnail.objects.filter(
+            source__in=source_ids,
+            storage_hash=get_storage_hash(thumbnail_storage))
+        removals.extend(
+            (thumbnail_storage, name)
+            for name in thumbnails.values_list('name', flat=True))
+        Source.objects.filter(pk__in=source_ids).delete()
+    return removals
+
+
+def delete_files(file_ids, user_id=None):
+    """
+    Deletes the files with ``file_ids`` and returns how many were deleted.
+
+    Files which are the last reference to their stored file are removed from
+    the storage together with their thumbnails, after the transaction is
+    committed. If ``user_id`` is given, admin log entries are written.
+    ``delete()`` of the models is not called.
+    """
+    from ..models import File
+
+    files = File.objects.non_polymorphic().filter(pk__in=file_ids)
+    rows = list(files.values_list(
+        'pk', 'file', 'is_public', 'name', 'original_filename',
+        'polymorphic_ctype_id'))
+    if not rows:
+        return 0
+    pks = [row[0] for row in rows]
+    blobs = set((name, is_public) for pk, name, is_public, _, _, _ in rows if name)
+    # stored files still referenced by other files have to stay
+    referenced = set(File.objects.filter(
+        file__in=set(name for name, is_public in blobs),
+    ).exclude(pk__in=pks).values_list('file', 'is_public').distinct())
+    orphans = blobs - referenced
+
+    if user_id is not None:
+        default_content_type_id = ContentType.objects.get_for_model(File).pk
+        log_deletions(user_id, [
+            (content_type_id or default_content_type_id, pk,
+             name if name not in ('', None) else '%s' % (original_filename,))
+            for pk, _, _, name, original_filename, content_type_id in rows
+        ])
+
+    field = File._meta.get_field('file')
+    removals = _delete_thumbnail_caches(field, orphans)
+    removals.extend(
+        (field.storages['public' if is_public else 'private'], name)
+        for name, is_public in orphans)
+    File.objects.non_polymorphic().filter(pk__in=pks).delete()
+    on_commit(lambda: delete_from_storages(removals))
+    return len(pks)
+
+
+def delete_folders(folder_ids, user_id=None):
+    """
+    Deletes the folders with ``folder_ids`` including their subfolders and
+    files. Returns the number of deleted folders (without subfolders).
+    """
+    from ..models import File, Folder
+
+    folders = list(Folder.objects.filter(pk__in=folder_ids))
+    if not folders:
+        return 0
+    # The delete cascade would delete the files too, but without removing
+    # them from the storage.
+    file_ids = File.objects.filter(
+        folder__in=get_folder_ids_recursive(folders)).values_list('pk', flat=True)
+    delete_files(list(file_ids), user_id)
+    if user_id is not None:
+        content_type_id = ContentType.objects.get_for_model(Folder).pk
+        log_deletions(user_id, [
+            (content_type_id, folder.pk, force_text(folder)) for folder in folders
+        ])
+    for folder in folders:
+        # fetched again, deleting a folder shifts the tree fields of others
+        Folder.objects.get(pk=folder.pk).delete()
+    return len(folders)
+
+
+def format_file_name(rename_format, name, original_filename, folder_name,
+                     counter, global_counter):
+    """
+    Returns the new name of a file for the "Rename files" admin action.
+    ``counter`` and ``global_counter`` are 0-based.
+    """
+    original_basename, original_extension = os.path.splitext(original_filename)
+    if name:
+        current_basename, current_extension = os.path.splitext(name)
+    else:
+        current_basename = ""
+        current_extension = ""
+    return rename_format % {
+        'original_filename': original_filename,
+        'original_basename': original_basename,
+        'original_extension': original_extension,
+        'current_filename': name or "",
+        'current_basename': current_basename,
+        'current_extension': current_extension,
+        'current_folder': folder_name or '',
+        'counter': counter + 1,  # 1-based
+        'global_counter': global_counter + 1,  # 1-based
+    }
+
+
+def _file_label(row):
+    # same as File.label, which files are sorted by
+    pk, name, original_filename, folder_name = row
+    if name in ('', None):
+        return (original_filename or 'unnamed file').lower()
+    return name.lower()
+
+
+def plan_rename(files, folders, rename_format, global_counter=0):
+    """
+    Returns ``(pk, new name)`` for ``files`` and all files in ``folders`` and
+    their descendants, with a constant number of queries.
+
+    Files are numbered folder by folder, depth first: the files of the
+    subfolders (in name order) come before the files of a folder, the selected
+    ``files`` come last. Within a folder files are sorted by label.
+    ``counter`` restarts for every folder, ``global_counter`` does not and
+    starts at the given value.
+    """
+    from ..models import File, Folder
+
+    folder_ids = get_folder_ids_recursive(folders)
+    children = defaultdict(list)
+    folder_names = {}
+    for pk, parent_id, name in Folder.objects.filter(
+            pk__in=folder_ids).values_list('pk', 'parent_id', 'name'):
+        children[parent_id].append(pk)
+        folder_names[pk] = name
+    files_by_folder = defaultdict(list)
+    for pk, name, original_filename, folder_id in File.objects.filter(
+            folder__in=folder_ids).values_list(
+            'pk', 'name', 'original_filename', 'folder_id'):
+        files_by_folder[folder_id].append(
+            (pk, name, original_filename, folder_names[folder_id]))
+
+    groups = []
+
+    def walk(folder_ids):
+        for folder_id in folder_ids:
+            walk(children[folder_id])
+            groups.append(files_by_folder[folder_id])
+
+    walk([folder.pk for folder in folders])
+    groups.append(list(files.values_list(
+        'pk', 'name', 'original_filename', 'folder__name')))
+
+    names = []
+    for group in groups:
+        for counter, row in enumerate(sorted(group, key=_file_label)):
+            pk, name, original_filename, folder_name = row
+            names.append((pk, format_file_name(
+                rename_format, name, original_filename or '', folder_name,
+                counter, global_counter + len(names))))
+    return names
+
+
+def _update_in_batches(queryset, field_name, values, **fields):
+    """
+    Sets ``field_name`` of the rows in ``queryset`` from ``(pk, value)``
+    pairs, with one UPDATE per ``UPDATE_BATCH_SIZE`` rows. ``fields`` are set
+    on all of these rows. Returns the number of updated rows.
+    """
+    values = list(values)
+    updated = 0
+    for start in range(0, len(values), UPDATE_BATCH_SIZE):
+        batch = values[start:start + UPDATE_BATCH_SIZE]
+        fields[field_name] = Case(
+            *[When(pk=pk, then=Value(value)) for pk, value in batch],
+            output_field=CharField())
+        updated += queryset.filter(pk__in=[pk for pk, value in batch]).update(**fields)
+    return updated
+
+
+def rename_files(names):
+    """
+    Sets the names of files from ``(pk, name)`` pairs, with one UPDATE per
+    ``UPDATE_BATCH_SIZE`` files. Returns the number of renamed files.
+    """
+    from ..models import File
+
+    return _update_in_batches(
+        File.objects.all(), 'name', names, modified_at=timezone.now())
+
+
+def get_move_conflicts(folder_ids, destination_id):
+    """
+    Returns the names of the folders in the destination folder which have
+    the same name as one of the folders to move there, in one query.
+    """
+    from ..models import Folder
+
+    return list(Folder.objects.filter(
+        parent=destination_id,
+        name__in=Folder.objects.filter(pk__in=folder_ids).values('name'),
+    ).exclude(pk__in=folder_ids).values_list('name', flat=True))
+
+
+def move_files(file_ids, destination_id):
+    """
+    Moves the files with ``file_ids`` to a folder with one UPDATE. Returns
+    the number of moved files.
+    """
+    from ..models import File
+
+    return File.objects.filter(pk__in=file_ids).update(
+        folder=destination_id, modified_at=timezone.now())
+
+
+def move_folders(folder_ids, destination_id):
+    """
+    Moves the folders with ``folder_ids`` and their subtrees to a folder.
+    Every subtree is relocated with the batched updates of
+    ``TreeManager.move_node()``, independent of its size. Returns the number
+    of moved folders (without subfolders).
+    """
+    from ..models import Folder
+
+    moved = []
+    for pk in folder_ids:
+        # fetched again, moving a subtree shifts the tree fields of others
+        folders = Folder.objects.in_bulk([pk, destination_id])
+        if pk not in folders:
+            continue
+        Folder._tree_manager.move_node(folders[pk], folders[destination_id], 'last-child')
+        moved.append(pk)
+    if moved:
+        Folder.objects.filter(pk__in=moved).update(modified_at=timezone.now())
+    return len(moved)
+
+
+def _generate_new_filename(filename, suffix):
+    basename, extension = os.path.splitext(filename)
+    return basename + suffix + extension
+
+
+def _get_available_names(destination_id, names):
+    """
+    Returns names for new folders in the destination folder, numbering the
+    names of existing folders like ``name_1``.
+    """
+    from ..models import Folder
+
+    taken = set(Folder.objects.filter(
+        parent=destination_id).values_list('name', flat=True))
+    available = []
+    for name in names:
+        count = itertools.count(1)
+        original = name
+        while name in taken:
+            name = "%s_%s" % (original, next(count))
+        taken.add(name)
+        available.append(name)
+    return available
+
+
+def _clone(model, obj, **values):
+    """
+    Returns an unsaved ``model`` instance with the field values of ``obj``
+    (without the primary key) updated with ``values``.
+    """
+    data = dict(
+        (field.attname, getattr(obj, field.attname))
+        for field in model._meta.concrete_fields if not field.primary_key)
+    data.update(values)
+    return model(**data)
+
+
+def _insert(model, objs, fields):
+    """
+    INSERTs the rows of ``objs`` into the table of ``model`` in batches.
+    ``bulk_create()`` refuses multi-table inherited models, their tables are
+    filled one by one with this.
+    """
+    connection = connections[router.db_for_write(model)]
+    batch_size = max(1, connection.ops.bulk_batch_size(fields, objs))
+    for start in range(0, len(objs), batch_size):
+        model._base_manager._insert(
+            objs[start:start + batch_size], fields=fields, using=connection.alias)
+
+
+def _allocate_tree_space(destination, size):
+    """
+    Makes room for ``size`` tree fields (two per node) at the end of the
+    children of ``destination``, with two UPDATEs. Returns the first free
+    ``lft`` value.
+    """
+    from ..models import Folder
+
+    opts = Folder._mptt_meta
+    start = getattr(destination, opts.right_attr)
+    tree = Folder.objects.filter(**{
+        opts.tree_id_attr: getattr(destination, opts.tree_id_attr)})
+    tree.filter(**{'%s__gt' % opts.left_attr: start}).update(**{
+        opts.left_attr: F(opts.left_attr) + size})
+    tree.filter(**{'%s__gte' % opts.right_attr: start}).update(**{
+        opts.right_attr: F(opts.right_attr) + size})
+    return start
+
+
+def _copy_folder_tree(roots, destination):
+    """
+    Copies the folder subtrees of ``roots`` and their permissions into
+    ``destination``. Roots inside the subtree of another root are only
+    copied with that subtree. The tree fields of all copies are computed from
+    the source trees up front, the folders are created with one INSERT per
+    tree level. Returns a dictionary mapping the source folder ids to the ids
+    of their copies.
+    """
+    from ..models import Folder, FolderPermission
+
+    opts = Folder._mptt_meta
+    tree_id, left, right, level = (
+        opts.tree_id_attr, opts.left_attr, opts.right_attr, opts.level_attr)
+    roots = [root for root in roots if not any(
+        other is not root and
+        getattr(other, tree_id) == getattr(root, tree_id) and
+        getattr(other, left) < getattr(root, left) < getattr(other, right)
+        for other in roots)]
+    sources = list(Folder.objects.filter(
+        pk__in=get_folder_ids_recursive(roots)).order_by(tree_id, left))
+    size = sum(getattr(root, right) - getattr(root, left) + 1 for root in roots)
+    offset = _allocate_tree_space(destination, size)
+    names = dict(zip(
+        [root.pk for root in roots],
+        _get_available_names(destination.pk, [root.name for root in roots])))
+
+    copies = []
+    for root in roots:
+        delta = offset - getattr(root, left)
+        level_delta = getattr(destination, level) + 1 - getattr(root, level)
+        for node in sources:
+            if (getattr(node, tree_id) != getattr(root, tree_id) or
+                    not getattr(root, left) <= getattr(node, left) <= getattr(root, right)):
+                continue
+            copies.append((node, _clone(Folder, node, **{
+                'name': names.get(node.pk, node.name),
+                tree_id: getattr(destination, tree_id),
+                left: getattr(node, left) + delta,
+                right: getattr(node, right) + delta,
+                level: getattr(node, level) + level_delta,
+            })))
+        offset += getattr(root, right) - getattr(root, left) + 1
+
+    new_ids = {}
+    levels = sorted(set(getattr(copy, level) for node, copy in copies))
+    for copy_level in levels:
+        batch = [(node, copy) for node, copy in copies
+                 if getattr(copy, level) == copy_level]
+        for node, copy in batch:
+            copy.parent_id = new_ids.get(node.parent_id, destination.pk)
+        Folder.objects.bulk_create([copy for node, copy in batch])
+        if batch[0][1].pk is None:
+            # the database didn't return the ids, look them up by position
+            ids = dict(Folder.objects.filter(**{
+                tree_id: getattr(destination, tree_id),
+                level: copy_level,
+                '%s__in' % left: [getattr(copy, left) for node, copy in batch],
+            }).values_list(left, 'pk'))
+            for node, copy in batch:
+                copy.pk = ids[getattr(copy, left)]
+        new_ids.update((node.pk, copy.pk) for node, copy in batch)
+
+    FolderPermission.objects.bulk_create([
+        _clone(FolderPermission, permission, folder_id=new_ids[permission.folder_id])
+        for permission in FolderPermission.objects.filter(folder__in=list(new_ids))
+    ])
+    return new_ids
+
+
+def _copy_blobs(copies):
+    """
+    Copies the ``(storage, name, new name)`` files of ``copies`` concurrently
+    and returns the names they were saved under. If a copy fails, the other
+    copies are removed again and the error is raised.
+    """
+    with StorageExecutor() as executor:
+        for storage, name, new_name in copies:
+            executor.copy(storage, name, storage, new_name)
+        results = executor.results(return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        delete_from_storages(
+            (storage, result) for (storage, name, new_name), result
+            in zip(copies, results) if not isinstance(result, Exception))
+        raise errors[0]
+    return results
+
+
+def _copy_file_rows(files, suffix):
+    """
+    Copies ``files``, ``(polymorphic file instance, destination folder id)``
+    tuples. The stored files are copied concurrently, the rows are inserted
+    per table.
+    """
+    from ..models import File
+
+    field = File._meta.get_field('file')
+    blobs = [obj for obj, folder_id in files if obj.file.name]
+    saved_names = _copy_blobs([
+        (field.storages['public' if obj.is_public else 'private'], obj.file.name,
+         _generate_new_filename(obj.file.name, suffix))
+        for obj in blobs])
+    new_names = dict(zip([obj.pk for obj in blobs], saved_names))
+    try:
+        rows = [
+            _clone(File, obj, folder_id=folder_id,
+                   file=new_names.get(obj.pk, obj.file.name),
+                   original_filename=_generate_new_filename(obj.original_filename or '', suffix))
+            for obj, folder_id in files]
+        File.objects.bulk_create([row for row in rows if row.file.name])
+        if any(row.pk is None and row.file.name for row in rows):
+            # the database didn't return the ids, the names of the copies
+            # are unique within their storage
+            ids = dict(
+                ((name, is_public), pk) for pk, name, is_public in File.objects.filter(
+                    folder__in=set(row.folder_id for row in rows), file__in=saved_names,
+                ).values_list('pk', 'file', 'is_public'))
+            for row in rows:
+                if row.file.name:
+                    row.pk = ids[(row.file.name, row.is_public)]
+        for row in rows:
+            if not row.file.name:
+                row.save()
+
+        # rows of the tables of subclasses (e.g. Image)
+        tables = defaultdict(list)
+        for (obj, folder_id), row in zip(files, rows):
+            for model in [obj.__class__] + list(obj._meta.get_parent_list()):
+                if model is File or not issubclass(model, File) or model._meta.proxy:
+                    continue
+                setattr(obj, model._meta.pk.attname, row.pk)
+                tables[model].append(obj)
+        models = sorted(tables, key=lambda model: len(model._meta.get_parent_list()))
+        for model in models:
+            _insert(model, tables[model], model._meta.local_concrete_fields)
+    except Exception:
+        delete_from_storages(
+            (field.storages['public' if obj.is_public else 'private'], name)
+            for obj, name in zip(blobs, saved_names))
+        raise
+    return len(files)
+
+
+def copy_files_and_folders(file_ids, folder_ids, destination_id, suffix):
+    """
+    Copies the files with ``file_ids`` and the folders with ``folder_ids``
+    (with their subfolders, permissions and files) into a folder. ``suffix``
+    is appended to the names of the copied files.
+
+    The number of queries only depends on the depth of the folder trees and
+    the number of file subclasses, the stored files are copied concurrently.
+    Returns the number of copied files and folders, subfolders included.
+    """
+    from ..models import File, Folder
+
+    destination = Folder.objects.get(pk=destination_id)
+    roots = Folder.objects.in_bulk(folder_ids)
+    roots = [roots[pk] for pk in folder_ids if pk in roots]
+    new_folder_ids = {}
+    if roots:
+        new_folder_ids = _copy_folder_tree(roots, destination)
+    files = [(obj, destination.pk) for obj in File.objects.filter(pk__in=file_ids)]
+    files.extend(
+        (obj, new_folder_ids[obj.folder_id])
+        for obj in File.objects.filter(folder__in=list(new_folder_ids)))
+    return _copy_file_rows(files, suffix) + len(new_folder_ids)
+
+
+def set_files_public(file_ids, is_public):
+    """
+    Makes the files with ``file_ids`` public or private. The stored files are
+    made available in the other storage concurrently (see
+    ``stage_visibility_change()``) and the rows updated in batches; the
+    sources and the thumbnails of the moved files are removed once the
+    transaction is committed. Stored files shared with other files (see
+    ``collapse_duplicates()``) are copied instead.
+
+    A ``filer_set_public`` hook of the destination storage changes the stored
+    file in place, so it is only called once the transaction is committed
+    (see ``_set_public_committed()``).
+
+    Returns the number of changed files and a dictionary of the errors of
+    the files which couldn't be moved (and were left unchanged) by file id.
+    """
+    from ..models import File
+
+    field = File._meta.get_field('file')
+    src_storage = field.storages['private' if is_public else 'public']
+    dst_storage = field.storages['public' if is_public else 'private']
+    hook = hasattr(dst_storage, 'filer_set_public')
+    # upload_to callables may look at the folder
+    files = list(File.objects.non_polymorphic().select_related('folder').filter(
+        pk__in=file_ids).exclude(is_public=is_public))
+    by_name = defaultdict(list)
+    for file_obj in files:
+        if file_obj.file.name:
+            by_name[file_obj.file.name].append(file_obj)
+    shared = set(File.objects.filter(
+        file__in=list(by_name), is_public=not is_public,
+    ).exclude(pk__in=[file_obj.pk for file_obj in files]).values_list('file', flat=True))
+    staged = [name for name in by_name if name in shared or not hook]
+    dst_names = {}
+    with StorageExecutor() as executor:
+        for name, group in by_name.items():
+            file_obj = group[0]
+            file_obj.is_public = is_public
+            dst_names[name] = field.generate_filename(file_obj, file_obj.original_filename)
+            if name in shared:
+                executor.copy(src_storage, name, dst_storage, dst_names[name])
+            elif not hook:
+                executor.submit(src_storage, stage_visibility_change, src_storage, name,
+                                dst_storage, dst_names[name], sha1=file_obj.sha1)
+        results = executor.results(return_exceptions=True)
+
+    errors = {}
+    names = []
+    moved = []
+    copies = []
+    sources = []
+    for name, result in zip(staged, results):
+        group = by_name[name]
+        if isinstance(result, Exception):
+            logger.error('Failed to move %s: %s', name, result)
+            errors.update((file_obj.pk, result) for file_obj in group)
+            continue
+        if name in shared:
+            saved_name = result
+        else:
+            saved_name, delete_source = result
+            moved.append((name, not is_public))
+            if delete_source:
+                sources.append((src_storage, name))
+        if saved_name != name:
+            copies.append((dst_storage, saved_name))
+        names.extend((file_obj.pk, saved_name) for file_obj in by_name[name])
+    committed = []
+    if hook:
+        # the rows keep their name until the hook says otherwise
+        for name, group in by_name.items():
+            if name not in shared:
+                moved.append((name, not is_public))
+                names.extend((file_obj.pk, name) for file_obj in group)
+                committed.append((name, dst_names[name], group[0].sha1,
+                                  [file_obj.pk for file_obj in group]))
+
+    now = timezone.now()
+    try:
+        changed = _update_in_batches(
+            File.objects.all(), 'file', names, is_public=is_public, modified_at=now)
+        changed += File.objects.filter(
+            pk__in=[file_obj.pk for file_obj in files if not file_obj.file.name],
+        ).update(is_public=is_public, modified_at=now)
+        removals = _delete_thumbnail_caches(field, moved)
+    except Exception:
+        # the sources are still in place, only the copies have to go
+        delete_from_storages(copies)
+        raise
+    removals.extend(sources)
+    on_commit(lambda: delete_from_storages(removals))
+    if committed:
+        on_commit(lambda: _set_public_committed(
+            src_storage, dst_storage, is_public, committed))
+    return changed, errors
+
+
+def _set_public_committed(src_storage, dst_storage, is_public, blobs):
+    """
+    Changes the visibility of the stored files ``blobs`` (``(name, name in
+    dst_storage if the data has to be moved, sha1, file ids)`` tuples) of
+    committed rows with ``change_visibility()``. Rows are updated if the file
+    gets another name, and reverted if it couldn't be changed.
+    """
+    from ..models import File
+
+    for name, dst_name, sha1, file_ids in blobs:
+        try:
+            saved_name = change_visibility(
+                src_storage, name, dst_storage, dst_name, is_public, sha1=sha1)
+        except Exception as e:
+            logger.error('Failed to move %s: %s', name, e)
+            File.objects.filter(pk__in=file_ids).update(is_public=not is_public)
+            continue
+        if saved_name != name:
+            File.objects.filter(pk__in=file_ids).update(file=saved_name)
+
+
+def collapse_duplicates(files):
+    """
+    Makes ``files`` (with the same sha1) share one stored file per
+    visibility, the one of the oldest file. The other stored files and their
+    thumbnails are removed once the transaction is committed. Returns the
+    number of bytes freed.
+    """
+    from ..models import File
+
+    field = File._meta.get_field('file')
+    files = sorted((file_obj for file_obj in files if file_obj.file.name),
+                   key=lambda file_obj: file_obj.pk)
+    sizes = {}
+    for is_public in (True, False):
+        group = [file_obj for file_obj in files if file_obj.is_public == is_public]
+        if len(group) < 2:
+            continue
+        keep = group[0].file.name
+        others = [file_obj for file_obj in group if file_obj.file.name != keep]
+        File.objects.filter(pk__in=[file_obj.pk for file_obj in others]).update(
+            file=keep, modified_at=timezone.now())
+        sizes.update(
+            ((file_obj.file.name, is_public), file_obj._file_size or 0)
+            for file_obj in others)
+    # stored files still referenced by other files have to stay
+    referenced = set(File.objects.filter(
+        file__in=set(name for name, is_public in sizes),
+    ).values_list('file', 'is_public').distinct())
+    orphans = set(sizes) - referenced
+    removals = _delete_thumbnail_caches(field, orphans)
+    removals.extend(
+        (field.storages['public' if is_public else 'private'], name)
+        for name, is_public in orphans)
+    on_commit(lambda: delete_from_storages(removals))
+    return sum(sizes[blob] for blob in orphans)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent storage operations.
+
+On remote storages the latency of each call dominates the time spent on
+operations touching many files. ``StorageExecutor`` runs storage calls in a
+bounded thread pool, limits the number of concurrent calls per storage,
+retries failed calls with exponential backoff and returns the results in the
+order the operations were submitted::
+
+    with StorageExecutor() as executor:
+        for name in names:
+            executor.delete(storage, name)
+        executor.results()
+
+The concurrency limit of a storage defaults to ``FILER_STORAGE_CONCURRENCY``
+and can be set per storage with a ``filer_concurrency`` attribute. Only
+``IOError``/``OSError`` (network errors included) are retried, storages can
+extend this with a ``filer_retry_exceptions`` tuple.
+
+The operations must not access the database: each thread would open its own
+connection.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import errno
+import logging
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from .storage import copy_file
+
+logger = logging.getLogger(__name__)
+
+RETRY_EXCEPTIONS = (IOError, OSError)
+# errors which won't go away by trying again
+PERMANENT_ERRNOS = (errno.ENOENT, errno.EEXIST, errno.EISDIR, errno.ENOTDIR)
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def get_storage_semaphore(storage):
+    """
+    Returns the semaphore limiting the concurrent calls to ``storage`` (shared
+    by all executors).
+    """
+    from .. import settings as filer_settings
+
+    with _semaphores_lock:
+        key = id(storage)
+        if key not in _semaphores:
+            limit = getattr(storage, 'filer_concurrency', None)
+            if limit is None:
+                limit = filer_settings.FILER_STORAGE_CONCURRENCY
+            # keep a reference to the storage, so its id is not reused
+            _semaphores[key] = (storage, threading.BoundedSemaphore(max(1, limit)))
+        return _semaphores[key][1]
+
+
+def _save(storage, name, content, **kwargs):
+    # rewind, a failed attempt may have read part of the content
+    content.seek(0)
+    return storage.save(name, content, **kwargs)
+
+
+def is_retryable(storage, exception):
+    retry_exceptions = RETRY_EXCEPTIONS + tuple(
+        getattr(storage, 'filer_retry_exceptions', ()))
+    if not isinstance(exception, retry_exceptions):
+        return False
+    return getattr(exception, 'errno', None) not in PERMANENT_ERRNOS
+
+
+class StorageExecutor(object):
+
+    def __init__(self, threads=None, retries=None, backoff=None):
+        from .. import settings as filer_settings
+
+        self.threads = threads or filer_settings.FILER_STORAGE_THREADS
+        self.retries = filer_settings.FILER_STORAGE_RETRIES if retries is None else retries
+        self.backoff = filer_settings.FILER_STORAGE_RETRY_BACKOFF if backoff is None else backoff
+        self._pool = None
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _call(self, storage, func, args, kwargs):
+        semaphore = get_storage_semaphore(storage)
+        attempt = 0
+        while True:
+            with semaphore:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.retries or not is_retryable(storage, e):
+                        raise
+            attempt += 1
+            delay = self.backoff * (2 ** (attempt - 1))
+            logger.warning('Retrying storage operation %s in %.2fs (attempt %d)',
+                           getattr(func, '__name__', func), delay, attempt)
+            time.sleep(delay * (0.5 + random.random() / 2))
+
+    def submit(self, storage, func, *args, **kwargs):
+        """
+        Schedules ``func(*args, **kwargs)``, a call to ``storage``.
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(self.threads)
+        self._pending.append(self._pool.apply_async(
+            self._call, (storage, func, args, kwargs)))
+
+    def save(self, storage, name, content, **kwargs):
+        self.submit(storage, _save, storage, name, content, **kwargs)
+
+    def delete(self, storage, name):
+        self.submit(storage, storage.delete, name)
+
+    def exists(self, storage, name):
+        self.submit(storage, storage.exists, name)
+
+    def copy(self, src_storage, src_name, dst_storage, dst_name):
+        self.submit(src_storage, copy_file, src_storage, src_name, dst_storage, dst_name)
+
+    def results(self, return_exceptions=False):
+        """
+        Waits for the submitted operations and returns their results in the
+        order they were submitted. Unless ``return_exceptions`` is set, the
+        first error is raised once all operations finished; otherwise
+        exceptions are returned in place of the results.
+        """
+        pending, self._pending = self._pending, []
+        results = []
+        error = None
+        for async_result in pending:
+            try:
+                results.append(async_result.get())
+            except Exception as e:
+                results.append(e)
+                error = error or e
+        if error is not None and not return_exceptions:
+            raise error
+        return results
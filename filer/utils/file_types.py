@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Content sniffing and the upload file type registry.
+
+Uploads are classified by looking at the magic bytes at the start of the file
+and, as a fallback, at the filename extension. The resulting MIME type is then
+looked up in a registry which maps MIME types to the models listed in
+``FILER_FILE_MODELS``. Models declare the MIME types they handle with the
+``mime_types`` class attribute (``type/subtype``, ``type/*`` or ``*/*``).
+
+Models which still override ``matches_file_type()`` without declaring their own
+``mime_types`` are asked explicitly, in ``FILER_FILE_MODELS`` order, so custom
+matching logic keeps working.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import mimetypes
+from operator import itemgetter
+
+from django.utils import six
+
+from .loader import load_model
+
+# Number of bytes read from the start of a file to detect its type.
+HEAD_SIZE = 512
+
+DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+# Each signature is a tuple of ``(offset, magic bytes)`` conditions which all
+# have to match, and the MIME type they identify. The first match wins, so
+# more specific signatures have to be listed first.
+SIGNATURES = [
+    (((0, b'\xff\xd8\xff'),), 'image/jpeg'),
+    (((0, b'\x89PNG\r\n\x1a\n'),), 'image/png'),
+    (((0, b'GIF87a'),), 'image/gif'),
+    (((0, b'GIF89a'),), 'image/gif'),
+    (((0, b'RIFF'), (8, b'WEBP')), 'image/webp'),
+    (((0, b'RIFF'), (8, b'AVI ')), 'video/x-msvideo'),
+    (((0, b'RIFF'), (8, b'WAVE')), 'audio/x-wav'),
+    (((4, b'ftypavif'),), 'image/avif'),
+    (((4, b'ftypheic'),), 'image/heic'),
+    (((4, b'ftypqt  '),), 'video/quicktime'),
+    (((4, b'ftyp'),), 'video/mp4'),
+    (((0, b'II*\x00'),), 'image/tiff'),
+    (((0, b'MM\x00*'),), 'image/tiff'),
+    (((0, b'BM'),), 'image/bmp'),
+    (((0, b'\x00\x00\x01\x00'),), 'image/x-icon'),
+    (((0, b'%PDF-'),), 'application/pdf'),
+    (((0, b'PK\x03\x04'),), 'application/zip'),
+    (((0, b'\x1f\x8b'),), 'application/gzip'),
+    (((0, b'Rar!\x1a\x07'),), 'application/x-rar-compressed'),
+    (((0, b'7z\xbc\xaf\x27\x1c'),), 'application/x-7z-compressed'),
+    (((0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'),), 'application/x-ole-storage'),
+    (((0, b'\x1a\x45\xdf\xa3'),), 'video/x-matroska'),
+    (((0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'),), 'video/x-ms-asf'),
+    (((0, b'OggS'),), 'application/ogg'),
+    (((0, b'fLaC'),), 'audio/flac'),
+    (((0, b'ID3'),), 'audio/mpeg'),
+]
+
+# Container formats whose actual type is better described by the extension
+# (e.g. ``.docx`` and ``.odt`` files are zip archives).
+CONTAINER_MIME_TYPES = (
+    'application/zip',
+    'application/x-ole-storage',
+    'application/ogg',
+    'video/x-matroska',
+)
+
+
+def register_signature(mime_type, *conditions):
+    """
+    Registers an additional magic bytes signature. ``conditions`` are
+    ``(offset, magic bytes)`` tuples. Signatures registered later take
+    precedence over the built in ones.
+    """
+    SIGNATURES.insert(0, (tuple(conditions), mime_type))
+
+
+def _sniffable_mime_types():
+    return set(mime_type for conditions, mime_type in SIGNATURES)
+
+
+def read_head(file_obj, size=HEAD_SIZE):
+    """
+    Returns the first ``size`` bytes of ``file_obj`` and rewinds it, so that
+    later consumers still see the whole file.
+    """
+    if file_obj is None:
+        return b''
+    try:
+        file_obj.seek(0)
+        head = file_obj.read(size)
+        file_obj.seek(0)
+    except (AttributeError, IOError, OSError, ValueError):
+        return b''
+    if isinstance(head, six.text_type):
+        head = head.encode('utf-8')
+    return head or b''
+
+
+def sniff_mime_type(head):
+    """
+    Returns the MIME type identified by the magic bytes in ``head`` or None.
+    """
+    for conditions, mime_type in SIGNATURES:
+        for offset, magic in conditions:
+            if head[offset:offset + len(magic)] != magic:
+                break
+        else:
+            return mime_type
+    return None
+
+
+def guess_mime_type(filename, head=b''):
+    """
+    Combines content sniffing with the filename extension. The magic bytes
+    win, except for generic container formats. If the extension claims a type
+    we know the signature of, but the content does not match it, the file is
+    misnamed and the extension is ignored.
+    """
+    sniffed = sniff_mime_type(head) if head else None
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+    if sniffed and not (sniffed in CONTAINER_MIME_TYPES and guessed):
+        return sniffed
+    if sniffed is None and head and guessed in _sniffable_mime_types():
+        return DEFAULT_MIME_TYPE
+    return guessed or sniffed or DEFAULT_MIME_TYPE
+
+
+def mime_type_matches(mime_type, patterns):
+    major = mime_type.split('/', 1)[0]
+    for pattern in patterns or ():
+        if pattern in ('*', '*/*', mime_type, '%s/*' % major):
+            return True
+    return False
+
+
+def _defining_class(model, attr):
+    for klass in model.__mro__:
+        if attr in klass.__dict__:
+            return klass
+    return None
+
+
+def uses_custom_matcher(model):
+    """
+    True if ``model`` overrides ``matches_file_type()`` below the class which
+    declares its ``mime_types``, i.e. it has its own matching logic which the
+    registry cannot precompute.
+    """
+    matcher_class = _defining_class(model, 'matches_file_type')
+    mime_types_class = _defining_class(model, 'mime_types')
+    if mime_types_class is None:
+        return True
+    return (matcher_class is not mime_types_class and
+            issubclass(matcher_class, mime_types_class))
+
+
+class FileTypeRegistry(object):
+    """
+    Maps MIME types to the File models configured in ``FILER_FILE_MODELS``.
+
+    The mapping is computed once (on app ready) and recomputed only when the
+    ``FILER_FILE_MODELS`` setting changes, so classifying an upload is a couple
+    of dictionary lookups.
+    """
+
+    def __init__(self):
+        self._built_for = None
+        self._exact = {}
+        self._major = {}
+        self._catch_all = None
+        self._custom = []
+
+    def build(self, model_names=None):
+        if model_names is None:
+            from .. import settings as filer_settings
+            model_names = filer_settings.FILER_FILE_MODELS
+        exact, major, catch_all, custom = {}, {}, None, []
+        for rank, model_name in enumerate(model_names):
+            model = load_model(model_name)
+            if uses_custom_matcher(model):
+                custom.append((rank, model))
+                continue
+            for pattern in model.mime_types or ():
+                type_, _, subtype = pattern.partition('/')
+                if type_ == '*':
+                    catch_all = catch_all or (rank, model)
+                elif subtype == '*':
+                    major.setdefault(type_, (rank, model))
+                else:
+                    exact.setdefault(pattern, (rank, model))
+        self._exact, self._major = exact, major
+        self._catch_all, self._custom = catch_all, custom
+        self._built_for = tuple(model_names)
+
+    def ensure_built(self):
+        from .. import settings as filer_settings
+        if self._built_for != tuple(filer_settings.FILER_FILE_MODELS):
+            self.build(filer_settings.FILER_FILE_MODELS)
+
+    def lookup(self, mime_type):
+        """
+        Returns the ``(rank, model)`` of the first model in
+        ``FILER_FILE_MODELS`` that declares ``mime_type``, or None.
+        """
+        candidates = [
+            self._exact.get(mime_type),
+            self._major.get(mime_type.split('/', 1)[0]),
+            self._catch_all,
+        ]
+        candidates = [c for c in candidates if c is not None]
+        if not candidates:
+            return None
+        return min(candidates, key=itemgetter(0))
+
+    def classify(self, filename, upload, request=None):
+        """
+        Returns ``(model, mime_type)`` for an upload. ``model`` is None if no
+        configured model accepts the file.
+        """
+        self.ensure_built()
+        mime_type = guess_mime_type(filename, read_head(upload))
+        match = self.lookup(mime_type)
+        limit = match[0] if match else len(self._built_for)
+        for rank, model in self._custom:
+            if rank >= limit:
+                break
+            if model.matches_file_type(filename, upload, request):
+                return model, mime_type
+        if match:
+            return match[1], mime_type
+        return None, mime_type
+
+
+registry = FileTypeRegistry()
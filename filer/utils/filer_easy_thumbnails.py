@@ -4,8 +4,23 @@ from __future__ import absolute_import, unicode_literals
 
 import os
 import re
+from contextlib import contextmanager
 
-from easy_thumbnails.files import Thumbnailer
+from django.core.files.base import ContentFile
+from easy_thumbnails import engine, exceptions, models, signals, utils
+from easy_thumbnails.conf import settings
+from easy_thumbnails.files import Thumbnailer, ThumbnailFile
+
+from ..thumbnail_processors import (
+    REDUCE_FOR,
+    REDUCIBLE_MODES,
+    SOURCE_SCALE_INFO,
+    get_required_scale,
+)
+from . import locks, thumbnail_index
+from .compatibility import PILImage
+from .executor import StorageExecutor
+from .thumbnail_formats import is_supported
 
 # match the source filename using `__` as the seperator. ``opts_and_ext`` is non
 # greedy so it should match the last occurence of `__`.
@@ -46,6 +61,10 @@ class ThumbnailerNameMixin(object):
         extension = extension or 'jpg'
 
         thumbnail_options = thumbnail_options.copy()
+        # the output format is only part of the extension, see thumbnail_formats
+        image_format = thumbnail_options.pop('format', None)
+        if image_format and is_supported(image_format):
+            extension = image_format.lower()
         size = tuple(thumbnail_options.pop('size'))
         quality = thumbnail_options.pop('quality', self.thumbnail_quality)
         initial_opts = ['%sx%s' % size, 'q%s' % quality]
@@ -72,6 +91,267 @@ class ThumbnailerNameMixin(object):
         return os.path.join(basedir, path, subdir, filename)
 
 
+class ImagePyramid(object):
+    """
+    A decoded source image and versions of it downscaled by powers of two,
+    computed on demand. Smaller thumbnails are made from the smallest version
+    which still has enough pixels, instead of from the full resolution.
+    """
+
+    def __init__(self, image):
+        self.levels = [image]
+
+    def get_image(self, thumbnail_options):
+        source = self.levels[0]
+        if 'box' in thumbnail_options or source.mode not in REDUCIBLE_MODES:
+            return source
+        scale = get_required_scale(source.size, thumbnail_options)
+        level = 0
+        while scale <= 0.5 ** (level + 1) and min(source.size) >> (level + 1):
+            level += 1
+            if level == len(self.levels):
+                self.levels.append(self._reduce(self.levels[-1]))
+        return self.levels[level]
+
+    def _reduce(self, image):
+        source = self.levels[0]
+        # the source itself may have been reduced while decoding
+        scale_x, scale_y = source.info.get(SOURCE_SCALE_INFO, (1, 1))
+        size = (max(1, image.size[0] // 2), max(1, image.size[1] // 2))
+        reduced = image.resize(size, getattr(PILImage, 'BOX', PILImage.ANTIALIAS))
+        reduced.info = dict(source.info)
+        reduced.info[SOURCE_SCALE_INFO] = (
+            scale_x * float(size[0]) / source.size[0],
+            scale_y * float(size[1]) / source.size[1])
+        return reduced
+
+
+def _replace(storage, name, content):
+    # like Thumbnailer.save_thumbnail()
+    try:
+        storage.delete(name)
+    except Exception:
+        pass
+    return storage.save(name, content)
+
+
+class ThumbnailSetMixin(object):
+
+    def get_thumbnail_set(self, thumbnail_options_list, silent_template_exception=False):
+        """
+        Returns a ``ThumbnailFile`` for each of the thumbnail options, like
+        ``get_thumbnail()``. The source image is decoded only once for all
+        missing thumbnails, small thumbnails are made from downscaled versions
+        of it (see ``ImagePyramid``) and all of them are saved concurrently.
+        """
+        options_list = [self.get_options(options) for options in thumbnail_options_list]
+        thumbnails = []
+        missing = []
+        for index, options in enumerate(options_list):
+            thumbnail = self.get_existing_thumbnail(options)
+            if thumbnail is None:
+                if options.get('HIGH_RESOLUTION', self.thumbnail_high_resolution):
+                    # high resolution versions are generated one by one
+                    thumbnail = self.get_thumbnail(
+                        options, silent_template_exception=silent_template_exception)
+                elif self.generate:
+                    missing.append(index)
+                else:
+                    signals.thumbnail_missed.send(
+                        sender=self, options=options, high_resolution=False)
+            thumbnails.append(thumbnail)
+        tokens = {}
+        try:
+            for index in missing:
+                tokens[index] = locks.acquire(self.get_lock_name(options_list[index]))
+            generating = [index for index in missing if tokens[index]]
+            if generating:
+                generated = self.generate_thumbnail_set(
+                    [options_list[index] for index in generating], silent_template_exception)
+                self.save_thumbnail_set(generated)
+                for index, thumbnail in zip(generating, generated):
+                    thumbnails[index] = thumbnail
+        finally:
+            for index, token in tokens.items():
+                if token:
+                    locks.release(self.get_lock_name(options_list[index]), token)
+        for index in missing:
+            if not tokens[index]:
+                # generated by someone else, get_thumbnail() waits for it
+                thumbnails[index] = self.get_thumbnail(
+                    options_list[index], silent_template_exception=silent_template_exception)
+        return thumbnails
+
+    def get_thumbnail(self, thumbnail_options, save=True, generate=None,
+                      silent_template_exception=False):
+        """
+        Like ``Thumbnailer.get_thumbnail()``, but a missing thumbnail is
+        generated by one process (or thread) at a time: the others wait up to
+        ``FILER_THUMBNAIL_LOCK_WAIT`` seconds for it to be generated (see
+        ``filer.utils.locks``), then generate it themselves if it still
+        doesn't exist.
+        """
+        thumbnail_options = self.get_options(thumbnail_options)
+        if generate is None:
+            generate = self.generate
+        if not (save and generate):
+            return super(ThumbnailSetMixin, self).get_thumbnail(
+                thumbnail_options, save, generate, silent_template_exception)
+        if not thumbnail_options.get('HIGH_RESOLUTION', self.thumbnail_high_resolution):
+            thumbnail = self.get_existing_thumbnail(thumbnail_options)
+            if thumbnail:
+                return thumbnail
+        with self.generation_lock(thumbnail_options):
+            return super(ThumbnailSetMixin, self).get_thumbnail(
+                thumbnail_options, save, generate, silent_template_exception)
+
+    def get_lock_name(self, thumbnail_options):
+        return '%s:%s' % (utils.get_storage_hash(self.thumbnail_storage),
+                          self.get_thumbnail_name(thumbnail_options))
+
+    @contextmanager
+    def generation_lock(self, thumbnail_options):
+        from .. import settings as filer_settings
+
+        name = self.get_lock_name(thumbnail_options)
+        token = locks.acquire(name)
+        if token is None:
+            # someone else is generating the thumbnail, wait for them
+            token = locks.acquire(name, filer_settings.FILER_THUMBNAIL_LOCK_WAIT)
+            self.forget_existing_thumbnails()
+        try:
+            yield
+        finally:
+            if token is not None:
+                locks.release(name, token)
+
+    def forget_existing_thumbnails(self):
+        """
+        Called when thumbnails may have been created or deleted elsewhere.
+        """
+
+    def generate_thumbnail_set(self, thumbnail_options_list, silent_template_exception=False):
+        """
+        Returns unsaved ``ThumbnailFile`` instances for a list of thumbnail
+        options, decoding the source image once.
+        """
+        options_list = [self.get_options(options) for options in thumbnail_options_list]
+        for options in options_list:
+            if max(int(dim or 0) for dim in options['size']) <= 0 or \
+                    min(int(dim or 0) for dim in options['size']) < 0:
+                raise exceptions.EasyThumbnailsError(
+                    "The source image is an invalid size (%sx%s)" % tuple(options['size']))
+        # source generators supporting it decode the image at a reduced size
+        # which is still large enough for all thumbnails
+        source_options = dict(options_list[0], **{REDUCE_FOR: options_list})
+        image = engine.generate_source_image(
+            self, source_options, self.source_generators,
+            fail_silently=silent_template_exception)
+        if image is None:
+            raise exceptions.InvalidImageFormatError(
+                "The source file does not appear to be an image")
+        pyramid = ImagePyramid(image)
+
+        thumbnails = []
+        for options in options_list:
+            thumbnail_image = engine.process_image(
+                pyramid.get_image(options), options, self.thumbnail_processors)
+            filename = self.get_thumbnail_name(
+                options, transparent=utils.is_transparent(thumbnail_image))
+            data = engine.save_image(
+                thumbnail_image, filename=filename, quality=options['quality'],
+                subsampling=options['subsampling']).read()
+            thumbnail = ThumbnailFile(
+                filename, file=ContentFile(data), storage=self.thumbnail_storage,
+                thumbnail_options=options)
+            thumbnail.image = thumbnail_image
+            thumbnail._committed = False
+            thumbnails.append(thumbnail)
+        return thumbnails
+
+    def save_thumbnail_set(self, thumbnails):
+        """
+        Saves thumbnails like ``save_thumbnail()``, writing them to the
+        storage concurrently.
+        """
+        with StorageExecutor() as executor:
+            for thumbnail in thumbnails:
+                executor.submit(self.thumbnail_storage, _replace,
+                                self.thumbnail_storage, thumbnail.name, thumbnail)
+            executor.results()
+        for thumbnail in thumbnails:
+            thumb_cache = self.get_thumbnail_cache(thumbnail.name, create=True, update=True)
+            if settings.THUMBNAIL_CACHE_DIMENSIONS and thumb_cache is not None:
+                models.ThumbnailDimensions.objects.update_or_create(
+                    thumbnail=thumb_cache,
+                    defaults={'width': thumbnail.width, 'height': thumbnail.height})
+            signals.thumbnail_created.send(sender=thumbnail)
+
+
+class ThumbnailIndexMixin(object):
+    """
+    Looks up existing thumbnails in the thumbnail index (see
+    ``filer.utils.thumbnail_index``) if it is enabled.
+    """
+
+    def get_source_modtime(self):
+        """
+        Returns the modification time of the source, as easy-thumbnails'
+        ``thumbnail_exists()`` gets it.
+        """
+        if utils.is_storage_local(self.source_storage):
+            return utils.get_modified_time(self.source_storage, self.name)
+        source = self.get_source_cache()
+        return source.modified if source else None
+
+    def get_thumbnail_index(self):
+        key = (utils.get_storage_hash(self.thumbnail_storage), self.name)
+        cached = getattr(self, '_thumbnail_index', None)
+        if cached is None or cached[0] != key:
+            entry = None
+            if thumbnail_index.get_cache() is not None:
+                source_modtime = self.get_source_modtime()
+                if source_modtime:
+                    entry = thumbnail_index.get_entry(
+                        self.source_storage, self.name, self.thumbnail_storage, source_modtime)
+            cached = self._thumbnail_index = (key, entry)
+        return cached[1]
+
+    def thumbnail_exists(self, thumbnail_name):
+        entry = None if self.remote_source else self.get_thumbnail_index()
+        if entry is None:
+            return super(ThumbnailIndexMixin, self).thumbnail_exists(thumbnail_name)
+        if thumbnail_name in entry:
+            return thumbnail_index.IndexedThumbnail(entry[thumbnail_name])
+        return False
+
+    def index_thumbnails(self, thumbnails):
+        sizes = dict((thumbnail.name, (thumbnail.width, thumbnail.height))
+                     for thumbnail in thumbnails)
+        thumbnail_index.add(self.name, self.thumbnail_storage, sizes)
+        entry = self.get_thumbnail_index()
+        if entry is not None:
+            entry.update(sizes)
+
+    def save_thumbnail(self, thumbnail):
+        super(ThumbnailIndexMixin, self).save_thumbnail(thumbnail)
+        self.index_thumbnails([thumbnail])
+
+    def save_thumbnail_set(self, thumbnails):
+        super(ThumbnailIndexMixin, self).save_thumbnail_set(thumbnails)
+        self.index_thumbnails(thumbnails)
+
+    def delete_thumbnails(self, source_cache=None):
+        deleted = super(ThumbnailIndexMixin, self).delete_thumbnails(source_cache)
+        thumbnail_index.clear(self.thumbnail_storage, [self.name])
+        self.forget_existing_thumbnails()
+        return deleted
+
+    def forget_existing_thumbnails(self):
+        super(ThumbnailIndexMixin, self).forget_existing_thumbnails()
+        self._thumbnail_index = None
+
+
 class ActionThumbnailerMixin(object):
     thumbnail_basedir = ''
     thumbnail_subdir = ''
@@ -94,7 +374,8 @@ class ActionThumbnailerMixin(object):
         return False
 
 
-class FilerThumbnailer(ThumbnailerNameMixin, Thumbnailer):
+class FilerThumbnailer(ThumbnailIndexMixin, ThumbnailSetMixin, ThumbnailerNameMixin,
+                       Thumbnailer):
     def __init__(self, *args, **kwargs):
         self.thumbnail_basedir = kwargs.pop('thumbnail_basedir', '')
         super(FilerThumbnailer, self).__init__(*args, **kwargs)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Reads the dimensions of JPEG, PNG, GIF and WebP images from their headers.
+
+Only the first few kilobytes of a file are needed, so this is a lot cheaper
+than opening the image with PIL, especially for remote storages which would
+otherwise download the whole object. Storages can implement
+``read_range(name, start, end)`` (returning the bytes from ``start`` up to but
+not including ``end``) to let filer use ranged reads; otherwise the file is
+opened and only the head of it is read.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import struct
+
+# bytes read at first, and the maximum read for JPEG files with large
+# metadata segments (EXIF, ICC profiles, ...) in front of the frame header
+INITIAL_PROBE_SIZE = 8 * 1024
+MAX_PROBE_SIZE = 256 * 1024
+
+# JPEG start of frame markers (all but DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD9)) | set([0x01])
+
+
+class NeedMoreData(Exception):
+    pass
+
+
+def _jpeg_dimensions(data):
+    i = 2
+    length = len(data)
+    while True:
+        # skip to the next marker, markers may be padded with 0xFF
+        while i < length and data[i] != 0xFF:
+            i += 1
+        while i < length and data[i] == 0xFF:
+            i += 1
+        if i >= length:
+            raise NeedMoreData
+        marker = data[i]
+        i += 1
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image or start of scan before any frame header
+            return None
+        if i + 2 > length:
+            raise NeedMoreData
+        segment_length = struct.unpack('>H', bytes(data[i:i + 2]))[0]
+        if marker in JPEG_SOF_MARKERS:
+            if i + 7 > length:
+                raise NeedMoreData
+            height, width = struct.unpack('>HH', bytes(data[i + 3:i + 7]))
+            return width, height
+        i += segment_length
+
+
+def _webp_dimensions(data):
+    if len(data) < 30:
+        raise NeedMoreData
+    chunk = bytes(data[12:16])
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', bytes(data[26:30]))
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', bytes(data[21:25]))[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = data[24] | data[25] << 8 | data[26] << 16
+        height = data[27] | data[28] << 8 | data[29] << 16
+        return width + 1, height + 1
+    return None
+
+
+def parse_image_dimensions(data):
+    """
+    Returns ``(width, height)`` parsed from the head of an image file or None
+    if the format is not recognized. Raises ``NeedMoreData`` if ``data`` is too
+    short to contain the dimensions.
+    """
+    data = bytearray(data)
+    if data[:3] == b'\xff\xd8\xff':
+        return _jpeg_dimensions(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) < 24:
+            raise NeedMoreData
+        if bytes(data[12:16]) != b'IHDR':
+            return None
+        return struct.unpack('>II', bytes(data[16:24]))
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) < 10:
+            raise NeedMoreData
+        return struct.unpack('<HH', bytes(data[6:10]))
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _webp_dimensions(data)
+    if len(data) < 12:
+        raise NeedMoreData
+    return None
+
+
+def _probe(read):
+    """
+    Calls ``read(size)`` with growing sizes until the dimensions are found.
+    ``read`` returns the first ``size`` bytes of the file.
+    """
+    size = INITIAL_PROBE_SIZE
+    while True:
+        data = read(size)
+        try:
+            return parse_image_dimensions(data)
+        except NeedMoreData:
+            if len(data) < size or size >= MAX_PROBE_SIZE:
+                # end of file reached or the header is unreasonably large
+                return None
+            size = min(size * 4, MAX_PROBE_SIZE)
+
+
+def get_image_dimensions(file_obj):
+    """
+    Returns ``(width, height)`` of an open image file or None. The file is
+    rewound afterwards.
+    """
+    def read(size):
+        file_obj.seek(0)
+        return file_obj.read(size)
+    try:
+        return _probe(read)
+    finally:
+        file_obj.seek(0)
+
+
+def get_storage_image_dimensions(storage, name):
+    """
+    Returns ``(width, height)`` of the image ``name`` in ``storage`` or None,
+    reading as little of the file as possible.
+    """
+    if hasattr(storage, 'read_range'):
+        return _probe(lambda size: storage.read_range(name, 0, size))
+    file_obj = storage.open(name)
+    try:
+        return get_image_dimensions(file_obj)
+    finally:
+        file_obj.close()
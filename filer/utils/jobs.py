@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Background jobs for long running operations.
+
+A job is a list of items and the dotted path of a handler called as
+``handler(job, item)`` for each of them. Handlers return the number of
+objects they changed (``None`` counts as one). Items are processed in batches
+of ``FILER_JOB_BATCH_SIZE``, each item in its own savepoint: an item raising
+an exception is recorded in the job's errors and skipped.
+
+Handlers decorated with ``@batch_handler`` are called as
+``handler(job, items)`` once per batch instead, in a single savepoint. If the
+batch fails its items are retried one by one to find the failing ones.
+
+Each batch and the progress after it (but not the items) are saved in one
+transaction, so a job interrupted by a crash is resumed after its last
+committed batch by the next worker, once it stopped making progress for
+``FILER_JOB_TIMEOUT`` seconds. While a batch runs, a heartbeat keeps the job
+from being considered abandoned, and a worker which lost its job to another
+one stops at the end of its batch (``JobClaimedError``). Handlers should
+defer side effects outside of the database until the transaction is committed
+(see ``filer.utils.bulk.on_commit``); other side effects are repeated when an
+interrupted batch is resumed, so they have to be idempotent.
+
+Jobs are processed by the ``filer_worker`` management command. If
+``FILER_BACKGROUND_JOBS`` is off, ``submit()`` runs them right away.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from .loader import load_object
+
+logger = logging.getLogger(__name__)
+
+
+class JobClaimedError(Exception):
+    """
+    The job was claimed by another worker, after this one made no progress
+    for ``FILER_JOB_TIMEOUT`` seconds.
+    """
+
+
+def batch_handler(func):
+    """
+    Marks a job handler as processing a whole batch of items at once.
+    """
+    func.batch = True
+    return func
+
+
+def _process(job, handler, item):
+    try:
+        with transaction.atomic():
+            if getattr(handler, 'batch', False):
+                affected = handler(job, [item])
+            else:
+                affected = handler(job, item)
+    except Exception as e:
+        logger.exception('Error processing %r of job %s', item, job)
+        job.add_error(item, force_text(e))
+    else:
+        job.affected += 1 if affected is None else affected
+
+
+def _process_batch(job, handler, batch):
+    if getattr(handler, 'batch', False) and len(batch) > 1:
+        try:
+            with transaction.atomic():
+                affected = handler(job, batch)
+        except Exception:
+            logger.warning('Batch of job %s failed, retrying items one by one', job)
+        else:
+            job.affected += len(batch) if affected is None else affected
+            return
+    for item in batch:
+        _process(job, handler, item)
+
+
+def create_job(handler, items, arguments=None, owner=None, title=''):
+    """
+    Returns a new, unsaved ``Job``.
+    """
+    from ..models.jobmodels import Job
+
+    job = Job(handler=handler, title=force_text(title),
+              owner=owner if owner and owner.pk else None)
+    job.set_items(items)
+    job.set_arguments(arguments or {})
+    return job
+
+
+def submit(handler, items, arguments=None, owner=None, title=''):
+    """
+    Creates a job and either queues it for the worker (if
+    ``FILER_BACKGROUND_JOBS`` is on) or runs it immediately. Returns the job.
+    Jobs run immediately are not stored in the database.
+    """
+    from .. import settings as filer_settings
+
+    job = create_job(handler, items, arguments, owner, title)
+    if filer_settings.FILER_BACKGROUND_JOBS:
+        job.save()
+    else:
+        run_job(job)
+    return job
+
+
+# the fields changing while a job runs, its items are never saved again
+PROGRESS_FIELDS = ('status', 'position', 'affected', 'started_at', 'finished_at')
+
+
+def _touch(job, **values):
+    """
+    Updates ``values`` and ``updated_at`` of ``job``, if no other worker
+    claimed it since its last update. Returns whether it was updated.
+    """
+    from ..models.jobmodels import Job
+
+    # whole seconds, some databases don't store fractions
+    updated_at = timezone.now().replace(microsecond=0)
+    with job._touch_lock:
+        updated = Job.objects.filter(pk=job.pk, updated_at=job.updated_at).update(
+            updated_at=updated_at, **values)
+        if updated:
+            job.updated_at = updated_at
+    return bool(updated)
+
+
+def _save(job):
+    if job.pk is not None:
+        values = dict((name, getattr(job, name)) for name in PROGRESS_FIELDS)
+        if job.flush_errors():
+            values['errors'] = job.errors
+        if not _touch(job, **values):
+            raise JobClaimedError('Job %s was claimed by another worker' % job.pk)
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refreshes ``updated_at`` of a running job every quarter of
+    ``FILER_JOB_TIMEOUT``, so slow batches don't look abandoned.
+    """
+
+    def __init__(self, job):
+        from .. import settings as filer_settings
+
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.job = job
+        self.interval = filer_settings.FILER_JOB_TIMEOUT / 4.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    if not _touch(self.job):
+                        break
+                except Exception:
+                    logger.exception('Heartbeat of job %s failed', self.job)
+        finally:
+            # the thread's own database connection
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_job(job, batch_size=None):
+    """
+    Processes the remaining items of ``job``.
+    """
+    from .. import settings as filer_settings
+    from ..models.jobmodels import Job
+
+    batch_size = batch_size or filer_settings.FILER_JOB_BATCH_SIZE
+    job._touch_lock = threading.Lock()
+    job.status = Job.STATUS_RUNNING
+    job.started_at = job.started_at or timezone.now()
+    _save(job)
+    heartbeat = None
+    if job.pk is not None:
+        heartbeat = Heartbeat(job)
+        heartbeat.start()
+    claimed = False
+    try:
+        handler = load_object(job.handler)
+        items = job.get_items()
+        while job.position < len(items):
+            batch = items[job.position:job.position + batch_size]
+            with transaction.atomic():
+                _process_batch(job, handler, batch)
+                job.position += len(batch)
+                _save(job)
+    except JobClaimedError:
+        claimed = True
+        raise
+    except Exception:
+        job.status = Job.STATUS_FAILED
+        raise
+    else:
+        job.status = Job.STATUS_DONE
+    finally:
+        if heartbeat is not None:
+            heartbeat.stop()
+        if not claimed:
+            job.finished_at = timezone.now()
+            _save(job)
+    return job
+
+
+def claim_job():
+    """
+    Marks the oldest pending job (or a running job which stopped making
+    progress) as running and returns it, or None if there is no work.
+    """
+    from .. import settings as filer_settings
+    from ..models.jobmodels import Job
+
+    stale = timezone.now() - timedelta(seconds=filer_settings.FILER_JOB_TIMEOUT)
+    candidates = Job.objects.filter(
+        Q(status=Job.STATUS_PENDING) |
+        Q(status=Job.STATUS_RUNNING, updated_at__lt=stale))
+    for job in candidates.order_by('created_at', 'pk')[:10]:
+        # compare and swap, so concurrent workers never claim the same job
+        claimed = Job.objects.filter(
+            pk=job.pk, status=job.status, updated_at=job.updated_at,
+        ).update(status=Job.STATUS_RUNNING, updated_at=timezone.now())
+        if claimed:
+            return Job.objects.get(pk=job.pk)
+    return None
+
+
+def run_pending_jobs(batch_size=None, limit=None):
+    """
+    Runs jobs until there is no more work (or ``limit`` jobs were run).
+    Returns the number of jobs run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = claim_job()
+        if job is None:
+            break
+        try:
+            run_job(job, batch_size)
+        except Exception:
+            logger.exception('Job %s failed', job)
+        count += 1
+    return count
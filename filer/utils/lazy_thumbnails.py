@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy thumbnails.
+
+With ``FILER_LAZY_THUMBNAILS`` enabled, missing thumbnails are not generated
+while a page is rendered. Their url points to the ``lazy_thumbnail`` view
+instead, which generates the thumbnail on the first request and redirects to
+it (public files) or serves it (private files).
+
+The url contains the id of the file and the thumbnail options, signed so that
+only thumbnails requested by filer can be generated, followed by the name of
+the thumbnail. It doesn't change until the thumbnail exists, so browsers can
+cache it.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import json
+import os
+
+from django.core import signing
+from django.core.urlresolvers import NoReverseMatch, reverse
+from django.utils.encoding import force_bytes, force_text
+
+SALT = 'filer.lazy_thumbnails'
+
+
+def get_token(file_id, thumbnail_options):
+    """
+    Returns the signed token of the thumbnail of the file ``file_id``.
+    """
+    payload = json.dumps([file_id, thumbnail_options], sort_keys=True,
+                         separators=(',', ':'))
+    payload = base64.urlsafe_b64encode(force_bytes(payload)).rstrip(b'=')
+    return signing.Signer(salt=SALT).sign(force_text(payload))
+
+
+def load_token(token):
+    """
+    Returns the file id and the thumbnail options of a token returned by
+    ``get_token()``. Raises ``signing.BadSignature`` if it was tampered with.
+    """
+    payload = force_bytes(signing.Signer(salt=SALT).unsign(token))
+    payload = base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4))
+    file_id, thumbnail_options = json.loads(force_text(payload))
+    thumbnail_options['size'] = tuple(thumbnail_options['size'])
+    return file_id, thumbnail_options
+
+
+def get_lazy_url(file_obj, thumbnail_options):
+    """
+    Returns the url generating the thumbnail of ``file_obj`` on request, or
+    None if the filer urls are not installed.
+    """
+    thumbnailer = file_obj.file
+    name = thumbnailer.get_thumbnail_name(thumbnailer.get_options(thumbnail_options))
+    try:
+        return reverse('lazy_thumbnail', kwargs={
+            'token': get_token(file_obj.pk, thumbnail_options),
+            'filename': os.path.basename(name),
+        })
+    except NoReverseMatch:
+        return None
+
+
+def get_thumbnail_url(file_obj, thumbnail_options):
+    """
+    Returns the url of the thumbnail of ``file_obj`` if it exists, otherwise
+    its lazy url. The thumbnail is only generated right away if there is no
+    lazy url.
+    """
+    thumbnail = file_obj.file.get_existing_thumbnail(thumbnail_options)
+    if thumbnail is not None:
+        return thumbnail.url
+    url = get_lazy_url(file_obj, thumbnail_options)
+    if url is None:
+        url = file_obj.file.get_thumbnail(thumbnail_options).url
+    return url
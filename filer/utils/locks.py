@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Locks making sure only one process or thread generates a given thumbnail.
+
+With ``FILER_THUMBNAIL_LOCK_CACHE`` set, locks are entries added to that cache
+(``cache.add()`` is atomic on memcached, redis and the database cache) and
+work across processes and servers. Otherwise they only coordinate the threads
+of the current process.
+
+A lock expires after ``LOCK_EXPIRY`` seconds, so a crashed process doesn't
+block the thumbnail forever.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+KEY_PREFIX = 'filer:lock:'
+LOCK_EXPIRY = 120
+POLL_INTERVAL = 0.05
+
+_held = {}
+_held_lock = threading.Lock()
+
+
+def get_cache():
+    from .. import settings as filer_settings
+
+    if not filer_settings.FILER_THUMBNAIL_LOCK_CACHE:
+        return None
+    return caches[filer_settings.FILER_THUMBNAIL_LOCK_CACHE]
+
+
+def get_key(name):
+    return KEY_PREFIX + hashlib.sha1(force_bytes(name)).hexdigest()
+
+
+def _try_acquire(key, token):
+    cache = get_cache()
+    if cache is not None:
+        return cache.add(key, token, LOCK_EXPIRY)
+    with _held_lock:
+        now = time.time()
+        if key in _held and _held[key][1] > now:
+            return False
+        _held[key] = (token, now + LOCK_EXPIRY)
+        return True
+
+
+def acquire(name, wait=0):
+    """
+    Acquires the lock ``name``, waiting up to ``wait`` seconds for another
+    holder to release it. Returns a token to release the lock with, or None
+    if it couldn't be acquired.
+    """
+    key = get_key(name)
+    token = uuid.uuid4().hex
+    deadline = time.time() + wait
+    while not _try_acquire(key, token):
+        if time.time() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+    return token
+
+
+def release(name, token):
+    key = get_key(name)
+    cache = get_cache()
+    if cache is not None:
+        # not atomic, but only an expired lock acquired by someone else in
+        # the meantime can be released by mistake
+        if cache.get(key) == token:
+            cache.delete(key)
+        return
+    with _held_lock:
+        if key in _held and _held[key][0] == token:
+            del _held[key]
+
+
+@contextmanager
+def lock(name, wait=0):
+    """
+    Context manager acquiring the lock ``name`` (see ``acquire()``). Yields
+    whether the lock was acquired.
+    """
+    token = acquire(name, wait)
+    try:
+        yield token is not None
+    finally:
+        if token is not None:
+            release(name, token)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight timing instrumentation.
+
+An operation (e.g. an upload) is wrapped in ``collect()``, which makes a
+``Timer`` the current one for the thread. Code anywhere below it records the
+duration of its stages with ``span()``. When no timer is active ``span()``
+does nothing, so instrumented code paths cost next to nothing outside of an
+instrumented operation.
+
+Collected timings are handed to the callable configured in
+``FILER_METRICS_HOOK`` (a dotted path), which is called as
+``hook(operation, timings)`` with ``timings`` mapping stage names to seconds.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .loader import load_object
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Timer(object):
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.timings = OrderedDict()
+        self.started = time.time()
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def add(self, stage, duration):
+        self.timings[stage] = self.timings.get(stage, 0.0) + duration
+
+    @contextmanager
+    def span(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+
+def get_current_timer():
+    return getattr(_local, 'timer', None)
+
+
+@contextmanager
+def span(stage):
+    """
+    Records the duration of ``stage`` on the current timer, if any.
+    """
+    timer = get_current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.span(stage):
+        yield
+
+
+@contextmanager
+def collect(operation):
+    """
+    Collects the spans of ``operation`` and reports them to the metrics hook.
+    Yields the ``Timer``, whose ``timings`` are complete once the block exits.
+    """
+    from .. import settings as filer_settings
+
+    previous = get_current_timer()
+    timer = _local.timer = Timer(operation)
+    try:
+        yield timer
+    finally:
+        timer.timings['total'] = timer.elapsed()
+        _local.timer = previous
+        hook = filer_settings.FILER_METRICS_HOOK
+        if hook:
+            try:
+                load_object(hook)(operation, timer.timings)
+            except Exception:
+                logger.exception('Error in metrics hook for %s', operation)
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to move and copy files between storages without loading them into
+memory.
+
+Files are streamed in chunks of ``CHUNK_SIZE`` bytes. When source and
+destination are on the same local filesystem the file is simply renamed, or
+copied by the kernel (hardlink if enabled, reflink, ``copy_file_range`` or
+``sendfile``). Other storage backends can provide a native (e.g. server side)
+move or copy by implementing::
+
+    def filer_move(self, name, dst_storage, dst_name):
+        # move ``name`` to ``dst_name`` in ``dst_storage`` and return the
+        # name it was saved under, or None if this pair of storages is not
+        # supported.
+
+    def filer_copy(self, name, dst_storage, dst_name):
+        # same as filer_move(), but keeps ``name``
+
+Storages sharing their backend with the storage of the other visibility (e.g.
+the same bucket) can make a file public or private without touching its data
+by implementing::
+
+    def filer_set_public(self, name, src_storage, is_public):
+        # make ``name`` of ``src_storage`` available through this storage
+        # (e.g. by flipping its ACL or renaming its prefix) and return its name
+        # in this storage, or None to move the data instead.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import errno
+import hashlib
+import os
+import posixpath
+import shutil
+
+from django.core.files.base import File as DjangoFile
+
+CHUNK_SIZE = 1024 * 1024
+
+# ioctl cloning a file on filesystems with copy on write support (btrfs, xfs)
+FICLONE = 0x40049409
+
+# errors meaning a copy strategy is not supported for this pair of files
+UNSUPPORTED_ERRNOS = set(
+    getattr(errno, code) for code in (
+        'EXDEV', 'EINVAL', 'ENOSYS', 'ENOTTY', 'EOPNOTSUPP', 'ENOTSUP',
+        'EPERM', 'EBADF', 'EMLINK', 'ENOTSOCK')
+    if hasattr(errno, code))
+
+
+class StorageError(IOError):
+    pass
+
+
+class DigestReader(object):
+    """
+    Read-only file-like wrapper computing the sha1 of the data read through it.
+    """
+
+    def __init__(self, file_obj, size=None):
+        self.file = file_obj
+        if size is not None:
+            self.size = size
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.sha1.update(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.file.seek(offset, whence)
+        if offset == 0 and whence == os.SEEK_SET:
+            self.sha1 = hashlib.sha1()
+
+    def tell(self):
+        return self.file.tell()
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
+
+def local_path(storage, name):
+    """
+    Returns the filesystem path of ``name`` if ``storage`` is a local storage.
+    """
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def iter_files(storage, path=''):
+    """
+    Yields the names of all files below ``path`` in ``storage``, listing one
+    directory at a time.
+    """
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        subdirectories, files = storage.listdir(directory)
+        for name in files:
+            yield posixpath.join(directory, name)
+        directories.extend(
+            posixpath.join(directory, name) for name in reversed(subdirectories))
+
+
+def file_digest(storage, name):
+    """
+    Returns the sha1 hexdigest of ``name`` in ``storage``, reading it in chunks.
+    """
+    sha = hashlib.sha1()
+    file_obj = storage.open(name, 'rb')
+    try:
+        while True:
+            data = file_obj.read(CHUNK_SIZE)
+            if not data:
+                break
+            sha.update(data)
+    finally:
+        file_obj.close()
+    return sha.hexdigest()
+
+
+def stream_copy(src_storage, src_name, dst_storage, dst_name):
+    """
+    Copies ``src_name`` to ``dst_storage`` in chunks. Returns a tuple of the
+    name the file was saved under and the sha1 of the copied data.
+    """
+    src_file = src_storage.open(src_name, 'rb')
+    try:
+        try:
+            size = src_storage.size(src_name)
+        except (NotImplementedError, OSError):
+            size = None
+        reader = DigestReader(src_file, size=size)
+        content = DjangoFile(reader, name=os.path.basename(dst_name))
+        content.DEFAULT_CHUNK_SIZE = CHUNK_SIZE
+        saved_name = dst_storage.save(dst_name, content)
+    finally:
+        src_file.close()
+    return saved_name, reader.hexdigest()
+
+
+def _rename(src_storage, src_name, dst_storage, dst_name):
+    src_path = local_path(src_storage, src_name)
+    if src_path is None or local_path(dst_storage, dst_name) is None:
+        return None
+    hardlink = True
+    while True:
+        dst_name = dst_storage.get_available_name(dst_name)
+        dst_path = dst_storage.path(dst_name)
+        directory = os.path.dirname(dst_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            if hardlink:
+                # unlike os.rename, os.link never replaces a file saved
+                # concurrently under the same name
+                try:
+                    os.link(src_path, dst_path)
+                    os.unlink(src_path)
+                    break
+                except OSError as e:
+                    if e.errno == errno.EXDEV:
+                        # different devices, fall back to copying
+                        return None
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    hardlink = False
+            # reserve the name with an exclusive create, the rename then
+            # only replaces our own empty file
+            os.close(os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                             getattr(os, 'O_BINARY', 0), 0o666))
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            raise
+        try:
+            os.rename(src_path, dst_path)
+        except OSError:
+            os.remove(dst_path)
+            raise
+        break
+    permissions = getattr(dst_storage, 'file_permissions_mode', None)
+    if permissions is not None:
+        os.chmod(dst_path, permissions)
+    return dst_name
+
+
+def _link(src_storage, src_name, dst_storage, dst_name):
+    src_path = local_path(src_storage, src_name)
+    if src_path is None or local_path(dst_storage, dst_name) is None:
+        return None
+    while True:
+        dst_name = dst_storage.get_available_name(dst_name)
+        dst_path = dst_storage.path(dst_name)
+        directory = os.path.dirname(dst_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            os.link(src_path, dst_path)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            if e.errno in UNSUPPORTED_ERRNOS:
+                return None
+            raise
+        return dst_name
+
+
+def copy_verified(src_storage, src_name, dst_storage, dst_name, sha1=None):
+    """
+    Like ``copy_file()``, but compares the digest of the copy to ``sha1`` (or
+    to the digest of the data read while streaming it). On a mismatch the copy
+    is removed again and ``StorageError`` is raised.
+    """
+    saved_name = None
+    streamed_digest = None
+    if hasattr(src_storage, 'filer_copy'):
+        saved_name = src_storage.filer_copy(src_name, dst_storage, dst_name)
+    if saved_name is None:
+        saved_name = _local_copy(src_storage, src_name, dst_storage, dst_name)
+    if saved_name is None:
+        saved_name, streamed_digest = stream_copy(
+            src_storage, src_name, dst_storage, dst_name)
+    expected = sha1 or streamed_digest
+    if expected:
+        actual = file_digest(dst_storage, saved_name)
+        if actual != expected:
+            dst_storage.delete(saved_name)
+            raise StorageError(
+                "Digest mismatch after copying '%s' to '%s': %s != %s" % (
+                    src_name, saved_name, actual, expected))
+    return saved_name
+
+
+def move_file(src_storage, src_name, dst_storage, dst_name, sha1=None,
+              verify=True):
+    """
+    Moves ``src_name`` from ``src_storage`` to ``dst_name`` in ``dst_storage``
+    and returns the name the file was saved under.
+
+    If ``verify`` is set and the data had to be copied, the digest of the moved
+    file is compared to ``sha1`` (or to the digest of the data read while
+    copying). On a mismatch a streamed copy is removed again, the source is
+    kept and ``StorageError`` is raised.
+    """
+    saved_name = None
+    streamed_digest = None
+    if hasattr(src_storage, 'filer_move'):
+        saved_name = src_storage.filer_move(src_name, dst_storage, dst_name)
+    else:
+        saved_name = _rename(src_storage, src_name, dst_storage, dst_name)
+        if saved_name is not None:
+            # a rename can't change the data, nothing to verify
+            return saved_name
+    if saved_name is None:
+        saved_name, streamed_digest = stream_copy(
+            src_storage, src_name, dst_storage, dst_name)
+    expected = sha1 or streamed_digest
+    if verify and expected:
+        actual = file_digest(dst_storage, saved_name)
+        if actual != expected:
+            if streamed_digest is not None:
+                dst_storage.delete(saved_name)
+            raise StorageError(
+                "Digest mismatch after moving '%s' to '%s': %s != %s" % (
+                    src_name, saved_name, actual, expected))
+    if streamed_digest is not None:
+        src_storage.delete(src_name)
+    return saved_name
+
+
+def change_visibility(src_storage, src_name, dst_storage, dst_name, is_public,
+                      sha1=None):
+    """
+    Moves ``src_name`` from the public to the private storage or the other way
+    round and returns its name in ``dst_storage``.
+
+    The destination storage's ``filer_set_public`` hook is tried first. With
+    ``FILER_METADATA_ONLY_VISIBILITY`` local files are renamed and other files
+    keep their name if ``dst_storage`` finds them under it (both storages
+    point to the same location). Otherwise, e.g. for files on another device,
+    the data is moved.
+    """
+    from .. import settings as filer_settings
+
+    if hasattr(dst_storage, 'filer_set_public'):
+        saved_name = dst_storage.filer_set_public(src_name, src_storage, is_public)
+        if saved_name is not None:
+            return saved_name
+    if filer_settings.FILER_METADATA_ONLY_VISIBILITY:
+        saved_name = _rename(src_storage, src_name, dst_storage, dst_name)
+        if saved_name is not None:
+            return saved_name
+        if dst_storage.exists(src_name):
+            return src_name
+    return move_file(src_storage, src_name, dst_storage, dst_name, sha1=sha1)
+
+
+def stage_visibility_change(src_storage, src_name, dst_storage, dst_name,
+                            sha1=None):
+    """
+    The first half of ``change_visibility()`` for changes which have to be
+    undone if the database transaction is rolled back: makes the file
+    available in ``dst_storage`` but leaves ``src_name`` in ``src_storage``.
+    Returns the name of the file in ``dst_storage`` and whether ``src_name``
+    has to be deleted once the transaction is committed.
+
+    Local files on the same filesystem are hardlinked, other files copied
+    and verified. With ``FILER_METADATA_ONLY_VISIBILITY`` files found under
+    their name in ``dst_storage`` (both storages point to the same location)
+    are left alone. ``filer_set_public`` hooks change the file in place and
+    can't be staged.
+    """
+    from .. import settings as filer_settings
+
+    saved_name = _link(src_storage, src_name, dst_storage, dst_name)
+    if saved_name is not None:
+        return saved_name, True
+    if filer_settings.FILER_METADATA_ONLY_VISIBILITY and dst_storage.exists(src_name):
+        return src_name, False
+    return copy_verified(src_storage, src_name, dst_storage, dst_name, sha1), True
+
+
+def _reflink(src_fd, dst_fd, size):
+    import fcntl
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if sent == 0:
+            break
+        copied += sent
+
+
+def _sendfile(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if sent == 0:
+            break
+        copied += sent
+
+
+def _copy_fileobj(src_fd, dst_fd, size):
+    with os.fdopen(os.dup(src_fd), 'rb') as src, \
+            os.fdopen(os.dup(dst_fd), 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def _kernel_copy_strategies():
+    strategies = []
+    try:
+        import fcntl  # noqa
+        strategies.append(_reflink)
+    except ImportError:
+        pass
+    if hasattr(os, 'copy_file_range'):
+        strategies.append(_copy_file_range)
+    if hasattr(os, 'sendfile'):
+        strategies.append(_sendfile)
+    return strategies
+
+
+def _copy_data(src_path, dst_fd):
+    src_fd = os.open(src_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        size = os.fstat(src_fd).st_size
+        for strategy in _kernel_copy_strategies():
+            try:
+                strategy(src_fd, dst_fd, size)
+                return
+            except (IOError, OSError) as e:
+                if e.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                # start over, the strategy may have written part of the data
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+        _copy_fileobj(src_fd, dst_fd, size)
+    finally:
+        os.close(src_fd)
+
+
+def _local_copy(src_storage, src_name, dst_storage, dst_name):
+    from .. import settings as filer_settings
+
+    src_path = local_path(src_storage, src_name)
+    if src_path is None or local_path(dst_storage, dst_name) is None:
+        return None
+    hardlink = filer_settings.FILER_HARDLINK_COPIES
+    while True:
+        dst_name = dst_storage.get_available_name(dst_name)
+        dst_path = dst_storage.path(dst_name)
+        directory = os.path.dirname(dst_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            if hardlink:
+                try:
+                    os.link(src_path, dst_path)
+                    # a hardlink shares permissions with the source
+                    return dst_name
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    hardlink = False
+            # exclusive create, like FileSystemStorage, to not overwrite a
+            # file saved concurrently under the same name
+            dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                             getattr(os, 'O_BINARY', 0), 0o666)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            raise
+        break
+    try:
+        _copy_data(src_path, dst_fd)
+    except Exception:
+        os.close(dst_fd)
+        os.remove(dst_path)
+        raise
+    os.close(dst_fd)
+    permissions = getattr(dst_storage, 'file_permissions_mode', None)
+    if permissions is not None:
+        os.chmod(dst_path, permissions)
+    return dst_name
+
+
+def copy_file(src_storage, src_name, dst_storage, dst_name):
+    """
+    Copies ``src_name`` from ``src_storage`` to ``dst_name`` in ``dst_storage``
+    and returns the name the copy was saved under.
+    """
+    saved_name = None
+    if hasattr(src_storage, 'filer_copy'):
+        saved_name = src_storage.filer_copy(src_name, dst_storage, dst_name)
+    if saved_name is None:
+        saved_name = _local_copy(src_storage, src_name, dst_storage, dst_name)
+    if saved_name is None:
+        saved_name = stream_copy(src_storage, src_name, dst_storage, dst_name)[0]
+    return saved_name
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Output formats of thumbnails.
+
+The ``format`` thumbnail option sets the format of a thumbnail by its file
+extension, e.g. ``{'size': (100, 100), 'format': 'webp'}``. Formats Pillow
+can't write (WebP needs libwebp, AVIF a plugin like ``pillow-avif-plugin``)
+are ignored, the thumbnail gets the default format then.
+
+Browsers announce the image formats they support in the ``Accept`` header.
+``negotiate_format()`` picks the first of the preferred formats (of a
+``ThumbnailOption``, or ``FILER_THUMBNAIL_FORMATS``) the browser accepts.
+Responses depending on it must vary on ``Accept``.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+from .compatibility import PILImage
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+
+
+def is_supported(image_format):
+    """
+    Returns whether Pillow can save images with the extension ``image_format``.
+    """
+    PILImage.init()
+    pil_format = PILImage.EXTENSION.get('.%s' % image_format.lower())
+    return pil_format is not None and pil_format in PILImage.SAVE
+
+
+def parse_formats(value):
+    """
+    Returns a list of formats from a comma separated string (or a list).
+    """
+    if not value:
+        return []
+    if not isinstance(value, (list, tuple)):
+        value = value.split(',')
+    return [image_format.strip().lower() for image_format in value if image_format.strip()]
+
+
+def get_accepted_types(request):
+    """
+    Returns the mime types listed in the ``Accept`` header of ``request``
+    (wildcards don't say anything about modern formats and are ignored).
+    """
+    accepted = set()
+    for item in request.META.get('HTTP_ACCEPT', '').split(','):
+        params = item.strip().split(';')
+        mime_type = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        if quality > 0 and mime_type and '*' not in mime_type:
+            accepted.add(mime_type)
+    return accepted
+
+
+def negotiate_format(request, formats=None):
+    """
+    Returns the first of ``formats`` (defaults to ``FILER_THUMBNAIL_FORMATS``)
+    which Pillow supports and the browser accepts, or None to use the default
+    format.
+    """
+    from .. import settings as filer_settings
+
+    if formats is None:
+        formats = filer_settings.FILER_THUMBNAIL_FORMATS
+    formats = parse_formats(formats)
+    if request is None or not formats:
+        return None
+    accepted = get_accepted_types(request)
+    for image_format in formats:
+        if MIME_TYPES.get(image_format) in accepted and is_supported(image_format):
+            return image_format
+    return None
+
+
+def with_format(thumbnail_options, image_format):
+    """
+    Returns a copy of ``thumbnail_options`` with the output format set to
+    ``image_format``.
+    """
+    thumbnail_options = dict(thumbnail_options)
+    if image_format:
+        thumbnail_options['format'] = image_format
+    return thumbnail_options
+
+
+def get_variant_name(thumbnail_name, image_format):
+    """
+    Returns the name of the thumbnail ``thumbnail_name`` in another format.
+    """
+    return '%s.%s' % (os.path.splitext(thumbnail_name)[0], image_format)
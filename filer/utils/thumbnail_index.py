@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+An index of the thumbnails in the thumbnail storages.
+
+To find out whether a thumbnail exists, easy-thumbnails runs two queries per
+thumbnail (or stats the source and the thumbnail on local storages), and
+probes the storage on cache misses if ``THUMBNAIL_CHECK_CACHE_MISS`` is set.
+With ``FILER_THUMBNAIL_INDEX_CACHE`` set, the names (and dimensions) of all
+thumbnails of a source file are kept in a single entry of that cache, keyed by
+the thumbnail storage and the source name:
+
+* a missing entry is loaded from the easy-thumbnails database cache with one
+  query,
+* thumbnails are added to the entry when they are saved,
+* the entry is removed when the thumbnails of the source are deleted.
+
+Like easy-thumbnails, thumbnails older than their source don't count: an entry
+records the modification time of the source it was loaded for, and is loaded
+again (without the older thumbnails) once the source changed.
+
+The ``filer_thumbnail_index`` management command rebuilds all entries from
+listings of the thumbnail storages.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+from easy_thumbnails.conf import settings as thumbnail_settings
+from easy_thumbnails.models import Thumbnail, ThumbnailDimensions
+from easy_thumbnails.utils import get_modified_time, get_storage_hash, is_storage_local
+
+KEY_PREFIX = 'filer:thumbnails:'
+
+
+def get_cache():
+    """
+    Returns the cache of the index, or None if it is disabled.
+    """
+    from .. import settings as filer_settings
+
+    if not filer_settings.FILER_THUMBNAIL_INDEX_CACHE:
+        return None
+    return caches[filer_settings.FILER_THUMBNAIL_INDEX_CACHE]
+
+
+def get_key(thumbnail_storage, source_name):
+    key = '%s:%s' % (get_storage_hash(thumbnail_storage), source_name)
+    return KEY_PREFIX + hashlib.sha1(force_bytes(key)).hexdigest()
+
+
+def get_modified_times(storage, names, model=Thumbnail):
+    """
+    Returns the modification times of ``names`` in ``storage`` by name, as
+    easy-thumbnails compares them: from the file system for local storages,
+    otherwise from its database cache (in one query, ``model`` is ``Source``
+    for source files). Names without a modification time are left out.
+    """
+    if is_storage_local(storage):
+        modified_times = ((name, get_modified_time(storage, name)) for name in names)
+    else:
+        modified_times = model.objects.filter(
+            storage_hash=get_storage_hash(storage), name__in=list(names),
+        ).values_list('name', 'modified')
+    return dict((name, modified) for name, modified in modified_times if modified)
+
+
+def load_entry(source_storage, source_name, thumbnail_storage, source_modtime):
+    """
+    Returns the thumbnails of ``source_name`` known to the easy-thumbnails
+    database cache, and not older than ``source_modtime``, as a dictionary of
+    ``(width, height)`` (or None) by name.
+    """
+    thumbnails = Thumbnail.objects.filter(
+        source__storage_hash=get_storage_hash(source_storage),
+        source__name=source_name,
+        storage_hash=get_storage_hash(thumbnail_storage),
+        modified__gte=source_modtime)
+    if thumbnail_settings.THUMBNAIL_CACHE_DIMENSIONS:
+        rows = thumbnails.values_list('name', 'dimensions__width', 'dimensions__height')
+    else:
+        rows = ((name, None, None) for name in thumbnails.values_list('name', flat=True))
+    return dict(
+        (name, (width, height) if width and height else None)
+        for name, width, height in rows)
+
+
+def get_entry(source_storage, source_name, thumbnail_storage, source_modtime):
+    """
+    Returns the thumbnails of ``source_name`` (modified at ``source_modtime``)
+    in ``thumbnail_storage`` (see ``load_entry()``), or None if the index is
+    disabled.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    key = get_key(thumbnail_storage, source_name)
+    entry = cache.get(key)
+    if entry is None or entry[0] != source_modtime:
+        # missing, or the source changed since
+        entry = (source_modtime, load_entry(
+            source_storage, source_name, thumbnail_storage, source_modtime))
+        cache.set(key, entry)
+    return entry[1]
+
+
+def add(source_name, thumbnail_storage, thumbnails):
+    """
+    Adds ``thumbnails`` (a dictionary of ``(width, height)`` by name) to the
+    entry of ``source_name``, if it exists.
+
+    Entries are not locked: a thumbnail lost by concurrent updates is looked
+    for in the storage again and re-added when it is generated next.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+    key = get_key(thumbnail_storage, source_name)
+    entry = cache.get(key)
+    if entry is not None:
+        entry[1].update(thumbnails)
+        cache.set(key, entry)
+
+
+def clear(thumbnail_storage, source_names):
+    """
+    Removes the entries of ``source_names`` from the index.
+    """
+    cache = get_cache()
+    if cache is not None and source_names:
+        cache.delete_many([get_key(thumbnail_storage, name) for name in source_names])
+
+
+def set_entries(thumbnail_storage, entries):
+    """
+    Replaces the entries of the sources in ``entries`` (a dictionary of
+    ``(source modification time, thumbnails)`` by source name, see
+    ``get_entry()``).
+    """
+    cache = get_cache()
+    if cache is not None and entries:
+        cache.set_many(dict(
+            (get_key(thumbnail_storage, name), thumbnails)
+            for name, thumbnails in entries.items()))
+
+
+class IndexedThumbnail(object):
+    """
+    The result of ``thumbnail_exists()`` for thumbnails found in the index,
+    providing their dimensions like a ``Thumbnail`` of the easy-thumbnails
+    database cache.
+    """
+
+    def __init__(self, size):
+        self.dimensions = ThumbnailDimensions(width=size[0], height=size[1]) if size else None
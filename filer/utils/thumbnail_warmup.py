@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Thumbnails of the ``ThumbnailOption`` presets, generated ahead of the first
+page view.
+
+With ``FILER_THUMBNAIL_WARMUP`` on, uploaded images get the thumbnails of all
+presets (in their default and preferred formats) from a job, processed in the
+background with ``FILER_BACKGROUND_JOBS`` (see ``filer.utils.jobs``). Saving
+a preset in the admin queues a job generating its thumbnails for the existing
+images, optionally only those in some folders. The progress of the jobs is
+shown on their admin progress page.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.utils.translation import ugettext as _
+
+from . import jobs
+from .bulk import get_folder_ids_recursive, on_commit
+from .thumbnail_formats import is_supported, with_format
+
+HANDLER = '%s.warm_up_job' % __name__
+
+# without FILER_BACKGROUND_JOBS, the admin refuses to generate the thumbnails
+# of a preset for more images during the request
+MAX_SYNCHRONOUS_IMAGES = 100
+
+
+def get_thumbnail_options(thumbnail_options):
+    """
+    Returns the thumbnails to generate for ``ThumbnailOption`` instances by
+    name, in the default format and in each preferred format.
+    """
+    required_thumbnails = {}
+    for option in thumbnail_options:
+        name = 'option_%s' % option.pk
+        required_thumbnails[name] = option.as_dict
+        for image_format in option.format_list:
+            if is_supported(image_format):
+                required_thumbnails['%s_%s' % (name, image_format)] = with_format(
+                    option.as_dict, image_format)
+    return required_thumbnails
+
+
+@jobs.batch_handler
+def warm_up_job(job, items):
+    """
+    Generates the thumbnails of the presets in the ``options`` argument (all
+    presets if it is None) for the images ``items``.
+    """
+    from ..models import BaseImage, File, ThumbnailOption
+
+    option_ids = job.get_arguments().get('options')
+    options = ThumbnailOption.objects.all()
+    if option_ids is not None:
+        options = options.filter(pk__in=option_ids)
+    required_thumbnails = get_thumbnail_options(options)
+    if not required_thumbnails:
+        return 0
+    count = 0
+    for image in File.objects.filter(pk__in=items):
+        if isinstance(image, BaseImage):
+            # one decode per image for all presets
+            image.get_thumbnail_urls(required_thumbnails, lazy=False)
+            count += 1
+    return count
+
+
+def warm_up_images(image_ids, owner=None):
+    """
+    Generates the thumbnails of all presets for the images ``image_ids``,
+    once the current transaction is committed. Returns nothing, the job may
+    not exist yet.
+    """
+    from ..models import ThumbnailOption
+
+    image_ids = list(image_ids)
+    if not image_ids or not ThumbnailOption.objects.exists():
+        return
+    title = _('Generating the thumbnails of %(count)d images') % {'count': len(image_ids)}
+    on_commit(lambda: jobs.submit(
+        HANDLER, image_ids, {'options': None}, owner=owner, title=title))
+
+
+def get_images(folders=None):
+    """
+    Returns the images (in ``folders`` and their subfolders, if given) to
+    generate the thumbnails of a preset for.
+    """
+    from .. import settings as filer_settings
+    from .loader import load_model
+
+    Image = load_model(filer_settings.FILER_IMAGE_MODEL)
+    images = Image.objects.exclude(file__isnull=True).exclude(file='')
+    if folders:
+        images = images.filter(folder__in=get_folder_ids_recursive(folders))
+    return images
+
+
+def warm_up_option(option, folders=None, owner=None):
+    """
+    Generates the thumbnails of the preset ``option`` for the existing images
+    (in ``folders`` and their subfolders, if given). Returns the job.
+    """
+    title = _('Generating the thumbnails of "%(option)s"') % {'option': option.name}
+    return jobs.submit(
+        HANDLER, get_images(folders).order_by('pk').values_list('pk', flat=True),
+        {'options': [option.pk]}, owner=owner, title=title)
@@ -56,6 +56,9 @@ HELPER_SETTINGS = {
         'filer.thumbnail_processors.scale_and_crop_with_subject_location',
         'easy_thumbnails.processors.filters',
     ),
+    'THUMBNAIL_SOURCE_GENERATORS': (
+        'filer.thumbnail_processors.reduced_pil_image',
+    ),
     'FILE_UPLOAD_TEMP_DIR': mkdtemp(),
     'TEMPLATE_DIRS': (os.path.join(BASE_DIR, 'django-filer', 'filer', 'test_utils', 'templates'),),
     'FILER_CANONICAL_URL': 'test-path/',